@@ -0,0 +1,31 @@
+# src/benchmarks/_common.py
+"""
+Helpers shared by the benchmark scripts.
+
+The scripts are run as `python benchmarks/<name>.py`, so this module is found next to them; importing it
+adds the src directory to the Python path, for the pipeline modules they benchmark.
+"""
+import json
+import os
+import sys
+import time
+
+SRC_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+# Add the src directory to the Python path
+if SRC_DIR not in sys.path:
+    sys.path.append(SRC_DIR)
+
+def load_config():
+    config_path = os.path.join(SRC_DIR, 'config', 'config.json')
+    with open(config_path, 'r') as file:
+        return json.load(file)
+
+def best_time(function, repeat):
+    """Run `function` `repeat` times and return (seconds of the fastest run, result of the last run)."""
+    timings = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - start_time)
+    return min(timings), result
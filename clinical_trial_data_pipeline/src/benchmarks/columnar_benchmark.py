@@ -0,0 +1,86 @@
+# src/benchmarks/columnar_benchmark.py
+"""
+Benchmark of the row-dict transform against the columnar (Arrow) transform over an archived run.
+
+The row path builds one dict per study (flatten_study + normalize_ages + a status filter list
+comprehension) and keeps every row, like the pipeline did before pages were streamed as record
+batches; the columnar path builds one record batch per page and filters it with an Arrow mask.
+Both paths decode the archived pages themselves, so the memory figure is what each keeps
+once the decoded pages are released, as in the pipeline.
+
+Usage:
+    python benchmarks/columnar_benchmark.py [RUN_DIR] [--repeat R]
+"""
+import argparse
+import tracemalloc
+
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from _common import best_time, load_config  # Also adds the src directory to the Python path
+
+from utils.age_utils import normalize_ages
+from utils.page_archive import PageArchive, latest_run_dir
+from utils.study_decoder import decode_page
+from utils.study_transform import DATE_COLUMNS, flatten_study, studies_record_batch
+
+def rows(raw_pages, target_statuses):
+    studies_data = []
+    for raw in raw_pages:
+        page = decode_page(raw)
+        page_rows = [flatten_study(study) for study in page.get('studies', [])]
+        normalize_ages(page_rows)
+        studies_data.extend(page_rows)
+    filtered_studies = [study for study in studies_data if study.get('overallStatus') in target_statuses]
+    return studies_data, filtered_studies
+
+def columnar(raw_pages, target_statuses):
+    value_set = pa.array(target_statuses, pa.string())
+    batches = [studies_record_batch(decode_page(raw).get('studies', [])) for raw in raw_pages]
+    filtered_batches = [batch.filter(pc.is_in(batch.column('overallStatus'), value_set=value_set)) for batch in batches]
+    return batches, filtered_batches
+
+def retained_bytes(function, raw_pages, target_statuses):
+    """Bytes held by the transform's result: Python objects (tracemalloc) plus Arrow buffers."""
+    arrow_before = pa.total_allocated_bytes()
+    tracemalloc.start()
+    result = function(raw_pages, target_statuses)
+    python_bytes, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    arrow_bytes = pa.total_allocated_bytes() - arrow_before
+    del result
+    return python_bytes + arrow_bytes
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('run_dir', nargs='?', help='Archived run directory (default: latest run in archive_dir)')
+    parser.add_argument('--repeat', type=int, default=3, help='Timed repetitions, the best one is reported')
+    args = parser.parse_args()
+
+    config = load_config()
+    target_statuses = config.get('target_statuses')
+    run_dir = args.run_dir or latest_run_dir(config.get('archive_dir'))
+    raw_pages = list(PageArchive(run_dir).iter_raw_pages())
+
+    studies_data, filtered_studies = rows(raw_pages, target_statuses)
+    batches, filtered_batches = columnar(raw_pages, target_statuses)
+    # The columnar path parses the dates into DATE columns, the other columns must match the row dicts
+    compared = [column for column in studies_data[0] if column not in DATE_COLUMNS]
+    assert pa.Table.from_batches(batches).select(compared).to_pylist() == [
+        {column: study[column] for column in compared} for study in studies_data
+    ], 'both transforms must produce the same rows'
+    assert sum(batch.num_rows for batch in filtered_batches) == len(filtered_studies)
+    studies = len(studies_data)
+    del studies_data, filtered_studies, batches, filtered_batches
+
+    rows_seconds, _ = best_time(lambda: rows(raw_pages, target_statuses), args.repeat)
+    columnar_seconds, _ = best_time(lambda: columnar(raw_pages, target_statuses), args.repeat)
+    rows_bytes = retained_bytes(rows, raw_pages, target_statuses)
+    columnar_bytes = retained_bytes(columnar, raw_pages, target_statuses)
+    print(f'{run_dir}: {len(raw_pages)} pages, {studies} studies')
+    print(f"{'row dicts:':<16}{studies / rows_seconds:>10.0f} studies/s {rows_bytes / 1e6:>10.1f} MB")
+    print(f"{'record batches:':<16}{studies / columnar_seconds:>10.0f} studies/s {columnar_bytes / 1e6:>10.1f} MB")
+    print(f'Speedup: {rows_seconds / columnar_seconds:.2f}x, memory: {rows_bytes / columnar_bytes:.1f}x smaller')
+
+if __name__ == "__main__":
+    main()
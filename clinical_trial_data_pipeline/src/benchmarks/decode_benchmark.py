@@ -0,0 +1,48 @@
+# src/benchmarks/decode_benchmark.py
+"""
+Micro-benchmark of decode + flatten throughput on one archived page of studies.
+
+Compares the original path (json.loads of the whole document, then flatten_study) with
+decode_page (typed msgspec decoding of only the consumed fields, then flatten_study).
+
+Usage:
+    python benchmarks/decode_benchmark.py [RUN_DIR] [--page N] [--repeat R]
+"""
+import argparse
+import json
+
+from _common import best_time, load_config  # Also adds the src directory to the Python path
+
+from utils.page_archive import PageArchive, latest_run_dir
+from utils.study_decoder import decode_page, msgspec, orjson
+from utils.study_transform import flatten_study
+
+def baseline(raw):
+    return [flatten_study(study) for study in json.loads(raw)['studies']]
+
+def fast(raw):
+    return [flatten_study(study) for study in decode_page(raw)['studies']]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('run_dir', nargs='?', help='Archived run directory (default: latest run in archive_dir)')
+    parser.add_argument('--page', type=int, default=1, help='Archived page number to decode')
+    parser.add_argument('--repeat', type=int, default=5, help='Timed repetitions, the best one is reported')
+    args = parser.parse_args()
+
+    run_dir = args.run_dir or latest_run_dir(load_config().get('archive_dir'))
+    raw = next(raw for number, raw in enumerate(PageArchive(run_dir).iter_raw_pages(), start=1) if number == args.page)
+
+    studies = len(baseline(raw))
+    assert baseline(raw) == fast(raw), 'decode_page must produce the same rows as json.loads'
+
+    parser_name = 'msgspec' if msgspec is not None else ('orjson' if orjson is not None else 'json')
+    baseline_seconds, _ = best_time(lambda: baseline(raw), args.repeat)
+    fast_seconds, _ = best_time(lambda: fast(raw), args.repeat)
+    print(f'Page {args.page} of {run_dir}: {studies} studies, {len(raw) / 1e6:.2f} MB')
+    print(f"{'json.loads + flatten:':<34}{studies / baseline_seconds:>10.0f} studies/s")
+    print(f"{f'decode_page ({parser_name}) + flatten:':<34}{studies / fast_seconds:>10.0f} studies/s")
+    print(f'Speedup: {baseline_seconds / fast_seconds:.2f}x')
+
+if __name__ == "__main__":
+    main()
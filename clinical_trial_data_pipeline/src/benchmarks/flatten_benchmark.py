@@ -0,0 +1,82 @@
+# src/benchmarks/flatten_benchmark.py
+"""
+Per-study flatten cost of the flattener compiled from STUDY_MAPPING, compared with the
+hand-written loop it replaced, on the studies of one archived page.
+
+Usage:
+    python benchmarks/flatten_benchmark.py [RUN_DIR] [--page N] [--repeat R]
+"""
+import argparse
+
+from _common import best_time, load_config  # Also adds the src directory to the Python path
+
+from utils.page_archive import PageArchive, latest_run_dir
+from utils.study_transform import flatten_study
+
+def hand_written_flatten_study(study):
+    # The loop body main.py and data/studies_extract.py used before STUDY_MAPPING
+    nctId = study['protocolSection']['identificationModule'].get('nctId', 'Unknown')
+    overallStatus = study['protocolSection']['statusModule'].get('overallStatus', 'Unknown')
+    startDate = study['protocolSection']['statusModule'].get('startDateStruct', {}).get('date', 'Unknown Date')
+    conditions = ', '.join(study['protocolSection'].get('conditionsModule', {}).get('conditions', ['No conditions listed']))
+    briefTitle = study['protocolSection']['identificationModule'].get('briefTitle', 'Unknown')
+    acronym = study['protocolSection']['identificationModule'].get('acronym', 'Unknown')
+    interventions_list = study['protocolSection'].get('armsInterventionsModule', {}).get('interventions', [])
+    interventions = ', '.join([intervention.get('name', 'No intervention name listed') for intervention in interventions_list]) if interventions_list else "No interventions listed"
+    locations_list = study['protocolSection'].get('contactsLocationsModule', {}).get('locations', [])
+    locations = ', '.join([f"{location.get('city', 'No City')} - {location.get('country', 'No Country')}" for location in locations_list]) if locations_list else "No locations listed"
+    primaryCompletionDate = study['protocolSection']['statusModule'].get('primaryCompletionDateStruct', {}).get('date', 'Unknown Date')
+    studyFirstPostDate = study['protocolSection']['statusModule'].get('studyFirstPostDateStruct', {}).get('date', 'Unknown Date')
+    lastUpdatePostDate = study['protocolSection']['statusModule'].get('lastUpdatePostDateStruct', {}).get('date', 'Unknown Date')
+    studyType = study['protocolSection'].get('designModule', {}).get('studyType', 'Unknown')
+    phases = ', '.join(study['protocolSection'].get('designModule', {}).get('phases', ['Not Available']))
+    eligibilityCriteria = study['protocolSection'].get('eligibilityModule', {}).get('eligibilityCriteria', 'Unknown')
+    sex = study['protocolSection'].get('eligibilityModule', {}).get('sex', 'Unknown')
+    minimumAge = study['protocolSection'].get('eligibilityModule', {}).get('minimumAge', '0 Year')
+    maximumAge = study['protocolSection'].get('eligibilityModule', {}).get('maximumAge', '120 Years')
+    stdAges = study['protocolSection'].get('eligibilityModule', {}).get('stdAges', 'Unknown')
+    return {
+        'nctId': nctId, 'briefTitle': briefTitle, 'acronym': acronym, 'overallStatus': overallStatus,
+        'startDate': startDate, 'conditions': conditions, 'interventions': interventions, 'locations': locations,
+        'primaryCompletionDate': primaryCompletionDate, 'studyFirstPostDate': studyFirstPostDate,
+        'lastUpdatePostDate': lastUpdatePostDate, 'studyType': studyType, 'phases': phases,
+        'eligibilityCriteria': eligibilityCriteria, 'sex': sex, 'minimumAge': minimumAge,
+        'maximumAge': maximumAge, 'stdAges': stdAges
+    }
+
+def expected_row(study):
+    """
+    The hand-written row as the studies table stores it now: stdAges used to be loaded as a list, into
+    the dlt child table studies__std_ages, and is now one column joined like conditions.
+    """
+    row = hand_written_flatten_study(study)
+    if isinstance(row['stdAges'], list):
+        row['stdAges'] = ', '.join(row['stdAges'])
+    return row
+
+def flatten_all(flatten, studies):
+    for study in studies:
+        flatten(study)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('run_dir', nargs='?', help='Archived run directory (default: latest run in archive_dir)')
+    parser.add_argument('--page', type=int, default=1, help='Archived page number to flatten')
+    parser.add_argument('--repeat', type=int, default=5, help='Timed repetitions, the best one is reported')
+    args = parser.parse_args()
+
+    run_dir = args.run_dir or latest_run_dir(load_config().get('archive_dir'))
+    page = next(page for number, page in enumerate(PageArchive(run_dir).iter_pages(), start=1) if number == args.page)
+    studies = page['studies']
+
+    mismatches = sum(flatten_study(study) != expected_row(study) for study in studies)
+    assert mismatches == 0, f'{mismatches} of {len(studies)} rows differ from the hand-written loop'
+    hand_written_seconds, _ = best_time(lambda: flatten_all(hand_written_flatten_study, studies), args.repeat)
+    compiled_seconds, _ = best_time(lambda: flatten_all(flatten_study, studies), args.repeat)
+    print(f'Page {args.page} of {run_dir}: {len(studies)} studies, identical rows from both flatteners')
+    print(f"{'hand-written flatten:':<24}{hand_written_seconds / len(studies) * 1e6:>8.2f} us/study")
+    print(f"{'compiled STUDY_MAPPING:':<24}{compiled_seconds / len(studies) * 1e6:>8.2f} us/study")
+    print(f'Speedup: {hand_written_seconds / compiled_seconds:.2f}x')
+
+if __name__ == "__main__":
+    main()
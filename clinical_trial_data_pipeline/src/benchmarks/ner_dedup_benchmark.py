@@ -0,0 +1,58 @@
+# src/benchmarks/ner_dedup_benchmark.py
+"""
+NER time saved by running the model on the distinct lines of eligibility criteria instead of on whole criteria.
+
+The criteria are sampled with a fixed seed from the studies of an archived run, and run through the
+NER model whole (document level), then split into normalized lines of which each distinct line runs
+through the model once. Reports the dedup ratio (lines per distinct line), the NER time of both, and
+how many criteria get the same highest-scoring disease and medication either way.
+
+Usage:
+    python benchmarks/ner_dedup_benchmark.py [RUN_DIR] [--sample N] [--batch-size B] [--model MODEL]
+"""
+import argparse
+import time
+
+from _common import load_config  # Also adds the src directory to the Python path
+
+from benchmarks.ner_window_benchmark import sample_criteria
+from models.entity_extractor import EntityExtractor
+from models.line_dedup import LineDedupEntityExtractor
+from utils.page_archive import latest_run_dir
+from utils.run_metrics import RunMetrics
+
+def timed_extraction(extractor, texts, batch_size):
+    start_time = time.perf_counter()
+    extracted = extractor.extract_many(texts, batch_size=batch_size)
+    return time.perf_counter() - start_time, extracted
+
+def main():
+    config = load_config()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('run_dir', nargs='?', help='Archived run directory (default: latest run in archive_dir)')
+    parser.add_argument('--sample', type=int, default=500, help='Number of eligibility criteria sampled')
+    parser.add_argument('--batch-size', type=int, default=config.get('ner_batch_size', 16), help='NER batch size')
+    parser.add_argument('--model', default='Clinical-AI-Apollo/Medical-NER', help='Token classification model')
+    args = parser.parse_args()
+
+    run_dir = args.run_dir or latest_run_dir(config.get('archive_dir'))
+    texts = sample_criteria(run_dir, args.sample)
+    extractor = EntityExtractor(model_name=args.model, max_tokens=config.get('ner_max_tokens', 512),
+                                window_overlap=config.get('ner_window_overlap', 128))
+    metrics = RunMetrics()
+    line_dedup = LineDedupEntityExtractor(extractor, metrics)
+
+    document_seconds, document_entities = timed_extraction(extractor, texts, args.batch_size)
+    line_seconds, line_entities = timed_extraction(line_dedup, texts, args.batch_size)
+    same = sum(first == second for first, second in zip(document_entities, line_entities))
+
+    lines, distinct_lines = metrics.get('ner_lines'), metrics.get('ner_distinct_lines')
+    print(f'{run_dir}: {len(texts)} criteria, {lines} lines, {distinct_lines} distinct '
+          f'({lines / max(distinct_lines, 1):.1f}x dedup ratio)')
+    print(f"{'document:':<12}{document_seconds:>8.2f} s {len(texts) / document_seconds:>8.1f} criteria/s")
+    print(f"{'line dedup:':<12}{line_seconds:>8.2f} s {len(texts) / line_seconds:>8.1f} criteria/s  "
+          f'{1 - line_seconds / document_seconds:.1%} NER time saved')
+    print(f'Same highest-scoring disease and medication for {same} of {len(texts)} criteria')
+
+if __name__ == "__main__":
+    main()
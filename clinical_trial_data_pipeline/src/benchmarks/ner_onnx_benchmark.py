@@ -0,0 +1,71 @@
+# src/benchmarks/ner_onnx_benchmark.py
+"""
+Accuracy and throughput of the ONNX Runtime NER backends against the PyTorch pipeline, over a fixed sample of
+eligibility criteria.
+
+The sampled criteria are run through the NER model with PyTorch, then through its ONNX export with ONNX
+Runtime, in float32 and with int8-quantized weights (exported to --onnx-dir on first use). Taking the PyTorch
+entities as reference, each backend reports the F1 of its (type, word) entities and the share of criteria
+with the same highest-scoring disease and medication.
+
+Usage:
+    python benchmarks/ner_onnx_benchmark.py [RUN_DIR] [--sample N] [--batch-size B] [--onnx-dir DIR] [--model MODEL]
+"""
+import argparse
+import time
+
+from _common import load_config  # Also adds the src directory to the Python path
+
+from benchmarks.ner_window_benchmark import entity_words, sample_criteria
+from models.entity_extractor import EntityExtractor
+from utils.page_archive import latest_run_dir
+
+TARGET_ENTITIES = ['DISEASE_DISORDER', 'MEDICATION']
+
+def timed_entities(extractor, texts, batch_size):
+    # Warm up (thread pools, memory arenas) on the first batch, as the pipeline reuses one extractor for the run
+    extractor.find_entities(texts[:batch_size], batch_size)
+    start_time = time.perf_counter()
+    found = extractor.find_entities(texts, batch_size)
+    return time.perf_counter() - start_time, found
+
+def main():
+    config = load_config()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('run_dir', nargs='?', help='Archived run directory (default: latest run in archive_dir)')
+    parser.add_argument('--sample', type=int, default=500, help='Number of eligibility criteria sampled')
+    parser.add_argument('--batch-size', type=int, default=config.get('ner_batch_size', 16), help='NER batch size')
+    parser.add_argument('--onnx-dir', default=config.get('ner_onnx_dir'), help='Directory caching the ONNX exports')
+    parser.add_argument('--model', default='Clinical-AI-Apollo/Medical-NER', help='Token classification model')
+    args = parser.parse_args()
+
+    run_dir = args.run_dir or latest_run_dir(config.get('archive_dir'))
+    texts = sample_criteria(run_dir, args.sample)
+    extractor_kwargs = dict(model_name=args.model, max_tokens=config.get('ner_max_tokens', 512),
+                            window_overlap=config.get('ner_window_overlap', 128), onnx_dir=args.onnx_dir)
+    backends = {
+        'torch': EntityExtractor(**extractor_kwargs),
+        'onnx': EntityExtractor(backend='onnx', **extractor_kwargs),
+        'onnx int8': EntityExtractor(backend='onnx', quantize=True, **extractor_kwargs),
+    }
+
+    print(f'{run_dir}: {len(texts)} criteria')
+    reference_seconds, reference_found = timed_entities(backends.pop('torch'), texts, args.batch_size)
+    reference_words = [entity_words(entities) for entities in reference_found]
+    reference_top = [EntityExtractor.highest_scoring_entities(entities, TARGET_ENTITIES) for entities in reference_found]
+    print(f"{'torch:':<12}{len(texts) / reference_seconds:>8.1f} criteria/s")
+
+    for name, extractor in backends.items():
+        seconds, found = timed_entities(extractor, texts, args.batch_size)
+        words = [entity_words(entities) for entities in found]
+        matched = sum(len(first & second) for first, second in zip(words, reference_words))
+        precision = matched / max(sum(map(len, words)), 1)
+        recall = matched / max(sum(map(len, reference_words)), 1)
+        f1 = 2 * precision * recall / max(precision + recall, 1e-9)
+        same_top = sum(EntityExtractor.highest_scoring_entities(entities, TARGET_ENTITIES) == top
+                       for entities, top in zip(found, reference_top))
+        print(f"{f'{name}:':<12}{len(texts) / seconds:>8.1f} criteria/s  {reference_seconds / seconds:.2f}x  "
+              f'entity F1 {f1:.3f}, same highest-scoring entities for {same_top / len(texts):.1%}')
+
+if __name__ == "__main__":
+    main()
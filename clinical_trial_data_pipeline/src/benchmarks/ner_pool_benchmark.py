@@ -0,0 +1,59 @@
+# src/benchmarks/ner_pool_benchmark.py
+"""
+Scaling benchmark of the NER worker pool over a fixed sample of eligibility criteria.
+
+Extracts the entities of the sampled criteria in process (torch using every core), then with
+1, 2, 4, ... worker processes (up to --max-workers), each using its share of the cores, and
+reports the throughput and the speedup over the in-process extractor.
+
+Usage:
+    python benchmarks/ner_pool_benchmark.py [RUN_DIR] [--sample N] [--batch-size B] [--max-workers W] [--model MODEL]
+"""
+import argparse
+import os
+import time
+
+from _common import load_config  # Also adds the src directory to the Python path
+
+from benchmarks.ner_window_benchmark import sample_criteria
+from models.entity_extractor import EntityExtractor
+from models.ner_pool import EntityExtractorPool
+from utils.page_archive import latest_run_dir
+
+def timed_extraction(extractor, texts, batch_size):
+    start_time = time.perf_counter()
+    extracted = extractor.extract_many(texts, batch_size=batch_size)
+    return time.perf_counter() - start_time, extracted
+
+def main():
+    config = load_config()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('run_dir', nargs='?', help='Archived run directory (default: latest run in archive_dir)')
+    parser.add_argument('--sample', type=int, default=500, help='Number of eligibility criteria sampled')
+    parser.add_argument('--batch-size', type=int, default=config.get('ner_batch_size', 16), help='NER batch size')
+    parser.add_argument('--max-workers', type=int, default=os.cpu_count(), help='Largest pool size measured')
+    parser.add_argument('--model', default='Clinical-AI-Apollo/Medical-NER', help='Token classification model')
+    args = parser.parse_args()
+
+    run_dir = args.run_dir or latest_run_dir(config.get('archive_dir'))
+    texts = sample_criteria(run_dir, args.sample)
+    extractor_kwargs = dict(model_name=args.model, max_tokens=config.get('ner_max_tokens', 512),
+                            window_overlap=config.get('ner_window_overlap', 128))
+
+    baseline_seconds, expected = timed_extraction(EntityExtractor(**extractor_kwargs), texts, args.batch_size)
+    print(f'{run_dir}: {len(texts)} criteria, {os.cpu_count()} cores')
+    print(f"{'in process:':<14}{len(texts) / baseline_seconds:>10.1f} criteria/s")
+
+    workers = 1
+    while workers <= args.max_workers:
+        pool = EntityExtractorPool(workers, **extractor_kwargs)
+        # Load the model in every worker before timing, as the pipeline reuses one pool for the whole run
+        pool.extract_many(texts[:workers * args.batch_size], batch_size=args.batch_size)
+        seconds, extracted = timed_extraction(pool, texts, args.batch_size)
+        pool.shutdown()
+        assert extracted == expected, 'the pool must extract the same entities as the in-process extractor'
+        print(f"{f'{workers} workers:':<14}{len(texts) / seconds:>10.1f} criteria/s  {baseline_seconds / seconds:.2f}x")
+        workers *= 2
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+# src/benchmarks/ner_window_benchmark.py
+"""
+Throughput and recall of sliding-window NER against truncated NER, over a fixed sample of eligibility criteria.
+
+The criteria are sampled with a fixed seed from the studies of an archived run. Each sample is run
+through the NER model twice: truncated to its first window of tokens, as the pipeline did before
+long criteria were split into windows, and split into overlapping windows. Recall is the share of
+the (type, word) entities found with windows that truncation finds as well.
+
+Usage:
+    python benchmarks/ner_window_benchmark.py [RUN_DIR] [--sample N] [--batch-size B]
+                                              [--max-tokens T] [--window-overlap O] [--model MODEL]
+"""
+import argparse
+import random
+import time
+
+from _common import load_config  # Also adds the src directory to the Python path
+
+from models.entity_extractor import EntityExtractor
+from utils.page_archive import PageArchive, latest_run_dir
+from utils.study_transform import STUDIES_TABLE, transform_pages
+
+def sample_criteria(run_dir, sample, seed=0):
+    criteria = []
+    for table, batch in transform_pages(PageArchive(run_dir).iter_pages()):
+        if table == STUDIES_TABLE:
+            criteria.extend(batch.column('eligibilityCriteria').to_pylist())
+    return random.Random(seed).sample(criteria, min(sample, len(criteria)))
+
+def timed_entities(extractor, texts, batch_size):
+    start_time = time.perf_counter()
+    found = extractor.find_entities(texts, batch_size)
+    return time.perf_counter() - start_time, found
+
+def entity_words(entities):
+    return {(entity['entity_group'], entity['word'].strip().lower()) for entity in entities}
+
+def main():
+    config = load_config()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('run_dir', nargs='?', help='Archived run directory (default: latest run in archive_dir)')
+    parser.add_argument('--sample', type=int, default=500, help='Number of eligibility criteria sampled')
+    parser.add_argument('--batch-size', type=int, default=config.get('ner_batch_size', 16), help='NER batch size')
+    parser.add_argument('--max-tokens', type=int, default=config.get('ner_max_tokens', 512), help='Tokens per window')
+    parser.add_argument('--window-overlap', type=int, default=config.get('ner_window_overlap', 128),
+                        help='Tokens shared by consecutive windows')
+    parser.add_argument('--model', default='Clinical-AI-Apollo/Medical-NER', help='Token classification model')
+    args = parser.parse_args()
+
+    run_dir = args.run_dir or latest_run_dir(config.get('archive_dir'))
+    texts = sample_criteria(run_dir, args.sample)
+    truncated = EntityExtractor(model_name=args.model, max_tokens=args.max_tokens, window_overlap=None)
+    windowed = EntityExtractor(model_name=args.model, max_tokens=args.max_tokens, window_overlap=args.window_overlap)
+    token_ids = windowed.pipe.tokenizer(texts, verbose=False)['input_ids']
+    long_texts = sum(len(text_token_ids) > args.max_tokens for text_token_ids in token_ids)
+
+    truncated_seconds, truncated_found = timed_entities(truncated, texts, args.batch_size)
+    windowed_seconds, windowed_found = timed_entities(windowed, texts, args.batch_size)
+    windowed_words = [entity_words(entities) for entities in windowed_found]
+    truncated_words = [entity_words(entities) for entities in truncated_found]
+    recalled = sum(len(words & first_window_words) for words, first_window_words in zip(windowed_words, truncated_words))
+    total = sum(len(words) for words in windowed_words)
+    changed = sum(
+        truncated.highest_scoring_entities(first, ['DISEASE_DISORDER', 'MEDICATION'])
+        != windowed.highest_scoring_entities(second, ['DISEASE_DISORDER', 'MEDICATION'])
+        for first, second in zip(truncated_found, windowed_found)
+    )
+
+    print(f'{run_dir}: {len(texts)} criteria, {long_texts} longer than {args.max_tokens} tokens')
+    print(f"{'truncated:':<12}{len(texts) / truncated_seconds:>8.1f} criteria/s {sum(map(len, truncated_words)):>8} entities")
+    print(f"{'windowed:':<12}{len(texts) / windowed_seconds:>8.1f} criteria/s {total:>8} entities")
+    print(f'Recall of truncation: {recalled / max(total, 1):.1%}, '
+          f'highest-scoring disease or medication changed for {changed} criteria')
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+# src/benchmarks/parallel_benchmark.py
+"""
+Scaling benchmark of the process-pool transform over an archived run.
+
+Decodes, flattens and age-normalizes every archived page with 1, 2, 4, ... worker processes
+(up to --max-workers) and reports the throughput and the speedup over the in-process transform.
+
+Usage:
+    python benchmarks/parallel_benchmark.py [RUN_DIR] [--max-workers N] [--repeat R]
+"""
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from _common import best_time, load_config  # Also adds the src directory to the Python path
+
+from utils.page_archive import PageArchive, latest_run_dir
+from utils.parallel_transform import parallel_transform_pages, transform_raw_page
+from utils.study_transform import STUDIES_TABLE
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('run_dir', nargs='?', help='Archived run directory (default: latest run in archive_dir)')
+    parser.add_argument('--max-workers', type=int, default=os.cpu_count(), help='Largest pool size measured')
+    parser.add_argument('--repeat', type=int, default=3, help='Timed repetitions, the best one is reported')
+    args = parser.parse_args()
+
+    run_dir = args.run_dir or latest_run_dir(load_config().get('archive_dir'))
+    raw_pages = list(PageArchive(run_dir).iter_raw_pages())
+
+    baseline_seconds, studies = best_time(lambda: sum(transform_raw_page(raw)[0][1].num_rows for raw in raw_pages), args.repeat)
+    print(f'{run_dir}: {len(raw_pages)} pages, {studies} studies, {os.cpu_count()} cores')
+    print(f"{'in process:':<14}{studies / baseline_seconds:>10.0f} studies/s")
+
+    workers = 1
+    while workers <= args.max_workers:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # Start the workers before timing, as the pipeline reuses one pool for the whole run
+            list(executor.map(int, range(workers)))
+            seconds, _ = best_time(
+                lambda: sum(batch.num_rows for table, batch in parallel_transform_pages(executor, raw_pages, workers * 2)
+                            if table == STUDIES_TABLE),
+                args.repeat
+            )
+        print(f"{f'{workers} workers:':<14}{studies / seconds:>10.0f} studies/s  {baseline_seconds / seconds:.2f}x")
+        workers *= 2
+
+if __name__ == "__main__":
+    main()
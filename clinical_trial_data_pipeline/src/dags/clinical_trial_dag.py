@@ -40,11 +40,15 @@ run_main_script = BashOperator(
     bash_command='pip install tqdm && \
         pip install dlt && \
         pip install dlt[duckdb] && \
+        pip install pyarrow && \
+        pip install msgspec && \
         pip install transformers && \
         pip install openai && \
         pip install torch && \
+        pip install onnxruntime && \
+        pip install onnx && \
         ls /opt/airflow/src/data/ && \
-        python /opt/airflow/src/main.py',
+        python /opt/airflow/src/main.py --incremental',
     dag=parent_dag,
 )
 
@@ -18,6 +18,8 @@ import duckdb
 
 # Ensure the 'models' directory is in the Python path
 sys.path.append(os.path.abspath(os.path.join(os.getcwd(), '..', 'models')))
+# Add the src directory to the Python path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 """
 Using Hugging Face Model Clinical-AI-Apollo/Medical-NER instead of GPT-3.5
@@ -25,6 +27,7 @@ due to the cost I will incur if use OpenAI, as I pull all the studies from
 clinicaltrials.gov
 """
 from entity_extractor import EntityExtractor 
+from utils.study_transform import flatten_study
 
 # Data Pipeline
 
@@ -100,62 +103,8 @@ logger.info(f'Total elapsed time: {minutes} minutes and {seconds:.2f} seconds')
 # Start timer
 start_time = time.time()
 
-# Initialize an empty list to store the data
-studies_data = []
-
-# Loop for storing data with progress bar
-for study in tqdm(studies, desc="Processing studies"):
-    # Safely access nested keys
-    nctId = study['protocolSection']['identificationModule'].get('nctId', 'Unknown')
-    overallStatus = study['protocolSection']['statusModule'].get('overallStatus', 'Unknown')
-    startDate = study['protocolSection']['statusModule'].get('startDateStruct', {}).get('date', 'Unknown Date')
-    conditions = ', '.join(study['protocolSection'].get('conditionsModule',{}).get('conditions', ['No conditions listed']))
-    briefTitle = study['protocolSection']['identificationModule'].get('briefTitle', 'Unknown')
-    acronym = study['protocolSection']['identificationModule'].get('acronym', 'Unknown')
-
-    # Extract interventions safely
-    interventions_list = study['protocolSection'].get('armsInterventionsModule', {}).get('interventions', [])
-    interventions = ', '.join([intervention.get('name', 'No intervention name listed') for intervention in interventions_list]) if interventions_list else "No interventions listed"
-
-    # Extract locations safely
-    locations_list = study['protocolSection'].get('contactsLocationsModule', {}).get('locations', [])
-    locations = ', '.join([f"{location.get('city', 'No City')} - {location.get('country', 'No Country')}" for location in locations_list]) if locations_list else "No locations listed"
-
-    # Extract dates and phases
-    primaryCompletionDate = study['protocolSection']['statusModule'].get('primaryCompletionDateStruct', {}).get('date', 'Unknown Date')
-    studyFirstPostDate = study['protocolSection']['statusModule'].get('studyFirstPostDateStruct', {}).get('date', 'Unknown Date')
-    lastUpdatePostDate = study['protocolSection']['statusModule'].get('lastUpdatePostDateStruct', {}).get('date', 'Unknown Date')
-    studyType = study['protocolSection'].get('designModule',{}).get('studyType', 'Unknown')
-    phases = ', '.join(study['protocolSection'].get('designModule',{}).get('phases', ['Not Available']))
-
-    # Extract Eligibility
-    eligibilityCriteria = study['protocolSection'].get('eligibilityModule',{}).get('eligibilityCriteria','Unknown')
-    sex = study['protocolSection'].get('eligibilityModule',{}).get('sex','Unknown')
-    minimumAge = study['protocolSection'].get('eligibilityModule',{}).get('minimumAge','0 Year')
-    maximumAge = study['protocolSection'].get('eligibilityModule',{}).get('maximumAge','120 Years')
-    stdAges = study['protocolSection'].get('eligibilityModule',{}).get('stdAges','Uknown')
-
-    # Extend the data to the list as a dictionary
-    studies_data.append({
-        'nctId' : nctId,
-        'briefTitle' : briefTitle,
-        'acronym' : acronym,
-        'overallStatus' : overallStatus,
-        'startDate' : startDate,
-        'conditions' : conditions,
-        'interventions' : interventions,
-        'locations' : locations,
-        'primaryCompletionDate' : primaryCompletionDate,
-        'studyFirstPostDate' : studyFirstPostDate,
-        'lastUpdatePostDate' : lastUpdatePostDate,
-        'studyType' : studyType,
-        'phases' : phases,
-        'eligibilityCriteria' : eligibilityCriteria,
-        'sex' : sex,
-        'minimumAge' : minimumAge,
-        'maximumAge' : maximumAge,
-        'stdAges' : stdAges
-    })
+# Flatten every study with the flattener compiled from STUDY_MAPPING, shared with main.py
+studies_data = [flatten_study(study) for study in tqdm(studies, desc="Processing studies")]
 
 # End timer
 end_time = time.time()
@@ -1,14 +1,35 @@
 # src/main.py
+import argparse
+import itertools
 import json
 import os
 import sys
 import time
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+import pyarrow as pa
+import pyarrow.compute as pc
 from tqdm import tqdm
-from utils.api_client import APIClient
-from models.entity_extractor import EntityExtractor
+from utils.age_utils import unparsed_age_counts
+from utils.api_client import APIClient, build_shards, projection
+from utils.checkpoint import ExtractionCheckpoint, query_key
+from models.entity_extractor import EntityExtractor, model_revision
+from models.line_dedup import LineDedupEntityExtractor
+from models.ner_cache import CachedEntityExtractor, content_hash
+from models.ner_pool import EntityExtractorPool
+from models.onnx_backend import onnx_model_path
 from utils.data_pipeline import DataPipeline
 from utils.logger import setup_logger
-from utils.age_utils import normalize_ages
+from utils.page_archive import PageArchive, latest_run_dir
+from utils.parallel_transform import parallel_transform_pages
+from utils.rate_limiter import TokenBucket
+from utils.retry import RetryPolicy
+from utils.run_metrics import RunMetrics
+from utils.sql_transform import sql_transform
+from utils.study_transform import (
+    CATEGORICAL_COLUMNS, CHILD_TABLES, NORMALIZED_AGES, STUDIES_TABLE, STUDY_FIELDS, transform_pages
+)
+from utils.watermark import Watermark
 
 from dotenv import load_dotenv
 # Load environment variables from the .env file
@@ -24,154 +45,473 @@ config = load_config()
 DUCKDB_FILE_PATH = config.get('duckdb_file_path')
 API_BASE_URL = config.get('api_base_url')
 TARGET_STATUSES = config.get('target_statuses')
+MAX_PAGES = config.get('max_pages')  # None fetches every page of the registry
+SHARD_BY = config.get('shard_by')  # None walks the registry as a single pageToken chain
+FETCH_WORKERS = config.get('fetch_workers', 4)
+HTTP_POOL_SIZE = config.get('http_pool_size', 10)
+HTTP_CONNECT_TIMEOUT = config.get('http_connect_timeout', 10)
+HTTP_READ_TIMEOUT = config.get('http_read_timeout', 120)
+HTTP_MAX_ATTEMPTS = config.get('http_max_attempts', 6)
+HTTP_BACKOFF_MAX = config.get('http_backoff_max', 60)
+RATE_LIMIT_PER_SECOND = config.get('rate_limit_per_second')  # None disables client-side rate limiting
+RATE_LIMIT_BURST = config.get('rate_limit_burst', 1)
+ARCHIVE_DIR = config.get('archive_dir')  # None disables archiving of raw pages
+ARCHIVE_COMPRESSION = config.get('archive_compression', 'gzip')
+FIELD_PROJECTION = config.get('field_projection', True)
+CHECKPOINT_PATH = config.get('checkpoint_path')
+CHECKPOINT_PAGES = config.get('checkpoint_pages', 50)
+TRANSFORM_ENGINE = config.get('transform_engine', 'python')
+TRANSFORM_WORKERS = config.get('transform_workers', 1)  # 1 transforms pages in the main process
+NER_MODEL = config.get('ner_model', 'Clinical-AI-Apollo/Medical-NER')
+NER_MODEL_REVISION = config.get('ner_model_revision')  # None loads the latest revision
+NER_BATCH_SIZE = config.get('ner_batch_size', 16)
+NER_MAX_TOKENS = config.get('ner_max_tokens', 512)  # Longer criteria are split into overlapping windows
+NER_WINDOW_OVERLAP = config.get('ner_window_overlap', 128)  # None truncates them to their first window instead
+NER_WORKERS = config.get('ner_workers', 1)  # 1 runs NER in the main process
+NER_BACKEND = config.get('ner_backend', 'torch')
+NER_ONNX_QUANTIZE = config.get('ner_onnx_quantize', False)  # Dynamic int8 quantization of the ONNX export
+NER_ONNX_DIR = config.get('ner_onnx_dir', '/opt/airflow/src/data/onnx_models')
+LAST_UPDATE_WATERMARK = 'last_update_post_date'
 
-def filter_studies_by_status(studies_data, target_statuses):
-    filtered_studies = [study for study in studies_data if study.get("overallStatus") in target_statuses]
-    return filtered_studies
+def watermark_name(params):
+    """Name of the lastUpdatePostDate watermark of a query: runs limited to some statuses keep their own."""
+    if params.get('filter.overallStatus'):
+        return f"{LAST_UPDATE_WATERMARK}[{params['filter.overallStatus']}]"
+    return LAST_UPDATE_WATERMARK
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Extract, transform and load ClinicalTrials.gov studies into DuckDB')
+    parser.add_argument('--incremental', action='store_true', default=config.get('incremental', False),
+                        help='Only fetch studies updated since the previous run and merge them by nctId')
+    parser.add_argument('--shard-by', choices=['overallStatus', 'studyFirstPostDate'], default=SHARD_BY,
+                        help='Split the registry into independent queries that are paginated concurrently')
+    parser.add_argument('--fetch-workers', type=int, default=FETCH_WORKERS,
+                        help='Number of shards fetched at the same time')
+    parser.add_argument('--target-statuses-only', action='store_true', default=config.get('target_statuses_only', False),
+                        help='Only request studies whose overallStatus is one of target_statuses from the API')
+    parser.add_argument('--no-field-projection', dest='field_projection', action='store_false', default=FIELD_PROJECTION,
+                        help='Download full study records instead of only the fields the transform reads')
+    parser.add_argument('--archive-dir', default=ARCHIVE_DIR,
+                        help='Directory each run archives its raw API pages to (one sub-directory per run)')
+    parser.add_argument('--replay', nargs='?', const='latest', metavar='RUN_DIR',
+                        help='Feed the pipeline from an archived run instead of the API (default: latest run)')
+    parser.add_argument('--checkpoint-pages', type=int, default=CHECKPOINT_PAGES,
+                        help='Commit the load and checkpoint the pageTokens after every N pages')
+    parser.add_argument('--transform-engine', choices=['python', 'duckdb'], default=TRANSFORM_ENGINE,
+                        help='Flatten pages in Python, or in DuckDB straight from the archived page files (--replay only)')
+    parser.add_argument('--transform-workers', type=int, default=TRANSFORM_WORKERS,
+                        help='Decode and flatten pages in N worker processes (python engine)')
+    parser.add_argument('--ner-batch-size', type=int, default=NER_BATCH_SIZE,
+                        help='Number of eligibility criteria per forward pass of the NER model')
+    parser.add_argument('--ner-workers', type=int, default=NER_WORKERS,
+                        help='Run NER in N worker processes, each loading the model once')
+    parser.add_argument('--ner-backend', choices=['torch', 'onnx'], default=NER_BACKEND,
+                        help='Run the NER model with PyTorch, or its ONNX export (cached in ner_onnx_dir) with ONNX Runtime')
+    parser.add_argument('--no-ner-cache', dest='ner_cache', action='store_false', default=config.get('ner_cache', True),
+                        help='Run NER on every eligibility criteria instead of reusing the cached results')
+    parser.add_argument('--no-ner-line-dedup', dest='ner_line_dedup', action='store_false',
+                        default=config.get('ner_line_dedup', True),
+                        help='Run NER on whole eligibility criteria instead of on their distinct lines')
+    parser.add_argument('--no-ner-incremental', dest='ner_incremental', action='store_false',
+                        default=config.get('ner_incremental', True),
+                        help='Run NER on every target-status study instead of only on new or changed eligibility criteria')
+    args = parser.parse_args()
+    if args.transform_engine == 'duckdb' and not args.replay:
+        parser.error('--transform-engine duckdb reads archived pages and requires --replay')
+    if args.transform_workers > 1 and args.shard_by and not args.replay:
+        # Sharded fetches de-duplicate studies by nctId, which needs the decoded pages in this process
+        parser.error('--transform-workers cannot be combined with --shard-by')
+    return args
+
+def target_status_mask(studies, target_statuses):
+    """Boolean mask of the rows of a studies record batch whose overallStatus is one of `target_statuses`."""
+    return pc.is_in(studies.column('overallStatus'), value_set=pa.array(target_statuses, pa.string()))
+
+def extract_pages(api_client, params, logger, metrics, max_pages=None, shards=None, workers=1, replay=None, checkpoint=None,
+                  raw=False):
+    """
+    Yield raw API pages as soon as they arrive, walking the shards concurrently if any are given.
+    With a `replay` archive, the archived pages are yielded instead and the API is not called.
+    With `raw`, the undecoded page bodies are yielded (not supported together with shards).
+
+    Request errors are raised, never treated as the end of the data, so a failed extraction fails
+    the task and its retry resumes from the checkpoint.
+    """
+    if replay is not None:
+        pages = replay.iter_raw_pages() if raw else replay.iter_pages()
+    elif shards:
+        logger.info(f'Fetching {len(shards)} shards with {workers} workers')
+        pages = api_client.iter_sharded_pages(params, shards, workers, max_pages, checkpoint)
+    else:
+        pages = api_client.iter_pages(params, max_pages, checkpoint=checkpoint, raw=raw)
+
+    first_page = checkpoint.pages + 1 if checkpoint is not None else 1
+    for page, data in enumerate(pages, start=first_page):
+        logger.info(f'--- page: {page} ---')
+        metrics.increment('pages')
+        yield data
+
+def iter_chunks(pages, chunk_size):
+    """Split an iterator of pages into consecutive iterators of at most `chunk_size` pages."""
+    pages = iter(pages)
+    while True:
+        chunk = itertools.islice(pages, chunk_size)
+        first_page = next(chunk, None)
+        if first_page is None:
+            return
+        yield itertools.chain([first_page], chunk)
+
+def archive_chunks(archive, chunk_size, metrics):
+    """
+    Flatten an archived run in DuckDB, `chunk_size` page files at a time.
+
+    Yields:
+        iterator: The studies record batches of each chunk of page files, see `sql_transform`.
+    """
+    duplicates = archive.duplicates()
+    for files in iter_chunks(tqdm(archive.page_files(), desc="Processing pages", unit="page"), chunk_size):
+        files = list(files)
+        metrics.increment('pages', len(files))
+        yield sql_transform(files, duplicates=duplicates)
+
+def store_categories(data_pipeline, categories, metrics, logger, create=False):
+    """
+    Extend the ENUM columns of every table to the categorical values in `categories`, see `DataPipeline.enum_columns`.
+    With `create`, VARCHAR categorical columns (e.g. of freshly created tables) are converted into ENUMs as well.
+    """
+    for table, columns in CATEGORICAL_COLUMNS.items():
+        added = data_pipeline.enum_columns(table, {column: categories[table][column] for column in columns}, create)
+        for column, values in added.items():
+            metrics.increment('enum_values_added', len(values))
+            logger.info(f'New values of {table}.{column} added to its ENUM: {values}')
+
+def study_load_stream(batches, extractor, watermark, metrics, logger, write_disposition=None, child_merge_key=None,
+                      unparsed_ages=None, categories=None, ner_batch_size=NER_BATCH_SIZE, ner_settings=None,
+                      previous_entities=None, merged_nct_ids=None):
+    """
+    Add NER entities to the target-status studies of each studies record batch, and route the
+    child table batches to their own tables. Ages in an unknown format are counted in `unparsed_ages`,
+    the values of categorical columns collected in `categories` (table -> column -> set of values).
+
+    Each target-status study also gets an eligibility_hash of its criteria and the `ner_settings` they
+    were extracted with. `previous_entities` (nct_ids -> nct_id -> row of the previous run) carries the
+    entities of studies with an unchanged hash forward, so only new or changed criteria go through NER.
+    The nctIds of every study are added to `merged_nct_ids`, if given.
+
+    Each page is yielded as soon as it is enriched, so dlt can buffer it to disk before the next one
+    is fetched. filtered_studies is a view over the studies table, so its rows are not duplicated.
+    """
+    logged_sample = False
+    for table, batch in batches:
+        if categories is not None:
+            for column in CATEGORICAL_COLUMNS.get(table, ()):
+                categories[table][column].update(batch.column(column).dictionary.to_pylist())
+        if table != STUDIES_TABLE:
+            metrics.increment(f'{table}_rows', batch.num_rows)
+            yield DataPipeline.child_table_item(batch, table, write_disposition, child_merge_key)
+            continue
+
+        studies = batch
+        metrics.increment('studies', studies.num_rows)
+        if merged_nct_ids is not None:
+            merged_nct_ids.update(studies.column('nctId').to_pylist())
+        last_update = pc.max(studies.column('lastUpdatePostDate')).as_py()
+        if last_update is not None:
+            watermark.observe([last_update.isoformat()])
+        if unparsed_ages is not None:
+            for column, (age_column, _, _) in NORMALIZED_AGES.items():
+                unparsed_ages.update(unparsed_age_counts(studies.column(age_column), studies.column(column)))
+
+        mask = target_status_mask(studies, TARGET_STATUSES)
+        target_studies = studies.filter(mask)
+        criteria = target_studies.column('eligibilityCriteria').to_pylist()
+        hashes = [content_hash(ner_settings, text) for text in criteria]
+        entities = [None] * len(criteria)
+        if previous_entities is not None:
+            nct_ids = target_studies.column('nctId').to_pylist()
+            previous = previous_entities(nct_ids)
+            for index, (nct_id, eligibility_hash) in enumerate(zip(nct_ids, hashes)):
+                row = previous.get(nct_id)
+                if row is not None and row['eligibility_hash'] == eligibility_hash:
+                    entities[index] = row
+        changed = [index for index, found in enumerate(entities) if found is None]
+        metrics.increment('ner_carried_forward', len(criteria) - len(changed))
+
+        # The changed criteria of the whole record batch go through the model together, in length-sorted
+        # batches; each study directly gets the highest-scoring entity of each type
+        ner_start_time = time.perf_counter()
+        extracted = extractor.extract_many([criteria[index] for index in changed], batch_size=ner_batch_size)
+        metrics.increment('ner_seconds', time.perf_counter() - ner_start_time)
+        for index, found in zip(changed, extracted):
+            entities[index] = found
+        diseases = [diseases_medications.get('diseases', '') for diseases_medications in entities]
+        medications = [diseases_medications.get('medications', '') for diseases_medications in entities]
+
+        # The entities are scattered back to the target-status rows; the other rows stay null
+        no_entities = pa.nulls(studies.num_rows, pa.string())
+        studies = pa.RecordBatch.from_arrays(
+            studies.columns + [
+                pc.replace_with_mask(no_entities, mask, pa.array(diseases, pa.string())),
+                pc.replace_with_mask(no_entities, mask, pa.array(medications, pa.string())),
+                pc.replace_with_mask(no_entities, mask, pa.array(hashes, pa.string())),
+            ],
+            names=studies.schema.names + ['diseases', 'medications', 'eligibility_hash']
+        )
+
+        if criteria and not logged_sample:
+            logger.info('Sample transformed study data:')
+            logger.info(studies.filter(mask).slice(0, 1).to_pylist()[0])  # Log the first item for verification
+            logged_sample = True
+
+        metrics.increment('filtered_studies', len(criteria))
+        yield studies
 
 def main():
+    args = parse_args()
     logger = setup_logger(__name__)
-    api_client = APIClient(API_BASE_URL)
+    metrics = RunMetrics()
+
+    replay = None
+    archive = None
+    if args.replay:
+        replay_dir = latest_run_dir(args.archive_dir) if args.replay == 'latest' else args.replay
+        replay = PageArchive(replay_dir)
+    elif args.archive_dir:
+        archive = PageArchive(os.path.join(args.archive_dir, time.strftime('%Y%m%dT%H%M%S')), ARCHIVE_COMPRESSION)
+
+    api_client = APIClient(
+        API_BASE_URL,
+        metrics=metrics,
+        pool_size=max(HTTP_POOL_SIZE, args.fetch_workers),
+        connect_timeout=HTTP_CONNECT_TIMEOUT,
+        read_timeout=HTTP_READ_TIMEOUT,
+        archive=archive,
+        retry_policy=RetryPolicy(max_attempts=HTTP_MAX_ATTEMPTS, backoff_max=HTTP_BACKOFF_MAX),
+        # One bucket for the whole client, so concurrent shard fetchers share the request budget
+        rate_limiter=TokenBucket(RATE_LIMIT_PER_SECOND, RATE_LIMIT_BURST) if RATE_LIMIT_PER_SECOND else None
+    )
     openai_api_key = os.getenv("OPENAI_API_KEY")
-    extractor = EntityExtractor(use_gpt=False, openai_api_key=openai_api_key)
+    extractor_kwargs = dict(model_name=NER_MODEL, revision=NER_MODEL_REVISION, aggregation_strategy='simple',
+                            use_gpt=False, openai_api_key=openai_api_key, max_tokens=NER_MAX_TOKENS,
+                            window_overlap=NER_WINDOW_OVERLAP, backend=args.ner_backend, quantize=NER_ONNX_QUANTIZE,
+                            onnx_dir=NER_ONNX_DIR)
+    ner_pool = None
+    if args.ner_workers > 1:
+        if args.ner_backend == 'onnx':
+            onnx_model_path(NER_MODEL, NER_MODEL_REVISION, NER_ONNX_DIR, NER_ONNX_QUANTIZE)  # Exported once, not by every worker
+        # The model is only loaded by the workers; the threads of each are sized to share the cores
+        extractor = ner_pool = EntityExtractorPool(args.ner_workers, **extractor_kwargs)
+        logger.info(f'Running NER in {args.ner_workers} worker processes')
+    else:
+        extractor = EntityExtractor(**extractor_kwargs)
     data_pipeline = DataPipeline("clinical_trial_pipeline", DUCKDB_FILE_PATH, DUCKDB_FILE_PATH)
+    # Results are cached and carried forward per model commit, so a new revision of the model is not served stale results
+    model_settings = {name: extractor_kwargs[name] for name in ('model_name', 'aggregation_strategy', 'max_tokens',
+                                                                 'window_overlap')}
+    model_settings['revision'] = model_revision(NER_MODEL, NER_MODEL_REVISION) or NER_MODEL_REVISION
+    if args.ner_backend != 'torch':
+        # Only added for other backends, so the results cached with PyTorch stay valid
+        model_settings.update(backend=args.ner_backend, quantize=NER_ONNX_QUANTIZE)
+    ner_cache = None
+    if args.ner_cache:
+        extractor = ner_cache = CachedEntityExtractor(extractor, data_pipeline, model_settings, metrics)
+    if args.ner_line_dedup:
+        # Outermost, so the cache above holds the entities of each distinct line
+        extractor = LineDedupEntityExtractor(extractor, metrics)
+    # Line dedup combines the entities of the lines, so it changes the entities of a study as much as the model
+    ner_settings = dict(model_settings, line_dedup=args.ner_line_dedup)
+    previous_entities = None
+    # Taken before the first chunk, whose full refresh drops the studies table; a resumed run reuses the snapshot
+    # of the run it resumes, as that run already replaced part of the table
+    if args.ner_incremental and data_pipeline.snapshot_entities(STUDIES_TABLE):
+        previous_entities = data_pipeline.get_snapshot_entities
+        logger.info('Incremental NER: carrying forward the entities of unchanged eligibility criteria')
 
     params = {
         'pageSize': 1000,
         'format': 'json',
     }
-    
-    page = 1
-    studies = []
+    if args.field_projection:
+        params['fields'] = projection(STUDY_FIELDS)
+    if args.target_statuses_only:
+        # Let the API drop the other statuses; studies then only holds the target statuses
+        params['filter.overallStatus'] = ','.join(TARGET_STATUSES)
+
+    # A replay tracks the watermark of the query it was archived by, not the one of this run's flags
+    watermark_params = params
+    if replay is not None and replay.query() is not None:
+        watermark_params = replay.query()['params']
+    if args.incremental:
+        # Studies come back oldest update first, so a run that stops early still leaves a valid watermark
+        name = watermark_name(watermark_params)
+        watermark = Watermark(name, data_pipeline.get_watermark(name))
+        params['sort'] = 'LastUpdatePostDate:asc'
+        advanced_filter = watermark.advanced_filter('LastUpdatePostDate')
+        if advanced_filter:
+            params['filter.advanced'] = advanced_filter
+            logger.info(f'Incremental run: fetching studies updated since {watermark.previous_value}')
+        else:
+            logger.info('Incremental run without a stored watermark: fetching all studies')
+        # Child tables have no key of their own: all the rows of an updated study are replaced
+        write_disposition, primary_key, child_merge_key = 'merge', 'nctId', 'nct_id'
+    else:
+        watermark = Watermark(watermark_name(watermark_params))
+        write_disposition, primary_key, child_merge_key = 'replace', None, None
 
     overall_start_time = time.time()
-    logger.info('Started to Extract Data from ClinicalTrial.Gov API')
+    if replay is not None:
+        logger.info(f'Started to replay archived pages from {replay.directory}')
+    else:
+        logger.info('Started to Extract Data from ClinicalTrial.Gov API')
+        if archive is not None:
+            logger.info(f'Archiving raw pages to {archive.directory}')
+
+    if replay is None and args.field_projection:
+        # An estimate from one small page fetched twice (2 extra requests), not from the pages of the run
+        full_bytes, projected_bytes = api_client.measure_projection(params, STUDY_FIELDS)
+        logger.info(f'Field projection estimate, from a sample page: {full_bytes} bytes of full records, '
+                    f'{projected_bytes} bytes projected ({projected_bytes / full_bytes:.0%})')
+
+    shards = build_shards(args.shard_by, TARGET_STATUSES if args.target_statuses_only else None) if args.shard_by else None
+    max_pages = MAX_PAGES
+
+    checkpoint = None
+    resuming = False
+    if replay is None and CHECKPOINT_PATH:
+        checkpoint = ExtractionCheckpoint.load(CHECKPOINT_PATH, query_key(params, shards, write_disposition))
+        # Taken before any page is fetched: the checkpoint records every page as soon as it is handed over,
+        # so `checkpoint.resumed` turns true as the first chunk is read
+        resuming = checkpoint.resumed
+        if resuming:
+            logger.info(f'Resuming interrupted extraction after {checkpoint.pages} loaded pages')
+            # A chunk the interrupted run did not finish loading is fetched again after the checkpoint
+            data_pipeline.drop_pending_packages()
+            watermark.observe([checkpoint.watermark])
+            if max_pages is not None and not shards:
+                max_pages = max(max_pages - checkpoint.pages, 0)
+    if archive is not None:
+        archive.write_query(params, shards, max_pages)
+
+    # Pages are fetched, flattened, age-normalized, NER-enriched and handed to dlt one at a time as Arrow
+    # record batches, so memory stays bounded by a single columnar page regardless of the registry size
+    transform_pool = None
+    if args.transform_engine == 'duckdb':
+        # DuckDB reads, flattens and age-normalizes the archived page files itself, on every core
+        logger.info('Flattening archived pages with DuckDB')
+        chunks = archive_chunks(replay, args.checkpoint_pages, metrics)
+    elif args.transform_workers > 1:
+        # Worker processes decode and flatten the undecoded pages; this process only reads pageTokens.
+        # Each chunk is transformed on its own, so pages prefetched for the pool never cross a checkpoint
+        logger.info(f'Transforming pages in {args.transform_workers} worker processes')
+        transform_pool = ProcessPoolExecutor(max_workers=args.transform_workers)
+        pages = extract_pages(api_client, params, logger, metrics, max_pages, shards, args.fetch_workers, replay, checkpoint,
+                              raw=True)
+        pages = tqdm(pages, desc="Processing pages", unit="page")
+        chunks = (parallel_transform_pages(transform_pool, chunk, window=args.transform_workers * 2)
+                  for chunk in iter_chunks(pages, args.checkpoint_pages))
+    else:
+        pages = extract_pages(api_client, params, logger, metrics, max_pages, shards, args.fetch_workers, replay, checkpoint)
+        pages = tqdm(pages, desc="Processing pages", unit="page")
+        chunks = (transform_pages(chunk) for chunk in iter_chunks(pages, args.checkpoint_pages))
+
+    unparsed_ages = Counter()
+    categories = defaultdict(lambda: defaultdict(set))
+
+    # Every chunk of pages is committed as its own load; the checkpoint is saved right after,
+    # so a retried task only redoes the chunk that was in flight when the previous attempt died
+    for batches in chunks:
+        chunk_write_disposition = write_disposition
+        refresh = None
+        if write_disposition == 'replace':
+            if resuming or metrics.get('chunks'):
+                chunk_write_disposition = 'append'  # Only the first chunk of a full refresh replaces the tables
+            else:
+                refresh = 'drop_resources'  # Recreate the tables, so changed column types (e.g. DATE) are applied
+
+        merged_nct_ids = set() if child_merge_key else None
+        stream = study_load_stream(batches, extractor, watermark, metrics, logger, chunk_write_disposition, child_merge_key,
+                                   unparsed_ages, categories, args.ner_batch_size, ner_settings, previous_entities,
+                                   merged_nct_ids)
+
+        def before_load():
+            if merged_nct_ids:
+                # The merge only replaces the child rows of studies that still list items, so the child rows of
+                # every merged study are deleted first
+                data_pipeline.delete_rows([child_table.table for child_table in CHILD_TABLES], child_merge_key,
+                                          merged_nct_ids)
+            # Values the ENUM columns do not know yet would fail the load, so they are added once extracted
+            store_categories(data_pipeline, categories, metrics, logger)
+
+        logger.info(f'Loading studies and their child tables to duckdb ({chunk_write_disposition})')
+        data_pipeline.load_data(stream, STUDIES_TABLE, write_disposition=chunk_write_disposition, primary_key=primary_key,
+                                refresh=refresh, before_load=before_load)
+        metrics.increment('chunks')
+        if ner_cache is not None:
+            ner_cache.flush()  # Cache the NER results of the chunk once its studies are loaded
+
+        if checkpoint is not None:
+            checkpoint.watermark = watermark.value
+            checkpoint.save()
+            logger.info(f'Checkpoint saved after {checkpoint.pages} loaded pages')
 
-    
-    while page <= 5: # For testing faster, putting max page of api pagination, for demo purpose
-    # while True: # For fetching all studies data
-        logger.info(f'--- page: {page} ---')
-        
-        try:
-            data = api_client.fetch_data(params)
-        except Exception as e:
-            logger.error(str(e))
-            break
-
-        if not data.get('studies', []):
-            break
-
-        studies.extend(data['studies'])
-        # Check for next page token
-        next_page_token = data.get('nextPageToken')
-        if not next_page_token:
-            break  # No next page, exit the loop
-
-        # Update params for next page
-        params['pageToken'] = next_page_token
-        page += 1  # Increment page counter
-
-    # Initialize an empty list to store the data
-    studies_data = []
-
-    # Start timer
-    start_time = time.time()
-
-    # Loop for storing data with progress bar
-    for study in tqdm(studies, desc="Processing studies"):
-        # Safely access nested keys
-        nctId = study['protocolSection']['identificationModule'].get('nctId', 'Unknown')
-        overallStatus = study['protocolSection']['statusModule'].get('overallStatus', 'Unknown')
-        startDate = study['protocolSection']['statusModule'].get('startDateStruct', {}).get('date', 'Unknown Date')
-        conditions = ', '.join(study['protocolSection'].get('conditionsModule', {}).get('conditions', ['No conditions listed']))
-        briefTitle = study['protocolSection']['identificationModule'].get('briefTitle', 'Unknown')
-        acronym = study['protocolSection']['identificationModule'].get('acronym', 'Unknown')
-
-        # Extract interventions safely
-        interventions_list = study['protocolSection'].get('armsInterventionsModule', {}).get('interventions', [])
-        interventions = ', '.join([intervention.get('name', 'No intervention name listed') for intervention in interventions_list]) if interventions_list else "No interventions listed"
-
-        # Extract locations safely
-        locations_list = study['protocolSection'].get('contactsLocationsModule', {}).get('locations', [])
-        locations = ', '.join([f"{location.get('city', 'No City')} - {location.get('country', 'No Country')}" for location in locations_list]) if locations_list else "No locations listed"
-
-        # Extract dates and phases
-        primaryCompletionDate = study['protocolSection']['statusModule'].get('primaryCompletionDateStruct', {}).get('date', 'Unknown Date')
-        studyFirstPostDate = study['protocolSection']['statusModule'].get('studyFirstPostDateStruct', {}).get('date', 'Unknown Date')
-        lastUpdatePostDate = study['protocolSection']['statusModule'].get('lastUpdatePostDateStruct', {}).get('date', 'Unknown Date')
-        studyType = study['protocolSection'].get('designModule', {}).get('studyType', 'Unknown')
-        phases = ', '.join(study['protocolSection'].get('designModule', {}).get('phases', ['Not Available']))
-
-        # Extract Eligibility
-        eligibilityCriteria = study['protocolSection'].get('eligibilityModule', {}).get('eligibilityCriteria', 'Unknown')
-        sex = study['protocolSection'].get('eligibilityModule', {}).get('sex', 'Unknown')
-        minimumAge = study['protocolSection'].get('eligibilityModule', {}).get('minimumAge', '0 Year')
-        maximumAge = study['protocolSection'].get('eligibilityModule', {}).get('maximumAge', '120 Years')
-        stdAges = study['protocolSection'].get('eligibilityModule', {}).get('stdAges', 'Unknown')
-
-        # Extend the data to the list as a dictionary
-        studies_data.append({
-            'nctId': nctId,
-            'briefTitle': briefTitle,
-            'acronym': acronym,
-            'overallStatus': overallStatus,
-            'startDate': startDate,
-            'conditions': conditions,
-            'interventions': interventions,
-            'locations': locations,
-            'primaryCompletionDate': primaryCompletionDate,
-            'studyFirstPostDate': studyFirstPostDate,
-            'lastUpdatePostDate': lastUpdatePostDate,
-            'studyType': studyType,
-            'phases': phases,
-            'eligibilityCriteria': eligibilityCriteria,
-            'sex': sex,
-            'minimumAge': minimumAge,
-            'maximumAge': maximumAge,
-            'stdAges': stdAges
-        })
-
-    # End timer
-    end_time = time.time()
-    elapsed_time = end_time - start_time
-    minutes = int(elapsed_time // 60)
-    seconds = elapsed_time % 60
-
-    # Normalize ages before processing entities
-    normalize_ages(studies_data)
-
-    logger.info('Successfully stored data as list')  # Log completion message
-    logger.info(f'Total elapsed time: {minutes} minutes and {seconds:.2f} seconds')  # Log total elapsed time of Loop
-
-    filtered_studies = filter_studies_by_status(studies_data, TARGET_STATUSES)
-
-    logger.info('Extracting Entity diseases and medications from EligibilityCriteria Module')
-    for study in tqdm(filtered_studies, desc="Processing filtered studies"):
-        eligibilityCriteria = study['eligibilityCriteria']
-        diseases_medications = extractor.extract_specific_entities(eligibilityCriteria)
-        diseases = diseases_medications.get('diseases', '')  # Directly assign the highest-scoring entity
-        medications = diseases_medications.get('medications', '')  # Directly assign the highest-scoring entity
-        study['diseases'] = diseases
-        study['medications'] = medications
-        
-
-    logger.info('Sample transformed study data:')
-    logger.info(filtered_studies[0])  # Log the first item for verification
-
-    logger.info('Finished Extracting Entity diseases and medications.')
-
-    logger.info('Loading studies data to duckdb as table name studies')
-    data_pipeline.load_data(studies_data, 'studies')
     logger.info('Successfully loaded studies data')
+    if unparsed_ages:
+        metrics.increment('unparsed_ages', sum(unparsed_ages.values()))
+        logger.warning(f'Ages in an unknown format, loaded as no limit: {dict(unparsed_ages.most_common())}')
+    api_client.close()
+    if transform_pool is not None:
+        transform_pool.shutdown()
+    if ner_pool is not None:
+        ner_pool.shutdown()
+    if metrics.get('chunks') and write_disposition == 'replace':
+        # Incremental merges append in update order already; a full refresh is clustered once loaded,
+        # so filters on the update date only scan the matching row groups
+        data_pipeline.cluster_table(STUDIES_TABLE, 'last_update_post_date')
+        logger.info('Clustered studies by last_update_post_date')
+
+    if metrics.get('chunks'):
+        # Tables created by this run have VARCHAR columns until their values are known
+        store_categories(data_pipeline, categories, metrics, logger, create=True)
+        logger.info('Stored the categorical columns as ENUMs')
+
+    if metrics.get('chunks'):
+        data_pipeline.create_filtered_view('filtered_studies', 'studies', 'overall_status', TARGET_STATUSES)
+        logger.info('Exposed filtered_studies as a view over studies')
+
+    # Only advance the watermark once the studies it covers are safely loaded, and only if every study
+    # updated before it was seen: a page limit stops unsorted (or sharded) chains at arbitrary dates.
+    # An archive is only complete if its manifest shows every chain of its query walked to the end
+    if replay is not None:
+        complete = replay.complete_query() is not None
+    else:
+        complete = max_pages is None or (params.get('sort') == 'LastUpdatePostDate:asc' and not shards)
+    if watermark.advanced and not complete:
+        logger.info(f'Not storing the {watermark.name} watermark: the extraction may have left earlier updates unfetched')
+    elif watermark.advanced:
+        data_pipeline.save_watermark(watermark.name, watermark.value)
+        logger.info(f'Stored {watermark.name} watermark {watermark.value}')
 
-    logger.info('Loading filtered_studies_data to duckdb as table name filtered_studies')
-    data_pipeline.load_data(filtered_studies, 'filtered_studies')
-    logger.info('Successfully loaded filtered studies Data')
+    # The extraction is complete, the next run starts from scratch (or from the new watermark)
+    if checkpoint is not None:
+        checkpoint.clear()
+    # Only dropped once the run succeeded (even without incremental NER), so a failed run leaves it to the next one
+    data_pipeline.drop_entities_snapshot()
 
     overall_end_time = time.time()
     overall_elapsed_time = overall_end_time - overall_start_time
     overall_minutes = int(overall_elapsed_time // 60)
     overall_seconds = overall_elapsed_time % 60
+    metrics.log_summary(logger)
+    if metrics.get('requests'):
+        logger.info(f"Average decoded payload per page: {metrics.get('bytes_decoded') / metrics.get('requests') / 1e6:.2f} MB")
+    ner_cache_lookups = metrics.get('ner_cache_hits') + metrics.get('ner_cache_misses')
+    if ner_cache_lookups:
+        logger.info(f"NER cache hit rate: {metrics.get('ner_cache_hits') / ner_cache_lookups:.1%}")
+    if metrics.get('ner_distinct_lines'):
+        logger.info(f"NER line dedup ratio: {metrics.get('ner_lines') / metrics.get('ner_distinct_lines'):.1f}x "
+                    f"({metrics.get('ner_lines')} criteria lines, {metrics.get('ner_distinct_lines')} distinct)")
+    if metrics.get('bytes_on_wire'):
+        logger.info(f"Transfer compression ratio: {metrics.get('bytes_decoded') / metrics.get('bytes_on_wire'):.1f}x")
     logger.info(f'Overall Total elapsed time: {overall_minutes} minutes and {overall_seconds:.2f} seconds')
     
     # Ensure the script exits cleanly
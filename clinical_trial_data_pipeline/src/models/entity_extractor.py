@@ -1,8 +1,12 @@
-from transformers import pipeline as hf_pipeline
+import logging
+
+from transformers import AutoTokenizer, pipeline as hf_pipeline
 import openai
 from openai import OpenAI
 import os
 from dotenv import load_dotenv
+
+from models.onnx_backend import UnsupportedModelFilter, load_onnx_model, model_revision
 # Load environment variables from the .env file
 load_dotenv()
 # get the environment variable
@@ -12,8 +16,31 @@ client = OpenAI(api_key = 'sk-xxxxxxxxxxxxxxxxxxxx')
 # Set your OpenAI API key
 client.api_key = os.getenv("OPENAI_API_KEY")
 
+# Target entity type -> key of the extracted entities
+ENTITY_KEYS = {
+    'DISEASE_DISORDER': 'diseases',
+    'MEDICATION': 'medications'
+}
+
+def best_scored_entities(scored_results):
+    """
+    Combine the scored entities of several texts (as returned by `extract_many` with `with_scores`) into
+    the highest-scoring entity of each key among all of them.
+    """
+    best = {key: {'score': 0, 'entity': ''} for key in ENTITY_KEYS.values()}
+    for scored in scored_results:
+        for key, entity in scored.items():
+            if entity['score'] is None:
+                # Unscored (GPT-3.5) entities count only until a scored one is found
+                if entity['entity'] and not best[key]['entity']:
+                    best[key] = entity
+            elif entity['score'] > (best[key]['score'] or 0):
+                best[key] = entity
+    return best
+
 class EntityExtractor:
-    def __init__(self, model_name="Clinical-AI-Apollo/Medical-NER", aggregation_strategy='simple', use_gpt=False, openai_api_key=None):
+    def __init__(self, model_name="Clinical-AI-Apollo/Medical-NER", aggregation_strategy='simple', use_gpt=False, openai_api_key=None,
+                 max_tokens=512, window_overlap=128, revision=None, backend='torch', quantize=False, onnx_dir=None):
         """
         Initialize the EntityExtractor with a specific model.
 
@@ -22,6 +49,13 @@ class EntityExtractor:
             aggregation_strategy (str): The strategy to use for aggregation.
             use_gpt (bool): Whether to use GPT-3.5 for entity extraction.
             openai_api_key (str): The OpenAI API key to use for GPT-3.5.
+            max_tokens (int): Number of tokens the model reads at once; longer texts are split into windows.
+            window_overlap (int): Number of tokens shared by consecutive windows of a long text, so an entity cut
+                by the end of a window is whole in the next one. None truncates long texts to their first window.
+            revision (str): The model revision (branch, tag or commit hash) to load; None loads the latest one.
+            backend (str): 'torch' runs the model with PyTorch, 'onnx' runs its ONNX export with ONNX Runtime.
+            quantize (bool): With the onnx backend, run the export with weights dynamically quantized to int8.
+            onnx_dir (str): With the onnx backend, the directory caching the ONNX exports.
         """
         self.use_gpt = use_gpt
         if use_gpt:
@@ -29,7 +63,25 @@ class EntityExtractor:
                 raise ValueError("OpenAI API key must be provided if using GPT-3.5")
             client.api_key = openai_api_key
         else:
-            self.pipe = hf_pipeline("token-classification", model=model_name, aggregation_strategy=aggregation_strategy)
+            # The pipeline splits long texts into overlapping windows, batches the windows of many texts together and
+            # merges the entities of each text back, keeping a single entity where windows overlap
+            tokenizer = AutoTokenizer.from_pretrained(model_name, revision=revision, model_max_length=max_tokens)
+            model = model_name
+            if backend == 'onnx':
+                model = load_onnx_model(model_name, revision, onnx_dir, quantize)
+            elif backend != 'torch':
+                raise ValueError(f"Unknown NER backend: {backend}")
+            # The pipeline checks the model class against the PyTorch token classification models and logs an
+            # error for the ONNX Runtime wrapper, which it then runs like any of them; only that error is dropped
+            pipelines_logger = logging.getLogger('transformers.pipelines.base')
+            unsupported_filter = UnsupportedModelFilter()
+            if backend == 'onnx':
+                pipelines_logger.addFilter(unsupported_filter)
+            try:
+                self.pipe = hf_pipeline("token-classification", model=model, revision=revision, tokenizer=tokenizer,
+                                        framework='pt', aggregation_strategy=aggregation_strategy, stride=window_overlap)
+            finally:
+                pipelines_logger.removeFilter(unsupported_filter)
 
     def extract_specific_entities(self, text, target_entities=['DISEASE_DISORDER', 'MEDICATION']):
         """
@@ -47,22 +99,65 @@ class EntityExtractor:
         else:
             return self.extract_with_model(text, target_entities)
 
+    def extract_many(self, texts, target_entities=['DISEASE_DISORDER', 'MEDICATION'], batch_size=16, with_scores=False):
+        """
+        Extract specific entities from many texts, feeding the model batches of texts instead of one text at a time.
+
+        The texts are sorted by length before being batched: each batch is padded to its own longest text only,
+        so short criteria do not pay for long ones. The results are returned in the order of `texts`.
+
+        Args:
+            texts (list): The input texts.
+            target_entities (list): List of entity types to extract.
+            batch_size (int): Number of texts per forward pass of the model.
+            with_scores (bool): Return each entity with its score, as {key: {'entity': ..., 'score': ...}}.
+
+        Returns:
+            list: One dict per text, as returned by `extract_specific_entities`.
+        """
+        if self.use_gpt:
+            extracted = [self.extract_with_gpt(text, target_entities) for text in texts]
+            if with_scores:
+                # GPT-3.5 reports no scores
+                return [{key: {'entity': entity, 'score': None} for key, entity in entities.items()} for entities in extracted]
+            return extracted
+        return [self.highest_scoring_entities(results, target_entities, with_scores)
+                for results in self.find_entities(texts, batch_size)]
+
+    def find_entities(self, texts, batch_size=16):
+        """
+        Run the model over many texts in length-sorted batches.
+
+        Returns:
+            list: The entities found in each text (dicts with 'entity_group', 'score', 'word', 'start' and 'end'),
+                in the order of `texts`.
+        """
+        if not texts:
+            return []
+        order = sorted(range(len(texts)), key=lambda index: len(texts[index]))
+        found = [None] * len(texts)
+        for index, results in zip(order, self.pipe([texts[index] for index in order], batch_size=batch_size)):
+            found[index] = results
+        return found
+
     def extract_with_model(self, text, target_entities):
-        results = self.pipe(text)
+        return self.highest_scoring_entities(self.pipe(text), target_entities)
+
+    @staticmethod
+    def highest_scoring_entities(results, target_entities, with_scores=False):
+        """Keep the highest-scoring entity of each target type among the entities the pipeline found in one text."""
         extracted_entities = {'diseases': '', 'medications': ''}
-        entity_mapping = {
-            'DISEASE_DISORDER': 'diseases',
-            'MEDICATION': 'medications'
-        }
-        highest_score_entities = {key: {'score': 0, 'entity': ''} for key in entity_mapping.values()}
+        highest_score_entities = {key: {'score': 0, 'entity': ''} for key in ENTITY_KEYS.values()}
         
         for entity in results:
             entity_type = entity['entity_group']
             if entity_type in target_entities:
-                key = entity_mapping[entity_type]
+                key = ENTITY_KEYS[entity_type]
                 if entity['score'] > highest_score_entities[key]['score']:
-                    highest_score_entities[key] = {'score': entity['score'], 'entity': entity['word']}
+                    highest_score_entities[key] = {'score': float(entity['score']), 'entity': entity['word']}
         
+        if with_scores:
+            return highest_score_entities
         for key, value in highest_score_entities.items():
             extracted_entities[key] = value['entity']
         
@@ -0,0 +1,50 @@
+import re
+
+from models.entity_extractor import best_scored_entities
+
+# List markers opening a criteria line: bullets (*, -, •) and numbers (1. or 1))
+LINE_MARKER = re.compile(r'^\s*(?:[*\-•]+|\d+[.)])\s*')
+WHITESPACE = re.compile(r'\s+')
+
+def criteria_lines(text):
+    """
+    The normalized lines of an eligibility criteria text: list markers stripped, whitespace collapsed,
+    empty lines dropped, so the same criterion is the same line whichever list it appears in.
+    """
+    lines = (WHITESPACE.sub(' ', LINE_MARKER.sub('', line)).strip() for line in (text or '').splitlines())
+    return [line for line in lines if line]
+
+class LineDedupEntityExtractor:
+    def __init__(self, extractor, metrics=None):
+        """
+        Run `extract_many` on the distinct lines of the texts instead of on whole texts.
+
+        Eligibility criteria are mostly boilerplate lines shared by many studies ("Pregnant or breastfeeding",
+        "Able to give informed consent"), so the distinct lines of a batch are far fewer than its lines.
+        Wrapping a CachedEntityExtractor caches entities per line, across runs.
+
+        Args:
+            extractor: The extractor of the lines; its `extract_many` must support `with_scores`.
+            metrics (RunMetrics): Counts ner_lines and ner_distinct_lines (lines run through `extractor`).
+        """
+        self.extractor = extractor
+        self.metrics = metrics
+
+    def extract_many(self, texts, target_entities=['DISEASE_DISORDER', 'MEDICATION'], batch_size=16, with_scores=False):
+        """
+        Extract specific entities from many texts, see `EntityExtractor.extract_many`.
+
+        The entities of a text are the highest-scoring entities of each type among its lines.
+        """
+        text_lines = [criteria_lines(text) for text in texts]
+        distinct_lines = list(dict.fromkeys(line for lines in text_lines for line in lines))
+        extracted = self.extractor.extract_many(distinct_lines, target_entities, batch_size, with_scores=True)
+        line_entities = dict(zip(distinct_lines, extracted))
+
+        if self.metrics is not None:
+            self.metrics.increment('ner_lines', sum(map(len, text_lines)))
+            self.metrics.increment('ner_distinct_lines', len(distinct_lines))
+        results = [best_scored_entities(line_entities[line] for line in lines) for lines in text_lines]
+        if with_scores:
+            return results
+        return [{key: entity['entity'] for key, entity in entities.items()} for entities in results]
@@ -0,0 +1,81 @@
+import hashlib
+import json
+
+from models.entity_extractor import ENTITY_KEYS
+
+# Part of every cache key: rows of an earlier layout of the cache table (e.g. without scores) are never served
+CACHE_FORMAT = 2
+
+def content_hash(*parts):
+    """Hex SHA-256 of JSON-serializable `parts`, e.g. a text and the settings its entities were extracted with."""
+    key = json.dumps(list(parts), sort_keys=True)
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+class CachedEntityExtractor:
+    def __init__(self, extractor, data_pipeline, model_settings, metrics=None):
+        """
+        Serve `extract_many` from the NER cache table, running the model only on texts it has not seen before.
+
+        Args:
+            extractor: The EntityExtractor (or EntityExtractorPool) running the model on cache misses.
+            data_pipeline (DataPipeline): The pipeline of the database holding the cache table.
+            model_settings (dict): Everything besides the text that determines the entities: model name and
+                revision, aggregation strategy, windows. They are part of the cache key, so changing any of
+                them starts a new cache instead of serving stale results.
+            metrics (RunMetrics): Counts ner_cache_hits and ner_cache_misses (texts run through the model).
+        """
+        self.extractor = extractor
+        self.data_pipeline = data_pipeline
+        self.model_settings = model_settings
+        self.metrics = metrics
+        self.pending = {}  # Results extracted since the last `flush`, by cache key
+
+    def cache_key(self, text, target_entities):
+        return content_hash(CACHE_FORMAT, self.model_settings, list(target_entities), text)
+
+    def extract_many(self, texts, target_entities=['DISEASE_DISORDER', 'MEDICATION'], batch_size=16, with_scores=False):
+        """
+        Extract specific entities from many texts, see `EntityExtractor.extract_many`.
+
+        Cached texts are served from the cache table; the others run through the model once each, however
+        many times they occur in `texts`, and their results are kept for the next `flush`. The cache holds
+        the entities with their scores, so it serves both forms of results.
+        """
+        keys = [self.cache_key(text, target_entities) for text in texts]
+        cached = {key: self.pending[key] for key in keys if key in self.pending}
+        cached_rows = self.data_pipeline.get_ner_results({key for key in keys if key not in cached})
+        cached.update((key, scored_entities(row)) for key, row in cached_rows.items())
+
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in cached:
+                missing.setdefault(key, text)
+        extracted = self.extractor.extract_many(list(missing.values()), target_entities, batch_size, with_scores=True)
+        for key, entities in zip(missing, extracted):
+            cached[key] = self.pending[key] = entities
+
+        if self.metrics is not None:
+            self.metrics.increment('ner_cache_hits', len(texts) - len(missing))
+            self.metrics.increment('ner_cache_misses', len(missing))
+        if with_scores:
+            return [cached[key] for key in keys]
+        return [{key: entity['entity'] for key, entity in cached[key].items()} for key in keys]
+
+    def flush(self):
+        """Store the results extracted since the last flush in the cache table."""
+        if self.pending:
+            self.data_pipeline.save_ner_results([cache_row(key, entities) for key, entities in self.pending.items()])
+            self.pending = {}
+
+def scored_entities(row):
+    """The scored entities of a cache table row."""
+    return {key: {'entity': row[key], 'score': row[f'{key}_score']} for key in ENTITY_KEYS.values()}
+
+def cache_row(cache_key, entities):
+    """The cache table row of scored entities."""
+    row = {'cache_key': cache_key}
+    for key, entity in entities.items():
+        row[key] = entity['entity']
+        # No entity of the type found: the score 0 is a placeholder, not a score
+        row[f'{key}_score'] = entity['score'] or None
+    return row
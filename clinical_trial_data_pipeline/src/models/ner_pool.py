@@ -0,0 +1,61 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import torch
+
+from models.entity_extractor import EntityExtractor
+
+# The EntityExtractor of a worker process, loaded once when the process starts
+worker_extractor = None
+
+def init_worker(extractor_kwargs, threads):
+    global worker_extractor
+    torch.set_num_threads(threads)
+    worker_extractor = EntityExtractor(**extractor_kwargs)
+
+def extract_batch(texts, target_entities, batch_size, with_scores):
+    return worker_extractor.extract_many(texts, target_entities, batch_size, with_scores)
+
+class EntityExtractorPool:
+    def __init__(self, workers, threads_per_worker=None, **extractor_kwargs):
+        """
+        Run NER in `workers` processes, each with its own EntityExtractor, behind the `extract_many` API.
+
+        Args:
+            workers (int): Number of worker processes; each loads the model once.
+            threads_per_worker (int): Torch intra-op threads of each worker. Defaults to the cores divided
+                between the workers, so the workers together do not run more threads than there are cores.
+            **extractor_kwargs: Arguments of the EntityExtractor of each worker.
+        """
+        threads = threads_per_worker or max(1, (os.cpu_count() or 1) // workers)
+        # Spawned, not forked: forking a process whose torch thread pools are already running can deadlock
+        self.executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=init_worker,
+            initargs=(extractor_kwargs, threads)
+        )
+
+    def extract_many(self, texts, target_entities=['DISEASE_DISORDER', 'MEDICATION'], batch_size=16, with_scores=False):
+        """
+        Extract specific entities from many texts on the worker processes, see `EntityExtractor.extract_many`.
+
+        The texts are sorted by length and queued as batches of `batch_size`; idle workers take the next batch,
+        and the results are returned in the order of `texts`.
+        """
+        order = sorted(range(len(texts)), key=lambda index: len(texts[index]))
+        futures = [
+            self.executor.submit(extract_batch, [texts[index] for index in order[start:start + batch_size]],
+                                 target_entities, batch_size, with_scores)
+            for start in range(0, len(order), batch_size)
+        ]
+        extracted = [None] * len(texts)
+        positions = iter(order)
+        for future in futures:
+            for entities in future.result():
+                extracted[next(positions)] = entities
+        return extracted
+
+    def shutdown(self):
+        self.executor.shutdown()
@@ -0,0 +1,100 @@
+import inspect
+import logging
+import os
+
+import torch
+from transformers import AutoConfig, AutoModelForTokenClassification, AutoTokenizer
+
+try:
+    import onnxruntime
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+except ImportError:  # Only the onnx backend needs it
+    onnxruntime = None
+
+def model_revision(model_name, revision=None):
+    """Commit hash of the `revision` (None: the latest) of a Hugging Face model, None for a local model directory."""
+    return AutoConfig.from_pretrained(model_name, revision=revision)._commit_hash
+
+def export_onnx_model(model_name, revision, path):
+    """Export a token classification model to ONNX at `path`, with dynamic batch and sequence axes."""
+    model = AutoModelForTokenClassification.from_pretrained(model_name, revision=revision).eval()
+    tokenizer = AutoTokenizer.from_pretrained(model_name, revision=revision)
+    sample = tokenizer(['Inclusion Criteria:', 'Adults aged 18 or older'], padding=True, return_tensors='pt')
+    # The graph takes its inputs in the order of the forward arguments, whatever the order of the tokenizer outputs
+    input_names = [name for name in inspect.signature(model.forward).parameters if name in sample]
+    dynamic_axes = {name: {0: 'batch', 1: 'sequence'} for name in input_names + ['logits']}
+    with torch.no_grad():
+        torch.onnx.export(model, (dict(sample),), path, input_names=input_names, output_names=['logits'],
+                          dynamic_axes=dynamic_axes, opset_version=17, dynamo=False)
+
+def onnx_model_path(model_name, revision, onnx_dir, quantize=False):
+    """
+    Path of the ONNX export of a token classification model, exported (and quantized) on first use only.
+
+    Exports are kept in `onnx_dir`, one directory per model commit, so a new revision of the model is exported
+    again. A local model directory has no commit: delete its export to export it again.
+
+    Args:
+        model_name (str): Hugging Face model name or local model directory.
+        revision (str): The model revision to export; None exports the latest one.
+        onnx_dir (str): Directory of the cached exports.
+        quantize (bool): Return the export with its weights dynamically quantized to int8.
+    """
+    commit = model_revision(model_name, revision)
+    model_dir = os.path.join(onnx_dir, model_name.strip(os.sep).replace('/', '--'), commit or 'local')
+    exported = os.path.join(model_dir, 'model.onnx')
+    path = os.path.join(model_dir, 'model.int8.onnx') if quantize else exported
+    if os.path.exists(path):
+        return path
+
+    os.makedirs(model_dir, exist_ok=True)
+    # Written under a temporary name and renamed, so concurrent NER workers never load a partial export
+    temporary_path = os.path.join(model_dir, f'.{os.getpid()}.onnx')
+    if not os.path.exists(exported):
+        export_onnx_model(model_name, revision, temporary_path)
+        os.replace(temporary_path, exported)
+    if quantize:
+        # quantize_dynamic logs through the root logger, which adds a handler duplicating every log of the run
+        root_handlers = list(logging.root.handlers)
+        quantize_dynamic(exported, temporary_path, weight_type=QuantType.QInt8)
+        logging.root.handlers = root_handlers
+        os.replace(temporary_path, path)
+    return path
+
+class OnnxTokenClassifier:
+    def __init__(self, path, config):
+        """
+        An ONNX Runtime session standing in for the PyTorch model of a token classification pipeline.
+
+        It takes the tensors of the tokenizer and returns the logits as a tensor, so the windowing, batching
+        and aggregation of the pipeline are unchanged.
+
+        Args:
+            path (str): The ONNX model, see `onnx_model_path`.
+            config (PretrainedConfig): Configuration of the exported model, for its labels.
+        """
+        options = onnxruntime.SessionOptions()
+        # As many threads as torch, which the NER worker pool sizes to share the cores
+        options.intra_op_num_threads = torch.get_num_threads()
+        self.session = onnxruntime.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+        self.input_names = {session_input.name for session_input in self.session.get_inputs()}
+        self.config = config
+        self.device = torch.device('cpu')
+
+    def __call__(self, **inputs):
+        feed = {name: tensor.numpy() for name, tensor in inputs.items() if name in self.input_names}
+        return {'logits': torch.from_numpy(self.session.run(['logits'], feed)[0])}
+
+class UnsupportedModelFilter(logging.Filter):
+    """Drops the error a transformers pipeline logs for a model that is not one of its PyTorch model classes."""
+
+    def filter(self, record):
+        message = record.getMessage()
+        return not (message.startswith(f"The model '{OnnxTokenClassifier.__name__}'") and 'is not supported for' in message)
+
+def load_onnx_model(model_name, revision, onnx_dir, quantize=False):
+    """Load the (cached) ONNX export of a token classification model, see `onnx_model_path`."""
+    if onnxruntime is None:
+        raise ValueError("The onnx NER backend requires the onnxruntime and onnx packages")
+    path = onnx_model_path(model_name, revision, onnx_dir, quantize)
+    return OnnxTokenClassifier(path, AutoConfig.from_pretrained(model_name, revision=revision))
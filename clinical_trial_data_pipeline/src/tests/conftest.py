@@ -0,0 +1,169 @@
+import json
+import os
+import re
+import sys
+
+import duckdb
+import pytest
+
+# Add the src directory to the Python path
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import main
+from utils.api_client import APIClient
+
+LAST_UPDATE_RANGE = re.compile(r'AREA\[LastUpdatePostDate\]RANGE\[([^,\]]+),MAX\]')
+
+def make_study(number, status='RECRUITING', last_update='2024-01-10', start_date='2020-01',
+               criteria='Inclusion Criteria:\n* Adults with type 2 diabetes\nExclusion Criteria:\n* Prior metformin use',
+               conditions=('Diabetes',), phases=('PHASE2',), interventions=('Metformin',), locations=('Berlin',)):
+    """A raw API study; a list given as None leaves its key out of the study."""
+    protocol = {
+        'identificationModule': {'nctId': f'NCT{number:08d}', 'briefTitle': f'Study {number}'},
+        'statusModule': {
+            'overallStatus': status,
+            'startDateStruct': {'date': start_date},
+            'lastUpdatePostDateStruct': {'date': last_update},
+        },
+        'eligibilityModule': {'eligibilityCriteria': criteria, 'sex': 'ALL', 'minimumAge': '18 Years'},
+        'conditionsModule': {},
+        'designModule': {'studyType': 'INTERVENTIONAL'},
+        'armsInterventionsModule': {},
+        'contactsLocationsModule': {},
+    }
+    if conditions is not None:
+        protocol['conditionsModule']['conditions'] = list(conditions)
+    if phases is not None:
+        protocol['designModule']['phases'] = list(phases)
+    if interventions is not None:
+        protocol['armsInterventionsModule']['interventions'] = [{'type': 'DRUG', 'name': name} for name in interventions]
+    if locations is not None:
+        protocol['contactsLocationsModule']['locations'] = [{'city': city, 'country': 'Germany'} for city in locations]
+    return {'protocolSection': protocol}
+
+class FakeResponse:
+    def __init__(self, status_code=200, content=b'{}', headers=None):
+        """A `requests` response to a stream=True request whose body was `content` on the wire."""
+        self.status_code = status_code
+        self.ok = status_code < 400
+        self.content = content
+        self.text = content.decode('utf-8')
+        self.headers = headers or {}
+        self.raw = FakeRawResponse(len(content))
+
+class FakeRawResponse:
+    def __init__(self, size):
+        self.size = size
+
+    def tell(self):
+        return self.size
+
+class FakeAPI:
+    def __init__(self, studies, page_size=2):
+        """
+        In-memory studies endpoint serving `studies` `page_size` at a time along a pageToken chain.
+
+        Supports the status filter, the lastUpdatePostDate range filter and the ascending
+        lastUpdatePostDate sort the pipeline sends; every request's params are kept in `requests`.
+        """
+        self.studies = studies
+        self.page_size = page_size
+        self.requests = []
+        self.fail_after = None  # Number of requests served before every request fails
+        self.failing_status = None  # Requests filtered on this overallStatus fail
+        self.throttled = 0  # Number of requests answered 429 Too Many Requests before any is served
+        self.retry_after = None  # Retry-After header of the 429 responses
+
+    def get(self, url, params=None, stream=False):
+        """Answer like a `requests` session, so an APIClient's retries and rate limiting can run against the fake."""
+        if self.throttled:
+            self.throttled -= 1
+            headers = {'Retry-After': self.retry_after} if self.retry_after is not None else {}
+            return FakeResponse(429, b'Too Many Requests', headers)
+        return FakeResponse(200, self.fetch_raw(params or {}))
+
+    def fetch_raw(self, params):
+        if self.fail_after is not None and len(self.requests) >= self.fail_after:
+            raise ConnectionError('fake API unavailable')
+        if self.failing_status and self.failing_status in params.get('filter.overallStatus', '').split(','):
+            raise ConnectionError(f'fake API unavailable for {self.failing_status}')
+        self.requests.append(dict(params))
+        studies = self.matching(params)
+        offset = int(params.get('pageToken', 0))
+        end = offset + min(self.page_size, params.get('pageSize', self.page_size))
+        page = {'studies': studies[offset:end]}
+        if end < len(studies):
+            page['nextPageToken'] = str(end)
+        return json.dumps(page).encode('utf-8')
+
+    def matching(self, params):
+        studies = list(self.studies)
+        if params.get('filter.overallStatus'):
+            statuses = params['filter.overallStatus'].split(',')
+            studies = [study for study in studies if study['protocolSection']['statusModule']['overallStatus'] in statuses]
+        last_update = LAST_UPDATE_RANGE.search(params.get('filter.advanced', ''))
+        if last_update:
+            studies = [study for study in studies if last_update_date(study) >= last_update.group(1)]
+        if params.get('sort') == 'LastUpdatePostDate:asc':
+            studies.sort(key=last_update_date)
+        return studies
+
+def last_update_date(study):
+    return study['protocolSection']['statusModule']['lastUpdatePostDateStruct']['date']
+
+class StubEntityExtractor:
+    # Every text sent to the model, by any instance
+    texts = []
+
+    def __init__(self, **kwargs):
+        pass
+
+    def extract_many(self, texts, target_entities=['DISEASE_DISORDER', 'MEDICATION'], batch_size=16, with_scores=False):
+        StubEntityExtractor.texts.extend(texts)
+        extracted = []
+        for text in texts:
+            entities = {
+                'diseases': {'entity': 'diabetes', 'score': 0.9} if 'diabetes' in text.lower() else {'entity': '', 'score': 0},
+                'medications': {'entity': 'metformin', 'score': 0.8} if 'metformin' in text.lower() else {'entity': '', 'score': 0},
+            }
+            extracted.append(entities if with_scores else {key: entity['entity'] for key, entity in entities.items()})
+        return extracted
+
+@pytest.fixture
+def run_main(tmp_path, monkeypatch):
+    """
+    Run `main.main` against a FakeAPI, with the stub NER model and a DuckDB file in `tmp_path`.
+
+    Consecutive calls in one test share the database, the dlt pipeline and the checkpoint, like monthly runs.
+    """
+    monkeypatch.setenv('DLT_DATA_DIR', str(tmp_path / 'dlt'))
+    monkeypatch.setattr(main, 'DUCKDB_FILE_PATH', str(tmp_path / 'studies.duckdb'))
+    monkeypatch.setattr(main, 'CHECKPOINT_PATH', str(tmp_path / 'checkpoint.json'))
+    monkeypatch.setattr(main, 'ARCHIVE_DIR', None)
+    monkeypatch.setattr(main, 'MAX_PAGES', None)
+    monkeypatch.setattr(main, 'TARGET_STATUSES', ['RECRUITING'])
+    monkeypatch.setattr(main, 'RATE_LIMIT_PER_SECOND', None)
+    monkeypatch.setattr(main, 'EntityExtractor', StubEntityExtractor)
+    monkeypatch.setattr(main, 'model_revision', lambda model_name, revision=None: None)
+    monkeypatch.setattr(StubEntityExtractor, 'texts', [])
+
+    def run(api, *flags):
+        monkeypatch.setattr(APIClient, 'fetch_raw', lambda client, params: api.fetch_raw(params))
+        monkeypatch.setattr(sys, 'argv', ['main.py', '--checkpoint-pages', '1', *flags])
+        with pytest.raises(SystemExit) as exit_info:
+            main.main()
+        assert exit_info.value.code == 0
+
+    run.database = main.DUCKDB_FILE_PATH
+    run.checkpoint_path = main.CHECKPOINT_PATH
+    return run
+
+def query(database, sql):
+    """Rows of `sql` run in the dataset schema of the pipeline's DuckDB file."""
+    connection = duckdb.connect(database, read_only=True)
+    try:
+        schema = connection.execute("SELECT schema_name FROM duckdb_tables() WHERE table_name = '_dlt_loads'").fetchone()[0]
+        connection.execute(f'SET schema = {schema!r}')
+        return connection.execute(sql).fetchall()
+    finally:
+        connection.close()
@@ -0,0 +1,113 @@
+import pytest
+from requests import exceptions as request_exceptions
+
+from conftest import FakeAPI, FakeResponse, make_study
+from utils.api_client import APIClient, status_shards
+from utils.checkpoint import ExtractionCheckpoint
+from utils.page_archive import PageArchive
+from utils.run_metrics import RunMetrics
+from utils.retry import RetryPolicy
+from utils.sql_transform import sql_transform
+from utils.study_decoder import decode_page
+
+class FlakySession:
+    def __init__(self, errors):
+        """Session whose `get` raises each of `errors` in turn, then answers."""
+        self.errors = list(errors)
+        self.calls = 0
+
+    def get(self, url, params=None, stream=False):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return FakeResponse()
+
+@pytest.mark.parametrize('error', [
+    request_exceptions.ConnectionError('reset'),
+    request_exceptions.Timeout('read timed out'),
+    request_exceptions.ChunkedEncodingError('connection broken mid-body'),
+    request_exceptions.ContentDecodingError('truncated gzip stream'),
+])
+def test_fetch_raw_retries_transient_failures(error):
+    client = APIClient('https://example.org/studies', retry_policy=RetryPolicy(backoff_base=0))
+    client.session = FlakySession([error, error])
+    assert client.fetch_raw({}) == b'{}'
+    assert client.session.calls == 3
+
+def test_fetch_raw_raises_once_the_attempts_are_spent():
+    client = APIClient('https://example.org/studies', retry_policy=RetryPolicy(max_attempts=2, backoff_base=0))
+    client.session = FlakySession([request_exceptions.ChunkedEncodingError('connection broken mid-body')] * 2)
+    with pytest.raises(request_exceptions.ChunkedEncodingError):
+        client.fetch_raw({})
+
+def sharded_client(api):
+    client = APIClient('https://example.org/studies')
+    client.fetch_raw = api.fetch_raw
+    return client
+
+def nct_ids(pages):
+    return sorted(study['protocolSection']['identificationModule']['nctId'] for page in pages for study in page['studies'])
+
+def test_iter_pages_walks_the_page_token_chain():
+    api = FakeAPI([make_study(number) for number in range(5)])
+    pages = list(sharded_client(api).iter_pages({'pageSize': 2}))
+    assert [len(page['studies']) for page in pages] == [2, 2, 1]
+    assert [request.get('pageToken') for request in api.requests] == [None, '2', '4']
+
+def test_sharded_pages_cover_every_shard_once():
+    api = FakeAPI([make_study(number, status=status)
+                   for number, status in enumerate(['RECRUITING', 'COMPLETED', 'RECRUITING', 'WITHDRAWN', 'RECRUITING'])])
+    shards = status_shards(['RECRUITING', 'COMPLETED', 'WITHDRAWN'])
+    pages = list(sharded_client(api).iter_sharded_pages({'pageSize': 2}, shards, workers=3))
+    assert nct_ids(pages) == [f'NCT{number:08d}' for number in range(5)]
+
+def test_studies_returned_by_several_shards_are_yielded_once():
+    api = FakeAPI([make_study(number, status='RECRUITING' if number % 2 else 'COMPLETED') for number in range(6)])
+    metrics = RunMetrics()
+    client = sharded_client(api)
+    client.metrics = metrics
+    # Overlapping shards, like a study whose status changes while the shards are walked
+    shards = [{'filter.overallStatus': 'RECRUITING'}, {'filter.overallStatus': 'RECRUITING,COMPLETED'}]
+    pages = list(client.iter_sharded_pages({'pageSize': 2}, shards, workers=2))
+    assert nct_ids(pages) == [f'NCT{number:08d}' for number in range(6)]
+    assert metrics.get('duplicate_studies_skipped') == 3
+
+def test_studies_archived_by_several_shards_are_replayed_once(tmp_path):
+    api = FakeAPI([make_study(number, status='RECRUITING' if number % 2 else 'COMPLETED') for number in range(6)])
+    client = sharded_client(api)
+    client.archive = PageArchive(str(tmp_path), 'gzip')
+    shards = [{'filter.overallStatus': 'RECRUITING'}, {'filter.overallStatus': 'RECRUITING,COMPLETED'}]
+    list(client.iter_sharded_pages({'pageSize': 2}, shards, workers=2))
+
+    # Both shards archived their pages as sent, so the RECRUITING studies are on disk twice
+    replay = PageArchive(str(tmp_path))
+    expected = [f'NCT{number:08d}' for number in range(6)]
+    assert sum(entry['studies'] for entry in replay.manifest()) == 9
+    assert nct_ids(replay.iter_pages()) == expected
+    assert nct_ids(decode_page(raw) for raw in replay.iter_raw_pages()) == expected
+    batches = sql_transform(replay.page_files(), duplicates=replay.duplicates())
+    studies = [batch for table, batch in batches if table == 'studies']
+    assert sorted(nct_id for batch in studies for nct_id in batch.column('nctId').to_pylist()) == expected
+
+def test_a_failing_shard_fails_the_sharded_fetch():
+    api = FakeAPI([make_study(number, status=status) for number, status in enumerate(['RECRUITING', 'COMPLETED'] * 10)])
+    api.failing_status = 'COMPLETED'
+    shards = status_shards(['RECRUITING', 'COMPLETED'])
+    with pytest.raises(ConnectionError, match='COMPLETED'):
+        list(sharded_client(api).iter_sharded_pages({'pageSize': 2}, shards, workers=2))
+
+def test_sharded_fetch_resumes_every_shard_from_the_checkpoint(tmp_path):
+    statuses = ['RECRUITING', 'COMPLETED', 'WITHDRAWN']
+    api = FakeAPI([make_study(number, status=statuses[number % 3]) for number in range(12)])
+    shards = status_shards(statuses)
+    checkpoint = ExtractionCheckpoint.load(str(tmp_path / 'checkpoint.json'), 'query')
+    # RECRUITING stopped after its first page, COMPLETED was walked to the end, WITHDRAWN was not started
+    checkpoint.record_page(shards[0], '2')
+    checkpoint.record_page(shards[1], '2')
+    checkpoint.record_page(shards[1], None)
+
+    pages = list(sharded_client(api).iter_sharded_pages({'pageSize': 2}, shards, workers=3, checkpoint=checkpoint))
+    assert nct_ids(pages) == sorted(f'NCT{number:08d}' for number in (6, 9, 2, 5, 8, 11))
+    requests = sorted((request['filter.overallStatus'], request.get('pageToken', '')) for request in api.requests)
+    assert requests == [('RECRUITING', '2'), ('WITHDRAWN', ''), ('WITHDRAWN', '2')]
+    assert checkpoint.is_finished(shards[0]) and checkpoint.is_finished(shards[2])
@@ -0,0 +1,40 @@
+from utils.checkpoint import ExtractionCheckpoint, query_key
+
+def test_fresh_checkpoint_is_not_resumed(tmp_path):
+    checkpoint = ExtractionCheckpoint.load(str(tmp_path / 'checkpoint.json'), 'query')
+    assert not checkpoint.resumed
+    assert checkpoint.resume_params({'pageSize': 1000}) == {'pageSize': 1000}
+
+def test_saved_checkpoint_resumes_after_the_last_recorded_page(tmp_path):
+    path = str(tmp_path / 'checkpoint.json')
+    checkpoint = ExtractionCheckpoint.load(path, 'query')
+    checkpoint.record_page(None, 'token-2')
+    checkpoint.record_page({'filter.overallStatus': 'RECRUITING'}, None)
+    checkpoint.watermark = '2024-01-10'
+    checkpoint.save()
+
+    resumed = ExtractionCheckpoint.load(path, 'query')
+    assert resumed.resumed
+    assert resumed.pages == 2
+    assert resumed.watermark == '2024-01-10'
+    assert resumed.resume_params({'pageSize': 1000}) == {'pageSize': 1000, 'pageToken': 'token-2'}
+    assert resumed.is_finished({'filter.overallStatus': 'RECRUITING'})
+    assert not resumed.is_finished(None)
+
+def test_checkpoint_of_another_query_is_ignored(tmp_path):
+    path = str(tmp_path / 'checkpoint.json')
+    checkpoint = ExtractionCheckpoint.load(path, query_key({'pageSize': 1000}, write_disposition='replace'))
+    checkpoint.record_page(None, 'token-2')
+    checkpoint.save()
+
+    other = ExtractionCheckpoint.load(path, query_key({'pageSize': 1000}, write_disposition='merge'))
+    assert not other.resumed
+
+def test_cleared_checkpoint_starts_from_scratch(tmp_path):
+    path = str(tmp_path / 'checkpoint.json')
+    checkpoint = ExtractionCheckpoint.load(path, 'query')
+    checkpoint.record_page(None, 'token-2')
+    checkpoint.save()
+    checkpoint.clear()
+
+    assert not ExtractionCheckpoint.load(path, 'query').resumed
@@ -0,0 +1,129 @@
+import json
+import os
+from datetime import date
+
+import pytest
+
+import main
+from conftest import FakeAPI, make_study, query
+from utils.data_pipeline import DataPipeline
+
+def test_full_run_loads_studies_and_child_tables(run_main):
+    studies = [make_study(number, status='RECRUITING' if number % 2 else 'COMPLETED') for number in range(5)]
+    run_main(FakeAPI(studies))
+
+    assert query(run_main.database, 'SELECT count(*), count(DISTINCT nct_id) FROM studies') == [(5, 5)]
+    assert query(run_main.database, 'SELECT count(*) FROM filtered_studies') == [(2,)]
+    assert query(run_main.database, 'SELECT DISTINCT diseases, medications FROM filtered_studies') == [('diabetes', 'metformin')]
+    for table in ('study_locations', 'study_interventions', 'study_conditions', 'study_phases'):
+        assert query(run_main.database, f'SELECT count(*) FROM {table}') == [(5,)]
+    # A completed run leaves no checkpoint behind
+    assert not os.path.exists(run_main.checkpoint_path)
+
+def test_repeated_full_runs_replace_the_tables(run_main):
+    api = FakeAPI([make_study(number) for number in range(5)])
+    for _ in range(3):
+        run_main(api)
+
+    assert query(run_main.database, 'SELECT count(*), count(DISTINCT nct_id) FROM studies') == [(5, 5)]
+    for table in ('study_locations', 'study_interventions', 'study_conditions', 'study_phases'):
+        assert query(run_main.database, f'SELECT count(*) FROM {table}') == [(5,)]
+
+def test_interrupted_full_run_resumes_after_the_last_loaded_chunk(run_main):
+    api = FakeAPI([make_study(number) for number in range(5)])
+    # The two field projection samples and the first two pages are served, then the API goes down
+    api.fail_after = 4
+    with pytest.raises(ConnectionError):
+        run_main(api)
+    assert query(run_main.database, 'SELECT count(*) FROM studies') == [(4,)]
+    assert json.load(open(run_main.checkpoint_path))['pages'] == 2
+
+    api.fail_after = None
+    api.requests.clear()
+    run_main(api)
+    assert query(run_main.database, 'SELECT count(*), count(DISTINCT nct_id) FROM studies') == [(5, 5)]
+    # Only the page that was not loaded is fetched again (after the two field projection samples)
+    assert [request.get('pageToken') for request in api.requests[2:]] == ['4']
+
+def test_incremental_run_replaces_the_child_rows_of_updated_studies(run_main):
+    api = FakeAPI([make_study(0, conditions=('Diabetes', 'Obesity'), locations=('Berlin', 'Paris')),
+                   make_study(1, phases=('PHASE2', 'PHASE3'), interventions=('Metformin', 'Placebo')),
+                   make_study(2)])
+    run_main(api, '--incremental')
+
+    # Study 0 drops a condition and all its locations, study 1 drops its phases and an intervention
+    api.studies[:2] = [make_study(0, last_update='2024-02-01', conditions=('Diabetes',), locations=()),
+                       make_study(1, last_update='2024-02-01', phases=None, interventions=('Metformin',))]
+    run_main(api, '--incremental')
+
+    assert query(run_main.database, 'SELECT nct_id, condition FROM study_conditions ORDER BY ALL') == [
+        ('NCT00000000', 'Diabetes'), ('NCT00000001', 'Diabetes'), ('NCT00000002', 'Diabetes')]
+    assert query(run_main.database, 'SELECT nct_id, city FROM study_locations ORDER BY ALL') == [
+        ('NCT00000001', 'Berlin'), ('NCT00000002', 'Berlin')]
+    assert query(run_main.database, 'SELECT nct_id, phase FROM study_phases ORDER BY ALL') == [
+        ('NCT00000000', 'PHASE2'), ('NCT00000002', 'PHASE2')]
+    assert query(run_main.database, 'SELECT nct_id, name FROM study_interventions ORDER BY ALL') == [
+        ('NCT00000000', 'Metformin'), ('NCT00000001', 'Metformin'), ('NCT00000002', 'Metformin')]
+
+def test_full_run_recreates_the_tables_of_a_baseline_database(run_main):
+    # The pipeline used to load every column as text, into tables named studies and filtered_studies
+    baseline = DataPipeline('clinical_trial_pipeline', run_main.database, run_main.database)
+    row = {'nctId': 'NCT99999999', 'overallStatus': 'RECRUITING', 'startDate': '2020-01',
+           'primaryCompletionDate': 'Unknown Date', 'studyFirstPostDate': '2019-12-01', 'lastUpdatePostDate': '2024-01-10'}
+    baseline.load_data([row], 'studies', write_disposition='replace')
+    baseline.load_data([row], 'filtered_studies', write_disposition='replace')
+    date_types = ("SELECT column_name, data_type FROM information_schema.columns WHERE table_name = 'studies' "
+                  "AND column_name IN ('start_date', 'primary_completion_date', 'study_first_post_date', "
+                  "'last_update_post_date') ORDER BY column_name")
+    assert {data_type for _, data_type in query(run_main.database, date_types)} == {'VARCHAR'}
+
+    run_main(FakeAPI([make_study(number) for number in range(3)]))
+    assert query(run_main.database, date_types) == [
+        ('last_update_post_date', 'DATE'), ('primary_completion_date', 'DATE'),
+        ('start_date', 'DATE'), ('study_first_post_date', 'DATE')]
+    assert query(run_main.database, 'SELECT count(*), min(start_date) FROM studies') == [(3, date(2020, 1, 1))]
+    filtered_type = "SELECT table_type FROM information_schema.tables WHERE table_name = 'filtered_studies'"
+    assert query(run_main.database, filtered_type) == [('VIEW',)]
+
+def test_run_resumed_after_a_crash_between_normalize_and_load_loads_each_chunk_once(run_main, monkeypatch):
+    api = FakeAPI([make_study(number) for number in range(6)])
+    store_categories = main.store_categories
+    calls = []
+
+    def crash_before_the_second_load(*args, **kwargs):
+        # Called by before_load, once the chunk is extracted and normalized but not loaded yet
+        calls.append(args)
+        if len(calls) == 2:
+            raise RuntimeError('killed between normalize and load')
+        return store_categories(*args, **kwargs)
+
+    monkeypatch.setattr(main, 'store_categories', crash_before_the_second_load)
+    with pytest.raises(RuntimeError):
+        run_main(api)
+    monkeypatch.setattr(main, 'store_categories', store_categories)
+
+    run_main(api)
+    assert query(run_main.database, 'SELECT count(*), count(DISTINCT nct_id) FROM studies') == [(6, 6)]
+    for table in ('study_locations', 'study_interventions', 'study_conditions', 'study_phases'):
+        assert query(run_main.database, f'SELECT count(*) FROM {table}') == [(6,)]
+
+def test_new_category_in_a_later_chunk_extends_the_enum(run_main):
+    api = FakeAPI([make_study(number, status='RECRUITING' if number % 2 else 'COMPLETED') for number in range(4)])
+    run_main(api, '--incremental')
+    # Not the staging copy of the table, which dlt merges from
+    enum_type = ("SELECT data_type FROM information_schema.columns WHERE table_name = 'studies' "
+                 "AND column_name = 'overall_status' AND table_schema NOT LIKE '%_staging'")
+    assert query(run_main.database, enum_type) == [("ENUM('COMPLETED', 'RECRUITING')",)]
+
+    # Two updated pages, loaded as two chunks: only the second one holds a status and a phase the ENUMs lack
+    api.studies[:4] = [make_study(0, last_update='2024-02-01'), make_study(1, last_update='2024-02-01'),
+                       make_study(2, status='ACTIVE_NOT_RECRUITING', last_update='2024-02-01', phases=('PHASE4',)),
+                       make_study(3, last_update='2024-02-01')]
+    run_main(api, '--incremental')
+
+    assert query(run_main.database, enum_type) == [("ENUM('COMPLETED', 'RECRUITING', 'ACTIVE_NOT_RECRUITING')",)]
+    assert query(run_main.database, 'SELECT nct_id, overall_status FROM studies ORDER BY nct_id') == [
+        ('NCT00000000', 'RECRUITING'), ('NCT00000001', 'RECRUITING'),
+        ('NCT00000002', 'ACTIVE_NOT_RECRUITING'), ('NCT00000003', 'RECRUITING')]
+    assert query(run_main.database, 'SELECT nct_id, phase FROM study_phases ORDER BY ALL') == [
+        ('NCT00000000', 'PHASE2'), ('NCT00000001', 'PHASE2'), ('NCT00000002', 'PHASE4'), ('NCT00000003', 'PHASE2')]
@@ -0,0 +1,88 @@
+import logging
+
+import pytest
+
+from conftest import FakeAPI, StubEntityExtractor, make_study, query
+from models.ner_cache import CachedEntityExtractor, content_hash
+from models.onnx_backend import UnsupportedModelFilter
+from utils.data_pipeline import DataPipeline
+
+def test_cached_criteria_lines_are_not_sent_to_the_model_again(run_main):
+    api = FakeAPI([make_study(number) for number in range(3)])
+    run_main(api, '--no-ner-incremental')
+    # Line dedup: the shared criteria go through the model once per distinct line
+    assert sorted(StubEntityExtractor.texts) == [
+        'Adults with type 2 diabetes', 'Exclusion Criteria:', 'Inclusion Criteria:', 'Prior metformin use']
+
+    StubEntityExtractor.texts.clear()
+    run_main(api, '--no-ner-incremental')
+    assert StubEntityExtractor.texts == []
+    assert query(run_main.database, 'SELECT DISTINCT diseases, medications FROM studies') == [('diabetes', 'metformin')]
+
+def test_entities_of_unchanged_criteria_are_carried_forward(run_main):
+    api = FakeAPI([make_study(number) for number in range(3)])
+    run_main(api, '--no-ner-cache')
+
+    StubEntityExtractor.texts.clear()
+    api.studies[1] = make_study(1, criteria='Inclusion Criteria:\n* Adults with asthma')
+    run_main(api, '--no-ner-cache')
+    # Only the changed criteria went through the model, the other studies kept their entities
+    assert sorted(StubEntityExtractor.texts) == ['Adults with asthma', 'Inclusion Criteria:']
+    assert query(run_main.database, 'SELECT nct_id, diseases, medications FROM studies ORDER BY nct_id') == [
+        ('NCT00000000', 'diabetes', 'metformin'), ('NCT00000001', '', ''), ('NCT00000002', 'diabetes', 'metformin')]
+
+def test_resumed_full_refresh_carries_forward_the_entities_of_the_replaced_rows(run_main):
+    api = FakeAPI([make_study(number) for number in range(6)])
+    run_main(api, '--no-ner-cache')
+    snapshot_exists = "SELECT count(*) FROM duckdb_tables() WHERE table_name = 'ner_snapshot'"
+    assert query(run_main.database, snapshot_exists) == [(0,)]
+
+    # The two field projection samples and the first page are served: the refresh replaced studies with 2 rows
+    StubEntityExtractor.texts.clear()
+    api.requests.clear()
+    api.fail_after = 3
+    with pytest.raises(ConnectionError):
+        run_main(api, '--no-ner-cache')
+    assert query(run_main.database, 'SELECT count(*) FROM studies') == [(2,)]
+    assert query(run_main.database, snapshot_exists) == [(1,)]
+
+    api.fail_after = None
+    run_main(api, '--no-ner-cache')
+    # The snapshot of the failed run still held every study, so none went through the model again
+    assert StubEntityExtractor.texts == []
+    assert query(run_main.database, 'SELECT count(*), count(diseases) FROM studies WHERE diseases = \'diabetes\'') == [(6, 6)]
+    assert query(run_main.database, snapshot_exists) == [(0,)]
+
+def test_rows_of_a_cache_table_without_scores_are_not_served(tmp_path, monkeypatch):
+    monkeypatch.setenv('DLT_DATA_DIR', str(tmp_path / 'dlt'))
+    monkeypatch.setattr(StubEntityExtractor, 'texts', [])
+    database = str(tmp_path / 'studies.duckdb')
+    data_pipeline = DataPipeline('clinical_trial_pipeline', database, database)
+    settings = {'model_name': 'stub'}
+    targets = ['DISEASE_DISORDER', 'MEDICATION']
+    text = 'Adults with type 2 diabetes on metformin'
+    # The cache table as first released: keyed by settings, targets and text, without scores
+    data_pipeline.pipeline.run([{'cache_key': content_hash(settings, targets, text), 'diseases': 'stale',
+                                 'medications': 'stale'}], table_name='ner_cache')
+
+    extractor = CachedEntityExtractor(StubEntityExtractor(), data_pipeline, settings)
+    assert extractor.extract_many([text], targets, with_scores=True) == [
+        {'diseases': {'entity': 'diabetes', 'score': 0.9}, 'medications': {'entity': 'metformin', 'score': 0.8}}]
+    assert StubEntityExtractor.texts == [text]
+    extractor.flush()
+
+    # Once stored with their scores, the results are served from the cache
+    StubEntityExtractor.texts.clear()
+    extractor = CachedEntityExtractor(StubEntityExtractor(), data_pipeline, settings)
+    assert extractor.extract_many([text], targets) == [{'diseases': 'diabetes', 'medications': 'metformin'}]
+    assert StubEntityExtractor.texts == []
+
+def test_only_the_unsupported_model_error_of_the_onnx_wrapper_is_filtered():
+    def record(message):
+        return logging.LogRecord('transformers.pipelines.base', logging.ERROR, __file__, 1, message, None, None)
+
+    unsupported_filter = UnsupportedModelFilter()
+    assert not unsupported_filter.filter(record(
+        "The model 'OnnxTokenClassifier' is not supported for token-classification. Supported models are ['BertForTokenClassification']"))
+    assert unsupported_filter.filter(record("The model 'GPT2Model' is not supported for token-classification."))
+    assert unsupported_filter.filter(record('Device set to use cpu'))
@@ -0,0 +1,106 @@
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+from types import SimpleNamespace
+
+import pytest
+
+from conftest import FakeAPI, make_study
+from utils import api_client
+from utils.api_client import APIClient, APIRequestError
+from utils.rate_limiter import TokenBucket
+from utils.retry import RetryPolicy, parse_retry_after
+from utils.run_metrics import RunMetrics
+
+@pytest.mark.parametrize('value, seconds', [
+    ('3', 3.0),
+    ('0.5', 0.5),
+    ('-5', 0.0),
+    ('', None),
+    (None, None),
+    ('soon', None),
+    ('Wed, 21 Oct 2015 07:28:00 GMT', 0.0),
+])
+def test_parse_retry_after(value, seconds):
+    assert parse_retry_after(value) == seconds
+
+def test_parse_retry_after_http_date():
+    retry_at = datetime.now(timezone.utc) + timedelta(seconds=30)
+    assert parse_retry_after(format_datetime(retry_at, usegmt=True)) == pytest.approx(30, abs=2)
+
+def test_retry_delay_is_jittered_under_the_exponential_bound():
+    policy = RetryPolicy(backoff_base=1.0, backoff_max=10.0)
+    for attempt, bound in [(1, 1.0), (2, 2.0), (3, 4.0), (4, 8.0), (5, 10.0), (12, 10.0)]:
+        delays = [policy.delay(attempt) for _ in range(200)]
+        assert all(0 <= delay <= bound for delay in delays)
+        # Full jitter spreads the retries over the whole window
+        assert max(delays) > bound / 2 and min(delays) < bound / 2
+
+def test_retry_after_overrides_the_backoff():
+    assert RetryPolicy(backoff_max=1.0).delay(3, retry_after=7.0) == 7.0
+
+def test_token_bucket_halves_its_rate_when_penalized_and_recovers_when_rewarded():
+    bucket = TokenBucket(rate=16.0, min_rate=3.0)
+    bucket.penalize()
+    assert bucket.rate == 8.0
+    for _ in range(3):
+        bucket.penalize()
+    assert bucket.rate == 3.0  # Never below min_rate
+    bucket.reward()
+    assert bucket.rate == pytest.approx(3.8)
+    for _ in range(20):
+        bucket.reward()
+    assert bucket.rate == 16.0  # Never above the configured rate
+
+def test_penalized_token_bucket_drops_its_burst():
+    bucket = TokenBucket(rate=1000.0, capacity=5)
+    assert bucket.acquire() == 0.0
+    bucket.penalize()
+    assert bucket.acquire() > 0
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """Seconds the APIClient slept between attempts, instead of sleeping; the rate limiter still sleeps."""
+    slept = []
+    monkeypatch.setattr(api_client, 'time', SimpleNamespace(sleep=slept.append))
+    return slept
+
+def throttled_client(api, **policy):
+    client = APIClient('https://example.org/studies', metrics=RunMetrics(), retry_policy=RetryPolicy(**policy),
+                       rate_limiter=TokenBucket(rate=1000.0, capacity=10))
+    client.session = api
+    return client
+
+def test_throttled_requests_are_retried_after_the_retry_after_delay(sleeps):
+    api = FakeAPI([make_study(number) for number in range(3)])
+    api.throttled = 2
+    api.retry_after = '7'
+    client = throttled_client(api)
+
+    assert [len(page['studies']) for page in client.iter_pages({'pageSize': 2})] == [2, 1]
+    assert sleeps == [7.0, 7.0]
+    assert client.metrics.get('throttled_requests') == 2
+    assert client.metrics.get('retries') == 2
+    assert client.metrics.get('requests') == 2
+    # Halved twice by the 429s, then raised a little by each of the two pages served
+    assert client.rate_limiter.rate == pytest.approx(1000 / 4 + 2 * 1000 / 20)
+
+def test_throttled_requests_back_off_without_retry_after(sleeps):
+    api = FakeAPI([make_study(0)])
+    api.throttled = 3
+    client = throttled_client(api, backoff_base=1.0, backoff_max=3.0)
+
+    client.fetch_raw({})
+    assert len(sleeps) == 3
+    assert all(0 <= delay <= bound for delay, bound in zip(sleeps, [1.0, 2.0, 3.0]))
+
+def test_throttling_fails_the_request_once_the_attempts_are_spent(sleeps):
+    api = FakeAPI([make_study(0)])
+    api.throttled = 3
+    api.retry_after = '1'
+    client = throttled_client(api, max_attempts=3)
+
+    with pytest.raises(APIRequestError) as error_info:
+        client.fetch_raw({})
+    assert error_info.value.status_code == 429
+    assert sleeps == [1.0, 1.0]
+    assert api.requests == []
@@ -0,0 +1,64 @@
+import gzip
+import json
+import sys
+
+import pyarrow as pa
+import pytest
+
+import main
+
+from conftest import make_study
+from utils.sql_transform import sql_transform
+from utils.study_transform import transform_pages
+
+def tables(batches):
+    """Concatenate (table name, record batch) pairs into one pyarrow Table per table name."""
+    grouped = {}
+    for table, batch in batches:
+        grouped.setdefault(table, []).append(batch)
+    return {table: pa.Table.from_batches(table_batches) for table, table_batches in grouped.items()}
+
+def test_sql_engine_matches_the_python_transform(tmp_path):
+    studies = [make_study(0), make_study(1, conditions=(), phases=None, interventions=(), locations=None)]
+    studies[1]['protocolSection']['eligibilityModule']['stdAges'] = ['ADULT', 'OLDER_ADULT']
+    pages = [{'studies': studies[:1], 'nextPageToken': 't1'}, {'studies': studies[1:]}]
+    files = []
+    for number, page in enumerate(pages, start=1):
+        files.append(str(tmp_path / f'page-{number:05d}.json.gz'))
+        with gzip.open(files[-1], 'wt') as file:
+            json.dump(page, file)
+
+    expected = tables(transform_pages(pages))
+    for table, rows in tables(sql_transform(files)).items():
+        assert rows.schema == expected[table].schema
+        assert rows.to_pylist() == expected[table].to_pylist()
+
+def test_sql_engine_parses_dates_like_the_python_transform(tmp_path):
+    start_dates = ['2020-03-15', '2020-03', '2020', 'Unknown Date', '2020-13', '2021-02-30', 'soon']
+    studies = [make_study(number, start_date=start_date) for number, start_date in enumerate(start_dates)]
+    studies[0]['protocolSection']['statusModule']['primaryCompletionDateStruct'] = {'date': '2024-06'}
+    del studies[1]['protocolSection']['statusModule']['startDateStruct']
+    path = str(tmp_path / 'page-00001.json.gz')
+    with gzip.open(path, 'wt') as file:
+        json.dump({'studies': studies}, file)
+
+    columns = ['startDate', 'startDatePrecision', 'primaryCompletionDate', 'primaryCompletionDatePrecision']
+    expected = tables(transform_pages([{'studies': studies}]))['studies'].select(columns)
+    assert tables(sql_transform([path]))['studies'].select(columns) == expected
+    assert expected.column('startDatePrecision').to_pylist() == ['day', None, 'year', None, None, None, None]
+
+def test_sql_engine_reads_pretty_printed_pages(tmp_path):
+    page = {'studies': [make_study(0), make_study(1)]}
+    path = str(tmp_path / 'page-00001.json.gz')
+    with gzip.open(path, 'wt') as file:
+        json.dump(page, file, indent=2)
+
+    studies = tables(sql_transform([path]))['studies']
+    assert studies.column('nctId').to_pylist() == ['NCT00000000', 'NCT00000001']
+
+def test_sql_engine_requires_a_replayed_archive(monkeypatch, capsys):
+    monkeypatch.setattr(sys, 'argv', ['main.py', '--transform-engine', 'duckdb'])
+    with pytest.raises(SystemExit) as exit_info:
+        main.main()
+    assert exit_info.value.code == 2
+    assert '--transform-engine duckdb reads archived pages and requires --replay' in capsys.readouterr().err
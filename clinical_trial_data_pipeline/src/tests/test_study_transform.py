@@ -0,0 +1,95 @@
+from collections import Counter
+
+import datetime
+
+import pyarrow as pa
+import pytest
+
+from conftest import make_study
+from utils.age_utils import UNPARSED_AGE, age_in_years, normalize_age_column, unparsed_age_counts
+from utils.date_utils import normalize_date_column, parse_partial_date
+from utils.study_transform import NORMALIZED_AGES, flatten_columns, flatten_study, studies_record_batch
+
+def test_missing_lists_take_the_default():
+    row = flatten_study(make_study(1, conditions=None, phases=None, interventions=None, locations=None))
+    assert row['conditions'] == 'No conditions listed'
+    assert row['phases'] == 'Not Available'
+    assert row['interventions'] == 'No interventions listed'
+    assert row['locations'] == 'No locations listed'
+    assert row['stdAges'] == 'Unknown'
+
+def test_empty_lists_keep_the_semantics_of_the_hand_written_flattener():
+    study = make_study(1, conditions=(), phases=(), interventions=(), locations=())
+    study['protocolSection']['eligibilityModule']['stdAges'] = []
+    row = flatten_study(study)
+    # Empty conditions, phases and stdAges were joined into '', empty interventions and locations took the default
+    assert (row['conditions'], row['phases'], row['stdAges']) == ('', '', '')
+    assert row['interventions'] == 'No interventions listed'
+    assert row['locations'] == 'No locations listed'
+    assert {column: values[0] for column, values in flatten_columns([study]).items()} == row
+
+def test_lists_are_joined():
+    row = flatten_study(make_study(1, conditions=('Diabetes', 'Obesity'), locations=('Berlin', 'Paris')))
+    assert row['conditions'] == 'Diabetes, Obesity'
+    assert row['locations'] == 'Berlin - Germany, Paris - Germany'
+
+@pytest.mark.parametrize('age, lower, upper', [
+    ('18 Years', 18.0, 18.0),
+    ('6 Months', 0.5, 0.5),
+    ('1.5 Years', 1.5, 1.5),
+    (' 1 year ', 1.0, 1.0),
+    ('18-65 Years', 18.0, 65.0),
+    ('2 to 4 Weeks', 2 / 52, 4 / 52),
+    ('N/A', -1.0, -1.0),
+    ('none', -1.0, -1.0),
+    ('3 Fortnights', UNPARSED_AGE, UNPARSED_AGE),
+    ('Adult', UNPARSED_AGE, UNPARSED_AGE),
+])
+def test_age_in_years(age, lower, upper):
+    assert age_in_years(age, not_applicable=-1.0) == pytest.approx(lower)
+    assert age_in_years(age, upper=True, not_applicable=-1.0) == pytest.approx(upper)
+    assert normalize_age_column([age, None], upper=True, not_applicable=-1.0).to_pylist() == pytest.approx([upper, -1.0])
+
+def test_unparsed_ages_are_counted_across_batches():
+    unparsed_ages = Counter()
+    for ages in (['18 Years', 'Adult', 'Adult', 'N/A'], ['Adult', '3 Fortnights', '65 Years']):
+        studies = [make_study(number) for number in range(len(ages))]
+        for study, age in zip(studies, ages):
+            study['protocolSection']['eligibilityModule']['maximumAge'] = age
+        batch = studies_record_batch(studies)
+        for column, (age_column, _, _) in NORMALIZED_AGES.items():
+            unparsed_ages.update(unparsed_age_counts(batch.column(age_column), batch.column(column)))
+    assert unparsed_ages == {'Adult': 3, '3 Fortnights': 1}
+
+def test_ages_that_do_not_apply_take_the_default_limit():
+    studies = [make_study(0), make_study(1)]
+    studies[0]['protocolSection']['eligibilityModule'].update(minimumAge='N/A', maximumAge='N/A')
+    batch = studies_record_batch(studies)
+    # No limit, like a missing age
+    assert batch.column('normalized_minimumAge').to_pylist() == [0.0, 18.0]
+    assert batch.column('normalized_maximumAge').to_pylist() == [120.0, 120.0]
+    assert unparsed_age_counts(pa.array(['18 Years']), pa.array([18.0])) == {}
+
+@pytest.mark.parametrize('date, parsed, precision', [
+    ('2020-03-15', datetime.date(2020, 3, 15), 'day'),
+    ('2020-03', datetime.date(2020, 3, 1), 'month'),
+    ('2020', datetime.date(2020, 1, 1), 'year'),
+    ('Unknown Date', None, None),
+    ('2020-13', None, None),
+    ('2021-02-30', None, None),
+    ('20-03-15', None, None),
+    ('2020-03-15T10:00', None, None),
+])
+def test_parse_partial_date(date, parsed, precision):
+    assert parse_partial_date(date) == (parsed, precision)
+    dates, precisions = normalize_date_column(pa.array([date, None], pa.string()))
+    assert dates.to_pylist() == [parsed, None]
+    assert precisions.to_pylist() == [precision, None]
+
+def test_partial_dates_keep_their_precision():
+    studies = [make_study(number, start_date=start_date) for number, start_date in enumerate(['2020-03-15', '2020-03', '2020'])]
+    del studies[2]['protocolSection']['statusModule']['startDateStruct']
+    batch = studies_record_batch(studies)
+    assert batch.column('startDate').to_pylist() == [datetime.date(2020, 3, 15), datetime.date(2020, 3, 1), None]
+    assert batch.column('startDatePrecision').to_pylist() == ['day', 'month', None]
+    assert batch.column('primaryCompletionDatePrecision').to_pylist() == [None, None, None]
@@ -0,0 +1,94 @@
+import os
+
+import duckdb
+
+import main
+from conftest import FakeAPI, make_study, query
+from utils.watermark import Watermark
+
+def test_observe_keeps_the_highest_iso_date():
+    watermark = Watermark('last_update_post_date')
+    watermark.observe(['2024-01-10', 'Unknown Date', '2024-03-01', None, '2024-02-15'])
+    assert watermark.value == '2024-03-01'
+    assert watermark.advanced
+
+def test_watermark_without_newer_dates_does_not_advance():
+    watermark = Watermark('last_update_post_date', '2024-03-01')
+    watermark.observe(['2024-02-15', '2024-03-01'])
+    assert watermark.value == '2024-03-01'
+    assert not watermark.advanced
+
+def test_advanced_filter_includes_the_previous_date():
+    assert Watermark('last_update_post_date').advanced_filter('LastUpdatePostDate') is None
+    watermark = Watermark('last_update_post_date', '2024-03-01')
+    assert watermark.advanced_filter('LastUpdatePostDate') == 'AREA[LastUpdatePostDate]RANGE[2024-03-01,MAX]'
+
+def stored_watermarks(database):
+    return query(database, 'SELECT watermark, max(value) FROM extraction_watermarks GROUP BY watermark ORDER BY watermark')
+
+def test_full_run_stores_the_watermark_of_the_whole_chain(run_main):
+    run_main(FakeAPI([make_study(number, last_update=f'2024-01-{number + 10}') for number in range(5)]))
+    assert stored_watermarks(run_main.database) == [('last_update_post_date', '2024-01-14')]
+
+def test_full_run_cut_by_max_pages_stores_no_watermark(run_main, monkeypatch):
+    # Unsorted, so the studies left on the unfetched pages may be older than the ones loaded
+    dates = ['2024-03-01', '2024-01-01', '2024-02-01', '2024-01-15', '2024-02-15']
+    monkeypatch.setattr(main, 'MAX_PAGES', 1)
+    run_main(FakeAPI([make_study(number, last_update=date) for number, date in enumerate(dates)]))
+    assert query(run_main.database, 'SELECT count(*) FROM studies') == [(2,)]
+    assert query(run_main.database, "SELECT count(*) FROM duckdb_tables() WHERE table_name = 'extraction_watermarks'") == [(0,)]
+
+def test_incremental_run_cut_by_max_pages_stores_the_watermark_of_the_sorted_pages(run_main, monkeypatch):
+    dates = ['2024-03-01', '2024-01-01', '2024-02-01', '2024-01-15', '2024-02-15']
+    monkeypatch.setattr(main, 'MAX_PAGES', 1)
+    run_main(FakeAPI([make_study(number, last_update=date) for number, date in enumerate(dates)]), '--incremental')
+    assert stored_watermarks(run_main.database) == [('last_update_post_date', '2024-01-15')]
+
+def test_status_filtered_runs_keep_their_own_watermark(run_main):
+    api = FakeAPI([make_study(0, status='RECRUITING', last_update='2024-03-01'),
+                   make_study(1, status='COMPLETED', last_update='2024-01-01')])
+    run_main(api, '--target-statuses-only')
+    assert stored_watermarks(run_main.database) == [('last_update_post_date[RECRUITING]', '2024-03-01')]
+
+    # An unfiltered incremental run has not seen the other statuses yet, so it fetches every study
+    api.requests.clear()
+    run_main(api, '--incremental')
+    assert all('filter.advanced' not in request for request in api.requests)
+    assert query(run_main.database, 'SELECT count(*) FROM studies') == [(2,)]
+    assert stored_watermarks(run_main.database) == [('last_update_post_date', '2024-03-01'),
+                                                    ('last_update_post_date[RECRUITING]', '2024-03-01')]
+
+def archived_run(archive_dir):
+    runs = os.listdir(archive_dir)
+    assert len(runs) == 1
+    return os.path.join(archive_dir, runs[0])
+
+def test_replay_of_an_archive_cut_by_max_pages_stores_no_watermark(run_main, monkeypatch, tmp_path):
+    dates = ['2024-03-01', '2024-01-01', '2024-02-01', '2024-01-15', '2024-02-15']
+    api = FakeAPI([make_study(number, last_update=date) for number, date in enumerate(dates)])
+    monkeypatch.setattr(main, 'MAX_PAGES', 1)
+    run_main(api, '--archive-dir', str(tmp_path / 'archive'))
+
+    run_main(api, '--replay', archived_run(tmp_path / 'archive'))
+    assert query(run_main.database, "SELECT count(*) FROM duckdb_tables() WHERE table_name = 'extraction_watermarks'") == [(0,)]
+
+    # Without a watermark, the next incremental run fetches the studies the archive never held
+    monkeypatch.setattr(main, 'MAX_PAGES', None)
+    api.requests.clear()
+    run_main(api, '--incremental')
+    assert all('filter.advanced' not in request for request in api.requests)
+    assert query(run_main.database, 'SELECT count(*) FROM studies') == [(5,)]
+
+def test_replay_of_a_complete_archive_stores_the_watermark_of_the_archived_query(run_main, tmp_path):
+    api = FakeAPI([make_study(0, last_update='2024-03-01'), make_study(1, status='COMPLETED', last_update='2024-04-01'),
+                   make_study(2, last_update='2024-02-01')])
+    run_main(api, '--target-statuses-only', '--archive-dir', str(tmp_path / 'archive'))
+
+    schema = query(run_main.database, 'SELECT current_schema()')[0][0]
+    connection = duckdb.connect(run_main.database)
+    connection.execute(f'DELETE FROM "{schema}".extraction_watermarks')
+    connection.close()
+
+    # Replayed without --target-statuses-only, the pages still only hold the target statuses
+    run_main(api, '--replay', archived_run(tmp_path / 'archive'))
+    assert stored_watermarks(run_main.database) == [('last_update_post_date[RECRUITING]', '2024-03-01')]
@@ -1,48 +1,116 @@
 # src/utils/age_utils.py
+import functools
 import re
 
-def convert_age_to_years(age_str):
-    # Define conversion factors
-    conversion_factors = {
-        'year': 1,
-        'years': 1,
-        'month': 1/12,
-        'months': 1/12,
-        'week': 1/52,
-        'weeks': 1/52,
-        'day': 1/365,
-        'days': 1/365,
-        'hour': 1/8760,
-        'hours': 1/8760,
-        'minute': 1/525600,
-        'minutes': 1/525600
-    }
-
-    # Regular expression to extract age and unit
-    match = re.match(r'(\d+)\s*(year|years|month|months|week|weeks|day|days|hour|hours|minute|minutes)', age_str.lower())
-    
-    if match:
-        value, unit = match.groups()
-        return float(value) * conversion_factors[unit]
-    else:
+import pyarrow as pa
+import pyarrow.compute as pc
+
+# Length of every age unit in years; shared with the SQL transform engine
+AGE_UNIT_YEARS = {
+    'year': 1,
+    'month': 1/12,
+    'week': 1/52,
+    'day': 1/365,
+    'hour': 1/8760,
+    'minute': 1/525600,
+}
+
+# '18 Years', '6 months', '1.5 Years', '18-65 Years', '2 to 4 Weeks' (lower case); the syntax is shared
+# by Python's re and DuckDB's RE2, so both transform engines parse ages the same way
+AGE_PATTERN = r'^\s*(\d+(?:\.\d+)?)\s*(?:(?:-|to)\s*(\d+(?:\.\d+)?)\s*)?(' + '|'.join(AGE_UNIT_YEARS) + ')s?'
+
+# Values the API uses for an age limit that does not apply (lower case, stripped)
+NOT_APPLICABLE_AGES = ('n/a', 'na', 'none', '')
+
+_age_regex = re.compile(AGE_PATTERN)
+
+# Unknown formats are treated as no limit
+UNPARSED_AGE = float('inf')
+
+@functools.lru_cache(maxsize=None)
+def parse_age(age_str):
+    """
+    Parse an age string into its (lower, upper) bounds in years; both are equal unless it is a range.
+
+    The registry holds only a few hundred distinct age strings, so every string is parsed once.
+
+    Returns:
+        tuple: (lower, upper) in years, or None when the age does not apply ('N/A').
+
+    Raises:
+        ValueError: The string is not in a known age format.
+    """
+    age = age_str.strip().lower()
+    if age in NOT_APPLICABLE_AGES:
+        return None
+    match = _age_regex.match(age)
+    if not match:
         raise ValueError(f"Unknown age format: {age_str}")
-    
+    lower, upper, unit = match.groups()
+    return float(lower) * AGE_UNIT_YEARS[unit], float(upper or lower) * AGE_UNIT_YEARS[unit]
+
+def convert_age_to_years(age_str):
+    """Convert an age string to years (the lower bound of a range)."""
+    bounds = parse_age(age_str)
+    if bounds is None:
+        raise ValueError(f"Age does not apply: {age_str}")
+    return bounds[0]
+
+def age_in_years(age_str, upper=False, not_applicable=None):
+    """
+    Age limit in years of `age_str`: the lower bound of a range, or the upper one with `upper`.
+
+    'N/A' gives `not_applicable`, an unknown format UNPARSED_AGE.
+    """
+    try:
+        bounds = parse_age(age_str)
+    except ValueError:
+        return UNPARSED_AGE
+    if bounds is None:
+        return not_applicable
+    return bounds[1] if upper else bounds[0]
+
+def normalize_age_column(ages, upper=False, not_applicable=None):
+    """
+    Convert a whole column of age strings to years.
+
+    Only the distinct strings of the column are parsed; every row then takes the value of its
+    string, so the cost depends on the number of distinct ages rather than on the number of rows.
+
+    Args:
+        ages (pyarrow.Array or list): The age strings.
+        upper (bool): Use the upper bound of ranges (for maximum ages) instead of the lower one.
+        not_applicable (float): Value of 'N/A' ages.
+
+    Returns:
+        pyarrow.Array: The ages in years (float64).
+    """
+    if not isinstance(ages, pa.Array):
+        ages = pa.array(ages, pa.string())
+    distinct = pc.unique(ages)
+    years = pa.array(
+        [not_applicable if age is None else age_in_years(age, upper, not_applicable) for age in distinct.to_pylist()],
+        pa.float64()
+    )
+    return pc.take(years, pc.index_in(ages, value_set=distinct))
+
+def unparsed_age_counts(ages, years):
+    """
+    Count the rows of each age string that could not be parsed, for aggregated reporting.
+
+    Args:
+        ages (pyarrow.Array): The age strings.
+        years (pyarrow.Array): The same ages in years, as returned by `normalize_age_column`.
+
+    Returns:
+        dict: Unparsed age string -> number of rows.
+    """
+    unparsed = ages.filter(pc.equal(years, UNPARSED_AGE))
+    return {item['values']: item['counts'] for item in pc.value_counts(unparsed).to_pylist()}
+
 def normalize_ages(studies_data):
+    """Add the normalized ages to flattened studies rows (the row-by-row counterpart of `normalize_age_column`)."""
     for study in studies_data:
-        min_age_str = study.get('minimumAge', '0')
-        max_age_str = study.get('maximumAge', '120')
-        
-        try:
-            min_age = convert_age_to_years(min_age_str)
-        except ValueError as e:
-            min_age = float('inf')  # Handle unknown format as no limit
-            print(e)
-        
-        try:
-            max_age = convert_age_to_years(max_age_str)
-        except ValueError as e:
-            max_age = float('inf')  # Handle unknown format as no limit
-            print(e)
-        
-        study['normalized_minimumAge'] = min_age
-        study['normalized_maximumAge'] = max_age
+        study['normalized_minimumAge'] = age_in_years(study.get('minimumAge', '0 Year'), not_applicable=0.0)
+        study['normalized_maximumAge'] = age_in_years(study.get('maximumAge', '120 Years'), upper=True,
+                                                      not_applicable=120.0)
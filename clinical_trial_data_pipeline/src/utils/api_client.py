@@ -1,12 +1,303 @@
 # src/utils/api_client.py
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+
 from dlt.sources.helpers import requests
+from requests import exceptions as request_exceptions
+from requests.adapters import HTTPAdapter
+from urllib3.util.request import ACCEPT_ENCODING
+
+from utils.retry import RetryPolicy, parse_retry_after
+from utils.study_decoder import decode_page, decode_page_header
+
+# Every overallStatus value the ClinicalTrials.gov v2 API can return
+ALL_STATUSES = [
+    'ACTIVE_NOT_RECRUITING', 'COMPLETED', 'ENROLLING_BY_INVITATION', 'NOT_YET_RECRUITING',
+    'RECRUITING', 'SUSPENDED', 'TERMINATED', 'WITHDRAWN', 'AVAILABLE', 'NO_LONGER_AVAILABLE',
+    'TEMPORARILY_NOT_AVAILABLE', 'APPROVED_FOR_MARKETING', 'WITHHELD', 'UNKNOWN'
+]
+
+_SHARD_DONE = object()
+
+def status_shards(statuses=ALL_STATUSES):
+    """Partition the registry into one query per overallStatus."""
+    return [{'filter.overallStatus': status} for status in statuses]
+
+def date_range_shards(area='StudyFirstPostDate', start_year=2000, end_year=None):
+    """
+    Partition the registry into one query per calendar year of `area`.
+
+    The first shard is open towards the past and the last one towards the future,
+    so every study falls into exactly one shard.
+    """
+    end_year = end_year or date.today().year
+    shards = []
+    for year in range(start_year, end_year + 1):
+        lower = 'MIN' if year == start_year else f'{year}-01-01'
+        upper = 'MAX' if year == end_year else f'{year}-12-31'
+        shards.append({'filter.advanced': f'AREA[{area}]RANGE[{lower},{upper}]'})
+    return shards
+
+def build_shards(shard_by, statuses=None):
+    """
+    Build the shards of a strategy. `statuses` restricts overallStatus shards to those statuses,
+    e.g. when the query itself is already filtered by status.
+    """
+    if shard_by == 'overallStatus':
+        return status_shards(statuses or ALL_STATUSES)
+    if shard_by == 'studyFirstPostDate':
+        return date_range_shards('StudyFirstPostDate')
+    raise ValueError(f"Unknown shard strategy: {shard_by}")
+
+def projection(fields):
+    """Build the value of the API's `fields` parameter from a list of study field paths."""
+    return ','.join(fields)
+
+class APIRequestError(Exception):
+    def __init__(self, status_code, text):
+        super().__init__(f'Request failed ({status_code}): {text}')
+        self.status_code = status_code
 
 class APIClient:
-    def __init__(self, base_url):
+    def __init__(self, base_url, metrics=None, pool_size=10, connect_timeout=10, read_timeout=120, archive=None,
+                 retry_policy=None, rate_limiter=None):
+        """
+        Client for the ClinicalTrials.gov studies endpoint.
+
+        All requests go through one session, so connections (and their TLS handshakes) are kept alive
+        and reused across pages and across the threads of a sharded fetch.
+
+        Args:
+            base_url (str): The studies endpoint URL.
+            metrics (RunMetrics): Optional collector for request and transfer counters.
+            pool_size (int): Maximum number of pooled connections, should be at least the fetch workers.
+            connect_timeout (float): Seconds to wait for a connection to be established.
+            read_timeout (float): Seconds to wait for the server between bytes of a response.
+            archive (PageArchive): Optional archive every page fetched by `iter_pages` is written to.
+            retry_policy (RetryPolicy): How throttled, failed and timed out requests are retried.
+            rate_limiter (TokenBucket): Optional limiter shared by every thread sending requests.
+        """
         self.base_url = base_url
+        self.metrics = metrics
+        self.archive = archive
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.rate_limiter = rate_limiter
+        self.session = requests.Session(timeout=(connect_timeout, read_timeout), raise_for_status=False)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, pool_block=True)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        # Ask for every encoding urllib3 can decode here (gzip, deflate, plus br/zstd when installed)
+        self.session.headers['Accept-Encoding'] = ACCEPT_ENCODING
 
     def fetch_data(self, params):
-        response = requests.get(self.base_url, params=params)
-        if not response.ok:
-            raise Exception(f'Request failed: {response.text}')
-        return response.json()
+        return decode_page(self.fetch_raw(params))
+
+    def fetch_raw(self, params):
+        """
+        Fetch one page and return its undecoded JSON body.
+
+        Throttled (429), transient server side (5xx), connection, timeout and truncated body failures
+        are retried according to the retry policy, honoring the server's Retry-After header.
+        """
+        attempt = 0
+        while True:
+            attempt += 1
+            if self.rate_limiter is not None:
+                self._increment('rate_limiter_wait_seconds', self.rate_limiter.acquire())
+
+            retry_after = None
+            try:
+                response = self.session.get(self.base_url, params=params, stream=True)
+                content = response.content  # Reads and decodes the whole body
+            except (request_exceptions.ConnectionError, request_exceptions.Timeout,
+                    request_exceptions.ChunkedEncodingError, request_exceptions.ContentDecodingError) as e:
+                # Including bodies cut off mid-stream, which surface while reading or decompressing them
+                error = e
+            else:
+                if response.ok:
+                    if self.rate_limiter is not None:
+                        self.rate_limiter.reward()
+                    self._increment('requests')
+                    # raw.tell() counts the bytes pulled from the socket, i.e. before decompression
+                    self._increment('bytes_on_wire', response.raw.tell())
+                    self._increment('bytes_decoded', len(content))
+                    return content
+
+                error = APIRequestError(response.status_code, response.text)
+                if response.status_code not in self.retry_policy.retry_statuses:
+                    raise error
+                if response.status_code == 429:
+                    self._increment('throttled_requests')
+                    if self.rate_limiter is not None:
+                        self.rate_limiter.penalize()
+                retry_after = parse_retry_after(response.headers.get('Retry-After'))
+
+            if not self.retry_policy.should_retry(attempt):
+                raise error
+            self._increment('retries')
+            time.sleep(self.retry_policy.delay(attempt, retry_after))
+
+    def measure_projection(self, params, fields, sample_size=20):
+        """
+        Compare the payload of a small page with and without the `fields` projection.
+
+        An estimate of the saving: the sample page is fetched twice, in two requests of its own, which are
+        counted in the run metrics like any other.
+
+        Returns:
+            tuple: (bytes without projection, bytes with projection) for the same `sample_size` studies.
+        """
+        sample_params = {key: value for key, value in params.items() if key not in ('fields', 'pageToken')}
+        sample_params['pageSize'] = sample_size
+        full_bytes = len(self.fetch_raw(sample_params))
+        projected_bytes = len(self.fetch_raw({**sample_params, 'fields': projection(fields)}))
+        return full_bytes, projected_bytes
+
+    def close(self):
+        self.session.close()
+
+    def _end_chain(self, shard, first_page_token):
+        if self.archive is not None:
+            self.archive.write_chain_end(shard, first_page_token)
+
+    def _increment(self, name, value=1):
+        if self.metrics is not None:
+            self.metrics.increment(name, value)
+
+    def iter_pages(self, params, max_pages=None, shard=None, checkpoint=None, raw=False):
+        """
+        Walk the pageToken chain of a single query and yield each page as it arrives.
+
+        Args:
+            params (dict): Query parameters of the first page; the dict is not modified.
+            max_pages (int): Stop after this many pages, None to walk the whole chain.
+            shard (dict): The shard this chain belongs to, recorded in the archive manifest.
+            checkpoint (ExtractionCheckpoint): Resume the chain after its last recorded page and record
+                every page handed to the caller.
+            raw (bool): Yield the undecoded body of every page instead of the decoded page; only its
+                pagination fields are decoded here, the studies are left to the caller.
+        """
+        if checkpoint is not None:
+            if checkpoint.is_finished(shard):
+                return
+            params = checkpoint.resume_params(params, shard)
+
+        params = dict(params)
+        first_page_token = params.get('pageToken')
+        page = 1
+        while max_pages is None or page <= max_pages:
+            body = self.fetch_raw(params)
+            data = decode_page_header(body) if raw else decode_page(body)
+            if not data.get('studies', []):
+                self._end_chain(shard, first_page_token)
+                return
+
+            if self.archive is not None:
+                self.archive.write_page(
+                    body,
+                    page_token=params.get('pageToken'),
+                    next_page_token=data.get('nextPageToken'),
+                    shard=shard,
+                    studies=len(data['studies']),
+                    # Shards may return the same study, which is only loaded once
+                    nct_ids=None if shard is None or raw else [
+                        study['protocolSection']['identificationModule'].get('nctId') for study in data['studies']
+                    ]
+                )
+
+            if checkpoint is not None:
+                checkpoint.record_page(shard, data.get('nextPageToken'))
+            yield body if raw else data
+
+            # Check for next page token
+            next_page_token = data.get('nextPageToken')
+            if not next_page_token:
+                self._end_chain(shard, first_page_token)
+                return  # No next page, exit the loop
+
+            # Update params for next page
+            params['pageToken'] = next_page_token
+            page += 1  # Increment page counter
+
+    def iter_sharded_pages(self, params, shards, workers=4, max_pages=None, checkpoint=None):
+        """
+        Walk the pageToken chains of several independent query partitions concurrently.
+
+        Pages are yielded in arrival order. Studies already yielded by another shard (e.g. a study
+        whose status changed while the shards were walked) are dropped, based on their nctId.
+
+        Args:
+            params (dict): Query parameters shared by every shard.
+            shards (list): One dict of extra query parameters per partition, see `build_shards`.
+            workers (int): Number of shards walked at the same time.
+            max_pages (int): Page limit applied to each shard, None to walk every chain to the end.
+            checkpoint (ExtractionCheckpoint): Resume every shard after its last recorded page and record
+                each page when it is handed to the caller (not when it is fetched).
+        """
+        pages = queue.Queue(maxsize=workers * 2)
+        stop = threading.Event()
+
+        def put(item):
+            # Give up once the consumer is gone instead of blocking on a full queue forever
+            while not stop.is_set():
+                try:
+                    pages.put(item, timeout=0.5)
+                    return
+                except queue.Full:
+                    continue
+
+        def walk(shard):
+            try:
+                shard_params = self._shard_params(params, shard)
+                if checkpoint is not None:
+                    if checkpoint.is_finished(shard):
+                        return
+                    shard_params = checkpoint.resume_params(shard_params, shard)
+                for page in self.iter_pages(shard_params, max_pages, shard):
+                    if stop.is_set():
+                        return
+                    put((shard, page))
+            except Exception as e:
+                put(e)
+            finally:
+                put(_SHARD_DONE)
+
+        seen_nct_ids = set()
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='shard') as executor:
+            for shard in shards:
+                executor.submit(walk, shard)
+            try:
+                remaining = len(shards)
+                while remaining:
+                    item = pages.get()
+                    if item is _SHARD_DONE:
+                        remaining -= 1
+                        continue
+                    if isinstance(item, Exception):
+                        raise item
+
+                    shard, item = item
+                    studies = []
+                    for study in item['studies']:
+                        nct_id = study['protocolSection']['identificationModule'].get('nctId')
+                        if nct_id in seen_nct_ids:
+                            continue
+                        seen_nct_ids.add(nct_id)
+                        studies.append(study)
+                    self._increment('duplicate_studies_skipped', len(item['studies']) - len(studies))
+                    if checkpoint is not None:
+                        checkpoint.record_page(shard, item.get('nextPageToken'))
+                    yield {**item, 'studies': studies}
+            finally:
+                stop.set()
+
+    @staticmethod
+    def _shard_params(params, shard):
+        shard_params = {**params, **shard}
+        # Keep any advanced filter of the base query (e.g. the incremental watermark) next to the shard's
+        if 'filter.advanced' in params and 'filter.advanced' in shard:
+            shard_params['filter.advanced'] = f"{params['filter.advanced']} AND {shard['filter.advanced']}"
+        return shard_params
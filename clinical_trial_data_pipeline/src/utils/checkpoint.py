@@ -0,0 +1,81 @@
+# src/utils/checkpoint.py
+import hashlib
+import json
+import os
+
+SEQUENTIAL_CHAIN = 'all'
+
+def shard_key(shard):
+    """Stable name of a shard's pageToken chain in the checkpoint."""
+    return json.dumps(shard, sort_keys=True) if shard else SEQUENTIAL_CHAIN
+
+def query_key(params, shards=None, write_disposition=None):
+    """Fingerprint of a run's query, so a checkpoint is only resumed by the same kind of run."""
+    query = {'params': params, 'shards': shards, 'write_disposition': write_disposition}
+    return hashlib.sha256(json.dumps(query, sort_keys=True).encode('utf-8')).hexdigest()
+
+class ExtractionCheckpoint:
+    def __init__(self, path, query_key, pages=0, tokens=None, watermark=None):
+        """
+        Progress of an extraction, saved after every committed chunk of pages.
+
+        Args:
+            path (str): JSON file the checkpoint is persisted to.
+            query_key (str): Fingerprint of the run's query, see `query_key`.
+            pages (int): Number of pages already loaded.
+            tokens (dict): Next pageToken of each chain (shard) after its last loaded page;
+                None marks a chain that has been walked to the end.
+            watermark (str): Highest lastUpdatePostDate among the loaded pages.
+        """
+        self.path = path
+        self.query_key = query_key
+        self.pages = pages
+        self.tokens = tokens or {}
+        self.watermark = watermark
+
+    @classmethod
+    def load(cls, path, query_key):
+        """
+        Return the checkpoint left by an interrupted run of the same query, or a fresh one.
+        """
+        if os.path.exists(path):
+            with open(path, 'r') as file:
+                state = json.load(file)
+            if state.get('query_key') == query_key:
+                return cls(path, query_key, state['pages'], state['tokens'], state.get('watermark'))
+        return cls(path, query_key)
+
+    @property
+    def resumed(self):
+        return self.pages > 0
+
+    def is_finished(self, shard=None):
+        key = shard_key(shard)
+        return key in self.tokens and self.tokens[key] is None
+
+    def resume_params(self, params, shard=None):
+        """Return `params` positioned after the last loaded page of the shard's chain."""
+        token = self.tokens.get(shard_key(shard))
+        if token:
+            return {**params, 'pageToken': token}
+        return params
+
+    def record_page(self, shard, next_page_token):
+        """Record that the page of `shard` followed by `next_page_token` was handed to the loader."""
+        self.pages += 1
+        self.tokens[shard_key(shard)] = next_page_token
+
+    def save(self):
+        """Atomically replace the checkpoint file, so a crash never leaves a half-written checkpoint."""
+        state = {'query_key': self.query_key, 'pages': self.pages, 'tokens': self.tokens, 'watermark': self.watermark}
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w') as file:
+            json.dump(state, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, self.path)
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
@@ -11,9 +11,16 @@ def load_config():
 config = load_config()
 duckdb_file_path = config.get('duckdb_file_path')
 
+from datetime import datetime, timezone
+
 from dlt import pipeline as dlt_pipeline
+from dlt.destinations.exceptions import DatabaseUndefinedRelation
 import dlt
 
+WATERMARKS_TABLE = 'extraction_watermarks'
+NER_CACHE_TABLE = 'ner_cache'
+NER_SNAPSHOT_TABLE = 'ner_snapshot'
+
 class DataPipeline:
     def __init__(self, pipeline_name, dataset_name, db_file_path):
         self.pipeline = dlt_pipeline(
@@ -22,6 +29,241 @@ class DataPipeline:
             dataset_name=dataset_name
         )
 
-    def load_data(self, data, table_name):
+    def load_data(self, data, table_name, write_disposition=None, primary_key=None, refresh=None, before_load=None):
         # Use the dataset name as the schema name
-        self.pipeline.run(data, table_name=table_name)
\ No newline at end of file
+        # `data` may be a list or a generator; dlt buffers generated items to disk while extracting.
+        # Arrow record batches are written through as-is, without being normalized row by row.
+        # refresh='drop_resources' drops the loaded tables first, so they are recreated with the current column types
+        if before_load is None:
+            self.pipeline.run(data, table_name=table_name, write_disposition=write_disposition, primary_key=primary_key,
+                              refresh=refresh)
+            return
+        # The steps of `run`, one by one, to call `before_load` once `data` is extracted but not loaded yet;
+        # the empty run syncs the pipeline state and finishes pending loads first, as `run` does
+        self.pipeline.run()
+        self.pipeline.extract(data, table_name=table_name, write_disposition=write_disposition, primary_key=primary_key,
+                              refresh=refresh)
+        self.pipeline.normalize()
+        before_load()
+        self.pipeline.load()
+
+    def drop_pending_packages(self):
+        """
+        Drop the load packages an interrupted run extracted or normalized but did not load, so the next `load_data`
+        does not load them before loading the same data again.
+        """
+        self.pipeline.abort_packages()
+
+    def cluster_table(self, table_name, column):
+        """
+        Rewrite `table_name` sorted by `column`.
+
+        DuckDB keeps min/max zone maps per row group, so once the rows are clustered a range filter
+        on `column` (e.g. a date window) skips every row group outside the range.
+        """
+        with self.pipeline.sql_client() as client:
+            table = client.make_qualified_table_name(table_name)
+            with client.begin_transaction():
+                client.execute_sql(f"CREATE OR REPLACE TABLE {table} AS SELECT * FROM {table} ORDER BY {column}")
+
+    def enum_columns(self, table_name, values, create=True):
+        """
+        Store columns of `table_name` as ENUMs covering `values`, so each row holds a small code instead of a string.
+
+        The ENUM types are the registry of the values of each column: the API occasionally adds a status or a phase,
+        and loading a value missing from an ENUM fails, so the new values are appended to the ENUM (existing values
+        keep their order) before they are loaded.
+
+        Args:
+            table_name (str): The table; skipped while it does not exist.
+            values (dict): Column name, as extracted -> values about to be loaded.
+            create (bool): Also convert VARCHAR columns into ENUMs of their values; with False only existing ENUMs
+                are extended, which is enough before a load.
+
+        Returns:
+            dict: Column name -> the values appended to its existing ENUM.
+        """
+        naming = self.pipeline.default_schema.naming
+        added = {}
+        with self.pipeline.sql_client() as client:
+            column_types = dict(client.execute_sql(
+                "SELECT column_name, data_type FROM information_schema.columns WHERE table_schema = %s AND table_name = %s",
+                client.dataset_name, table_name
+            ))
+            table = client.make_qualified_table_name(table_name)
+            for column, column_values in values.items():
+                column_name = naming.normalize_identifier(column)
+                data_type = column_types.get(column_name)
+                if data_type is None:
+                    continue
+                identifier = client.escape_column_name(column_name)
+                if data_type.startswith('ENUM'):
+                    current = client.execute_sql(f"SELECT enum_range(NULL::{data_type})")[0][0]
+                elif create:
+                    rows = client.execute_sql(f"SELECT DISTINCT {identifier} FROM {table} WHERE {identifier} IS NOT NULL")
+                    current = sorted(row[0] for row in rows)
+                else:
+                    continue
+                new_values = sorted(set(column_values) - set(current))
+                if data_type.startswith('ENUM'):
+                    if not new_values:
+                        continue
+                    added[column] = new_values
+                if not current and not new_values:
+                    continue
+                enum = ', '.join("'" + value.replace("'", "''") + "'" for value in current + new_values)
+                client.execute_sql(f"ALTER TABLE {table} ALTER COLUMN {identifier} TYPE ENUM({enum})")
+        return added
+
+    @staticmethod
+    def child_table_item(data, table_name, write_disposition=None, merge_key=None):
+        """
+        Route an item of a `load_data` stream to the child table `table_name`, with its own hints.
+
+        The child table does not inherit the primary key of the loaded table; with a merge_key, a merge
+        replaces all the rows of the merged keys (delete-insert) instead of upserting single rows.
+        """
+        hints = dlt.mark.make_hints(table_name=table_name, write_disposition=write_disposition,
+                                    primary_key=[], merge_key=merge_key)
+        return dlt.mark.with_hints(data, hints, create_table_variant=True)
+
+    def delete_rows(self, table_names, column, values):
+        """
+        Delete the rows of `table_names` whose `column` is one of `values`, in one transaction.
+
+        Called before merging child tables: a merge only replaces the rows of the keys it loads rows for,
+        so the rows of items dropped from a study's list (or of a list that became empty) would stay behind.
+        Tables that do not exist yet are skipped.
+        """
+        if not values:
+            return
+        with self.pipeline.sql_client() as client:
+            rows = client.execute_sql(
+                "SELECT table_name FROM information_schema.tables WHERE table_schema = %s AND table_type = 'BASE TABLE'",
+                client.dataset_name
+            )
+            existing = {row[0] for row in rows}
+            column_name = client.escape_column_name(column)
+            with client.begin_transaction():
+                for table_name in table_names:
+                    if table_name in existing:
+                        table = client.make_qualified_table_name(table_name)
+                        client.execute_sql(f"DELETE FROM {table} WHERE {column_name} IN (SELECT unnest(%s))", list(values))
+
+    def create_filtered_view(self, view_name, table_name, column, values):
+        """
+        (Re)create `view_name` as the rows of `table_name` whose `column` is one of `values`.
+
+        Replaces a physical table of the same name left by earlier versions of the pipeline.
+        """
+        in_list = ', '.join("'" + value.replace("'", "''") + "'" for value in values)
+        with self.pipeline.sql_client() as client:
+            rows = client.execute_sql(
+                "SELECT table_type FROM information_schema.tables WHERE table_schema = %s AND table_name = %s",
+                client.dataset_name, view_name
+            )
+            view = client.make_qualified_table_name(view_name)
+            if rows and rows[0][0] == 'BASE TABLE':
+                client.execute_sql(f"DROP TABLE {view}")
+            table = client.make_qualified_table_name(table_name)
+            client.execute_sql(f"CREATE OR REPLACE VIEW {view} AS SELECT * FROM {table} WHERE {column} IN ({in_list})")
+
+    def get_watermark(self, name):
+        """
+        Return the latest value stored for watermark `name`, or None if no run has stored one yet.
+        """
+        try:
+            with self.pipeline.sql_client() as client:
+                table = client.make_qualified_table_name(WATERMARKS_TABLE)
+                rows = client.execute_sql(f"SELECT max(value) FROM {table} WHERE watermark = %s", name)
+        except DatabaseUndefinedRelation:
+            return None
+        return rows[0][0] if rows else None
+
+    def save_watermark(self, name, value):
+        """
+        Store `value` for watermark `name`. Call this only after the data it covers has been loaded.
+        """
+        row = {'watermark': name, 'value': value, 'extracted_at': datetime.now(timezone.utc)}
+        self.pipeline.run([row], table_name=WATERMARKS_TABLE, write_disposition='append')
+
+    def get_ner_results(self, cache_keys):
+        """
+        Return the cached NER results of `cache_keys` found in the NER cache table, as cache key -> row dict
+        holding the entities and their scores.
+        """
+        if not cache_keys:
+            return {}
+        try:
+            with self.pipeline.sql_client() as client:
+                table = client.make_qualified_table_name(NER_CACHE_TABLE)
+                query = f"SELECT * FROM {table} WHERE cache_key IN (SELECT unnest(%s))"
+                with client.execute_query(query, list(cache_keys)) as cursor:
+                    columns = [column[0] for column in cursor.description]
+                    rows = [dict(zip(columns, values)) for values in cursor.fetchall()]
+        except DatabaseUndefinedRelation:
+            return {}
+        return {row['cache_key']: row for row in rows}
+
+    def save_ner_results(self, rows):
+        """
+        Store NER results (dicts with cache_key, diseases, medications and the scores of both) in the NER cache table.
+
+        The table is loaded on its own, so it survives the full refreshes of the studies tables.
+        """
+        # Declared, as a batch without any entity of a type has only None scores
+        score_columns = {'diseases_score': {'data_type': 'double'}, 'medications_score': {'data_type': 'double'}}
+        self.pipeline.run(rows, table_name=NER_CACHE_TABLE, write_disposition='merge', primary_key='cache_key',
+                          columns=score_columns)
+
+    def snapshot_entities(self, table_name):
+        """
+        Copy the NER results of the rows of `table_name` that went through NER (nct_id, eligibility_hash, diseases
+        and medications) into the NER snapshot table, so they outlive a full refresh of `table_name` during the run.
+
+        A snapshot left by a failed run is kept: it was taken before that run replaced any rows of `table_name`,
+        which may now hold only the chunks the failed run loaded. Drop it once a run succeeds.
+
+        Returns:
+            bool: False when there is no snapshot and `table_name` has no eligibility hashes, i.e. was never
+                loaded with them.
+        """
+        with self.pipeline.sql_client() as client:
+            snapshot_exists = client.execute_sql(
+                "SELECT 1 FROM information_schema.tables WHERE table_schema = %s AND table_name = %s",
+                client.dataset_name, NER_SNAPSHOT_TABLE
+            )
+            if snapshot_exists:
+                return True
+            hashed = client.execute_sql(
+                "SELECT 1 FROM information_schema.columns WHERE table_schema = %s AND table_name = %s "
+                "AND column_name = 'eligibility_hash'",
+                client.dataset_name, table_name
+            )
+            if not hashed:
+                return False
+            table = client.make_qualified_table_name(table_name)
+            snapshot = client.make_qualified_table_name(NER_SNAPSHOT_TABLE)
+            client.execute_sql(
+                f"CREATE TABLE {snapshot} AS SELECT nct_id, eligibility_hash, diseases, medications "
+                f"FROM {table} WHERE eligibility_hash IS NOT NULL"
+            )
+        return True
+
+    def get_snapshot_entities(self, nct_ids):
+        """Return the NER results of `nct_ids` found in the NER snapshot table, as nct_id -> row dict."""
+        if not nct_ids:
+            return {}
+        with self.pipeline.sql_client() as client:
+            snapshot = client.make_qualified_table_name(NER_SNAPSHOT_TABLE)
+            rows = client.execute_sql(
+                f"SELECT nct_id, eligibility_hash, diseases, medications FROM {snapshot} "
+                f"WHERE nct_id IN (SELECT unnest(%s))",
+                list(nct_ids)
+            )
+        return {nct_id: {'eligibility_hash': eligibility_hash, 'diseases': diseases, 'medications': medications}
+                for nct_id, eligibility_hash, diseases, medications in rows}
+
+    def drop_entities_snapshot(self):
+        with self.pipeline.sql_client() as client:
+            client.execute_sql(f"DROP TABLE IF EXISTS {client.make_qualified_table_name(NER_SNAPSHOT_TABLE)}")
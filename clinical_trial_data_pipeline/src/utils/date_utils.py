@@ -0,0 +1,52 @@
+# src/utils/date_utils.py
+import datetime
+import functools
+import re
+
+import pyarrow as pa
+import pyarrow.compute as pc
+
+# The API reports dates as 'YYYY-MM-DD', or 'YYYY-MM' when only the month is known (e.g. planned start dates)
+DATE_PRECISIONS = {
+    'day': r'\d{4}-\d{2}-\d{2}',
+    'month': r'\d{4}-\d{2}',
+    'year': r'\d{4}',
+}
+# Suffix completing a partial date to the first day of its month or year
+DATE_PADDING = {'day': '', 'month': '-01', 'year': '-01-01'}
+
+_date_regexes = {precision: re.compile(pattern) for precision, pattern in DATE_PRECISIONS.items()}
+
+@functools.lru_cache(maxsize=None)
+def parse_partial_date(date_str):
+    """
+    Parse an API date into (date, precision); a partial date is the first day of its month or year.
+
+    Returns (None, None) for anything else, e.g. the 'Unknown Date' default. Cached, like `parse_age`,
+    as a date column holds far fewer distinct values than rows.
+    """
+    for precision, regex in _date_regexes.items():
+        if regex.fullmatch(date_str):
+            try:
+                return datetime.date.fromisoformat(date_str + DATE_PADDING[precision]), precision
+            except ValueError:
+                break
+    return None, None
+
+def normalize_date_column(dates):
+    """
+    Convert a whole column of API date strings into a DATE column and the precision of each date.
+
+    Args:
+        dates (pyarrow.Array): The date strings.
+
+    Returns:
+        tuple: (pyarrow.Array of date32, pyarrow.Array of precision strings), null where the date is unknown.
+    """
+    distinct = pc.unique(dates)
+    parsed = [parse_partial_date(date) if date is not None else (None, None) for date in distinct.to_pylist()]
+    indices = pc.index_in(dates, value_set=distinct)
+    return (
+        pc.take(pa.array([date for date, _ in parsed], pa.date32()), indices),
+        pc.take(pa.array([precision for _, precision in parsed], pa.string()), indices),
+    )
@@ -0,0 +1,167 @@
+# src/utils/page_archive.py
+import gzip
+import json
+import os
+import threading
+
+from utils.study_decoder import decode_page
+
+try:
+    import zstandard
+except ImportError:  # zstd archives are optional, gzip is always available
+    zstandard = None
+
+MANIFEST_FILE = 'manifest.jsonl'
+EXTENSIONS = {'gzip': '.json.gz', 'zstd': '.json.zst'}
+
+def latest_run_dir(archive_dir):
+    """Return the most recent run directory below `archive_dir` (run directories are named by timestamp)."""
+    runs = sorted(
+        name for name in os.listdir(archive_dir)
+        if os.path.isfile(os.path.join(archive_dir, name, MANIFEST_FILE))
+    )
+    if not runs:
+        raise FileNotFoundError(f"No archived runs found in {archive_dir}")
+    return os.path.join(archive_dir, runs[-1])
+
+def without_studies(raw, nct_ids):
+    """The JSON body of a page without the studies of `nct_ids`."""
+    page = json.loads(raw)
+    page['studies'] = [study for study in page['studies']
+                       if study['protocolSection']['identificationModule'].get('nctId') not in nct_ids]
+    return json.dumps(page).encode('utf-8')
+
+class PageArchive:
+    def __init__(self, directory, compression='gzip'):
+        """
+        A directory of raw API pages, one compressed file per page, plus a manifest listing
+        the pages in the order they were fetched, the query they answer and the pageToken chains
+        that were walked to their end.
+
+        Args:
+            directory (str): The directory of a single archived run.
+            compression (str): 'gzip' or 'zstd' (requires the zstandard package), used for new pages.
+        """
+        if compression not in EXTENSIONS:
+            raise ValueError(f"Unknown archive compression: {compression}")
+        if compression == 'zstd' and zstandard is None:
+            raise ValueError("zstd compression requires the zstandard package")
+        self.directory = directory
+        self.compression = compression
+        self.manifest_path = os.path.join(directory, MANIFEST_FILE)
+        self._lock = threading.Lock()
+        self._page_count = 0
+        self._nct_ids = set()
+
+    def write_page(self, raw, page_token=None, next_page_token=None, shard=None, studies=None, nct_ids=None):
+        """
+        Persist the undecoded body of one API page and append it to the manifest.
+
+        Safe to call from several fetch threads; pages are numbered in the order they are written.
+        With the `nct_ids` of the page's studies (sharded fetches, whose shards may return the same study),
+        the manifest lists those already archived by an earlier page as its `duplicates`, skipped on replay.
+        """
+        with self._lock:
+            duplicates = None
+            if nct_ids is not None:
+                duplicates = [nct_id for nct_id in nct_ids if nct_id in self._nct_ids]
+                self._nct_ids.update(nct_ids)
+            os.makedirs(self.directory, exist_ok=True)
+            self._page_count += 1
+            file_name = f'page-{self._page_count:06d}{EXTENSIONS[self.compression]}'
+            compressed = self._compress(raw)
+            with open(os.path.join(self.directory, file_name), 'wb') as file:
+                file.write(compressed)
+            self._append({
+                'page': self._page_count,
+                'file': file_name,
+                'page_token': page_token,
+                'next_page_token': next_page_token,
+                'shard': shard,
+                'studies': studies,
+                'bytes': len(raw),
+                'compressed_bytes': len(compressed),
+                'duplicates': duplicates,
+            })  # Appended after the page file is written, so every listed page is complete on disk
+
+    def write_query(self, params, shards=None, max_pages=None):
+        """Record the query of the run (parameters, sort and filters included) in the manifest, before its pages."""
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            self._append({'query': {'params': params, 'shards': shards, 'max_pages': max_pages}})
+
+    def write_chain_end(self, shard=None, first_page_token=None):
+        """
+        Record that the pageToken chain of `shard`, walked from `first_page_token` (None: its first page),
+        reached its last page. A chain stopped by max_pages or by an error has no end in the manifest.
+        """
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            self._append({'chain_end': {'shard': shard, 'first_page_token': first_page_token}})
+
+    def _append(self, entry):
+        with open(self.manifest_path, 'a') as manifest:
+            manifest.write(json.dumps(entry) + '\n')
+
+    def _entries(self):
+        with open(self.manifest_path, 'r') as manifest:
+            return [json.loads(line) for line in manifest if line.strip()]
+
+    def manifest(self):
+        """The manifest entries of the archived pages, in fetch order."""
+        return [entry for entry in self._entries() if 'page' in entry]
+
+    def query(self):
+        """The query recorded by `write_query`, None for archives written before queries were recorded."""
+        return next((entry['query'] for entry in self._entries() if 'query' in entry), None)
+
+    def complete_query(self):
+        """
+        The recorded query if every pageToken chain of it was archived from its first page to its last,
+        so the archive holds every study the query matched; None otherwise.
+        """
+        entries = self._entries()
+        query = next((entry['query'] for entry in entries if 'query' in entry), None)
+        if query is None:
+            return None
+        complete_chains = [entry['chain_end']['shard'] for entry in entries
+                           if 'chain_end' in entry and entry['chain_end']['first_page_token'] is None]
+        if all(shard in complete_chains for shard in query['shards'] or [None]):
+            return query
+        return None
+
+    def page_files(self):
+        """Paths of every archived page file, in fetch order."""
+        return [os.path.join(self.directory, entry['file']) for entry in self.manifest()]
+
+    def duplicates(self):
+        """Path of every archived page file -> nctIds of its studies archived by an earlier page (sharded runs)."""
+        return {os.path.join(self.directory, entry['file']): entry['duplicates']
+                for entry in self.manifest() if entry.get('duplicates')}
+
+    def iter_raw_pages(self):
+        """Yield the undecoded body of every archived page, in fetch order, without the studies of earlier pages."""
+        for entry in self.manifest():
+            with open(os.path.join(self.directory, entry['file']), 'rb') as file:
+                raw = self._decompress(entry['file'], file.read())
+            if entry.get('duplicates'):
+                raw = without_studies(raw, set(entry['duplicates']))
+            yield raw
+
+    def iter_pages(self):
+        """Yield every archived page decoded like `APIClient.fetch_data` would, in fetch order."""
+        for raw in self.iter_raw_pages():
+            yield decode_page(raw)
+
+    def _compress(self, raw):
+        if self.compression == 'zstd':
+            return zstandard.ZstdCompressor(level=3).compress(raw)
+        return gzip.compress(raw, compresslevel=6)
+
+    @staticmethod
+    def _decompress(file_name, data):
+        if file_name.endswith(EXTENSIONS['zstd']):
+            if zstandard is None:
+                raise ValueError(f"{file_name} is zstd compressed but the zstandard package is not installed")
+            return zstandard.ZstdDecompressor().decompress(data)
+        return gzip.decompress(data)
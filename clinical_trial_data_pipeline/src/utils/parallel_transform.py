@@ -0,0 +1,37 @@
+# src/utils/parallel_transform.py
+from collections import deque
+
+from utils.study_decoder import decode_page
+from utils.study_transform import study_tables
+
+def transform_raw_page(raw):
+    """
+    Decode, flatten and age-normalize the undecoded body of one API page into its table record batches.
+
+    Runs in a worker process; the record batches travel back to the parent as compact Arrow buffers
+    instead of pickled per-study dicts.
+    """
+    return study_tables(decode_page(raw).get('studies', []))
+
+def parallel_transform_pages(executor, raw_pages, window):
+    """
+    Transform undecoded pages on a process pool, yielding their table record batches in page order.
+
+    At most `window` pages are in flight: the next page is only taken from `raw_pages` once the
+    oldest one has been yielded, so a slow page holds back the output but never the memory bound.
+
+    Args:
+        executor (concurrent.futures.ProcessPoolExecutor): The pool running `transform_raw_page`.
+        raw_pages (iterable): Undecoded page bodies, in page order.
+        window (int): Maximum number of pages submitted but not yet yielded.
+
+    Yields:
+        tuple: (table name, pyarrow.RecordBatch) of each page, like `transform_pages`.
+    """
+    pending = deque()
+    for raw in raw_pages:
+        pending.append(executor.submit(transform_raw_page, raw))
+        if len(pending) >= window:
+            yield from pending.popleft().result()
+    while pending:
+        yield from pending.popleft().result()
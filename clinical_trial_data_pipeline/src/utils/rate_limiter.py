@@ -0,0 +1,55 @@
+# src/utils/rate_limiter.py
+import threading
+import time
+
+class TokenBucket:
+    def __init__(self, rate, capacity=1, min_rate=None):
+        """
+        Thread-safe token bucket shared by every fetcher of an APIClient.
+
+        The refill rate adapts to the server: it is halved whenever the API throttles a request
+        and creeps back up towards the configured rate while requests succeed.
+
+        Args:
+            rate (float): Requests per second allowed in the long run.
+            capacity (int): Maximum burst of requests sent back to back.
+            min_rate (float): Lower bound the rate is never halved below (default: rate / 16).
+        """
+        self.max_rate = rate
+        self.min_rate = min_rate or rate / 16
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a request may be sent and return the number of seconds waited."""
+        waited = 0.0
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+    def penalize(self):
+        """Halve the rate after the server throttled a request."""
+        with self._lock:
+            self._refill()
+            self.rate = max(self.rate / 2, self.min_rate)
+            self._tokens = min(self._tokens, 0)
+
+    def reward(self):
+        """Raise the rate a little after a successful request, up to the configured rate."""
+        with self._lock:
+            self._refill()
+            self.rate = min(self.rate + self.max_rate / 20, self.max_rate)
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
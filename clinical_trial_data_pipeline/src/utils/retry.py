@@ -0,0 +1,51 @@
+# src/utils/retry.py
+import random
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+# Responses worth retrying: throttling and transient server side failures
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+def parse_retry_after(value):
+    """
+    Parse a Retry-After header, given either in seconds or as an HTTP date, into seconds to wait.
+    Returns None when the header is missing or malformed.
+    """
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max((retry_at - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+class RetryPolicy:
+    def __init__(self, max_attempts=6, backoff_base=1.0, backoff_max=60.0, retry_statuses=RETRY_STATUSES):
+        """
+        Exponential backoff with full jitter.
+
+        Args:
+            max_attempts (int): Attempts per request, including the first one.
+            backoff_base (float): Upper bound in seconds of the first retry delay; doubled on every attempt.
+            backoff_max (float): Cap in seconds of any single retry delay.
+            retry_statuses (tuple): HTTP status codes that are retried.
+        """
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.retry_statuses = retry_statuses
+
+    def should_retry(self, attempt):
+        return attempt < self.max_attempts
+
+    def delay(self, attempt, retry_after=None):
+        """Seconds to wait before retry number `attempt`; a server provided Retry-After wins."""
+        if retry_after is not None:
+            return retry_after
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1)))
@@ -0,0 +1,42 @@
+# src/utils/run_metrics.py
+import resource
+import sys
+import threading
+
+
+def peak_rss_mb():
+    """Return the peak resident set size of the current process in megabytes."""
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and in kilobytes on Linux
+    if sys.platform == 'darwin':
+        return peak_rss / (1024 * 1024)
+    return peak_rss / 1024
+
+
+class RunMetrics:
+    def __init__(self):
+        """
+        Collect named counters for a single pipeline run.
+
+        Counters can be incremented from several threads at once, e.g. by concurrent fetchers.
+        """
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def increment(self, name, value=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def get(self, name, default=0):
+        with self._lock:
+            return self._counters.get(name, default)
+
+    def as_dict(self):
+        with self._lock:
+            metrics = {name: round(value, 2) if isinstance(value, float) else value for name, value in self._counters.items()}
+        metrics['peak_rss_mb'] = round(peak_rss_mb(), 1)
+        return metrics
+
+    def log_summary(self, logger):
+        for name, value in sorted(self.as_dict().items()):
+            logger.info(f'Run metric {name}: {value}')
@@ -0,0 +1,187 @@
+# src/utils/sql_transform.py
+import string
+from typing import List
+
+import duckdb
+
+from utils.age_utils import AGE_PATTERN, AGE_UNIT_YEARS, NOT_APPLICABLE_AGES, UNPARSED_AGE
+from utils.date_utils import DATE_PADDING, DATE_PRECISIONS
+from utils.study_mapping import field_tree
+from utils.study_transform import (
+    CHILD_TABLES, DATE_COLUMNS, NORMALIZED_AGES, STUDIES_TABLE, STUDY_MAPPING, TABLE_SCHEMAS
+)
+
+# Largest single page document read_json accepts; full (unprojected) pages run to tens of MB
+MAX_PAGE_BYTES = 64 << 20
+
+def sql_literal(value):
+    if value is None:
+        return 'NULL'
+    return "'" + str(value).replace("'", "''") + "'"
+
+def sql_identifier(name):
+    return '"' + name.replace('"', '""') + '"'
+
+SQL_TYPES = {str: 'VARCHAR', float: 'DOUBLE', List[str]: 'VARCHAR[]'}
+
+def studies_type_sql(mappings, child_tables=()):
+    """
+    DuckDB type of a page's `studies` list restricted to the mapped fields, so read_json parses each page
+    once, straight into typed structs, and skips every other field (the SQL counterpart of `page_schema`).
+    """
+    def to_type(node):
+        if isinstance(node, list):
+            return f'{to_type(node[0])}[]'
+        if isinstance(node, dict):
+            return 'STRUCT(' + ', '.join(f'{sql_identifier(key)} {to_type(value)}' for key, value in node.items()) + ')'
+        return SQL_TYPES[node]
+
+    return f'{to_type(field_tree(mappings, child_tables))}[]'
+
+def path_sql(path, root):
+    return '.'.join([root] + [sql_identifier(key) for key in path.split('.')])
+
+def column_sql(mapping, study='study'):
+    """SQL expression reading one mapped column out of the `study` struct, with the mapping's default and join."""
+    value = path_sql(mapping.path, study)
+    default = sql_literal(mapping.default)
+    if mapping.join is None:
+        return f'coalesce({value}, {default})'
+
+    if mapping.item:
+        parts = []
+        for literal, field, _, _ in string.Formatter().parse(mapping.item):
+            if literal:
+                parts.append(sql_literal(literal))
+            if field:
+                parts.append(f'coalesce(_i.{sql_identifier(field)}, {sql_literal(mapping.item_defaults.get(field))})')
+        value = f"list_transform({value}, _i -> {' || '.join(parts)})"
+    # A missing list (or an empty one, unless the mapping joins it into '') takes the default, like the Python flattener
+    present = f'len({value}) > 0' if mapping.empty_default else f'{value} IS NOT NULL'
+    return f'CASE WHEN {present} THEN array_to_string({value}, {sql_literal(mapping.join)}) ELSE {default} END'
+
+def age_in_years_sql(column, upper=False, not_applicable=None):
+    """SQL expression converting an age string column to years, with the same rules as `age_utils.age_in_years`."""
+    pattern = sql_literal(AGE_PATTERN)
+    age = f'lower({sql_identifier(column)})'
+    lower = f'regexp_extract({age}, {pattern}, 1)'
+    number = f"coalesce(nullif(regexp_extract({age}, {pattern}, 2), ''), {lower})" if upper else lower
+    units = ' '.join(f'WHEN {sql_literal(unit)} THEN CAST({factor!r} AS DOUBLE)' for unit, factor in AGE_UNIT_YEARS.items())
+    not_applicable_ages = ', '.join(sql_literal(value) for value in NOT_APPLICABLE_AGES)
+    years = (f'coalesce(TRY_CAST({number} AS DOUBLE) * CASE regexp_extract({age}, {pattern}, 3) {units} END, '
+             f'CAST({str(UNPARSED_AGE)!r} AS DOUBLE))')
+    return f'CASE WHEN trim({age}) IN ({not_applicable_ages}) THEN CAST({sql_literal(not_applicable)} AS DOUBLE) ELSE {years} END'
+
+def date_sql(column):
+    """SQL expression parsing an API date column into a DATE, with the same rules as `date_utils.parse_partial_date`."""
+    value = sql_identifier(column)
+    cases = ' '.join(
+        f'WHEN regexp_full_match({value}, {sql_literal(pattern)}) '
+        f'THEN TRY_CAST({value} || {sql_literal(DATE_PADDING[precision])} AS DATE)'
+        for precision, pattern in DATE_PRECISIONS.items()
+    )
+    return f'CASE {cases} END'
+
+def date_precision_sql(column):
+    """SQL expression of the precision of a parsed API date column, NULL when the date is unknown."""
+    value = sql_identifier(column)
+    cases = ' '.join(
+        f'WHEN regexp_full_match({value}, {sql_literal(pattern)}) '
+        f'THEN CASE WHEN {date_sql(column)} IS NOT NULL THEN {sql_literal(precision)} END'
+        for precision, pattern in DATE_PRECISIONS.items()
+    )
+    return f'CASE {cases} END'
+
+def page_studies_sql(files, duplicates=None, mappings=STUDY_MAPPING, child_tables=CHILD_TABLES):
+    """
+    Build the SELECT reading archived page files into one typed `study` struct per row.
+
+    `duplicates` (page file -> nctIds, see `PageArchive.duplicates`) lists studies of a file to skip.
+    """
+    file_list = '[' + ', '.join(sql_literal(file) for file in files) + ']'
+    skipped = [f'{file}|{nct_id}' for file in files for nct_id in (duplicates or {}).get(file, ())]
+    where = ''
+    if skipped:
+        # A plain filter, so the studies keep their page order
+        nct_id = path_sql('protocolSection.identificationModule.nctId', 'study')
+        skipped_list = '[' + ', '.join(sql_literal(key) for key in skipped) + ']'
+        where = f"WHERE NOT list_contains({skipped_list}, filename || '|' || {nct_id})"
+    # Pages are archived as the API sent them, which may be pretty-printed over many lines
+    return f"""
+SELECT study FROM (
+    SELECT unnest(studies) AS study, filename
+    FROM read_json(
+        {file_list}, format = 'auto', maximum_object_size = {MAX_PAGE_BYTES}, filename = true,
+        columns = {{'studies': {sql_literal(studies_type_sql(mappings, child_tables))}}}
+    )
+)
+{where}
+"""
+
+def study_select_sql(source, mappings=STUDY_MAPPING):
+    """
+    Build the SELECT returning the studies columns of STUDY_SCHEMA from the `study` structs of `source`.
+
+    Generated from the same field mappings as the Python flatteners, so both engines produce the same rows.
+    """
+    columns = ',\n        '.join(f'{column_sql(mapping)} AS {sql_identifier(mapping.column)}' for mapping in mappings)
+    dates = ', '.join(f'{date_sql(column)} AS {sql_identifier(column)}' for column in DATE_COLUMNS)
+    derived = [f'{age_in_years_sql(age_column, upper, not_applicable)} AS {sql_identifier(column)}'
+               for column, (age_column, upper, not_applicable) in NORMALIZED_AGES.items()]
+    derived.extend(f'{date_precision_sql(column)} AS {sql_identifier(precision_column)}'
+                   for column, precision_column in DATE_COLUMNS.items() if precision_column)
+    derived = ',\n    '.join(derived)
+    return f"""
+SELECT
+    * REPLACE ({dates}),
+    {derived}
+FROM (
+    SELECT
+        {columns}
+    FROM {source}
+)
+"""
+
+def child_select_sql(child_table, source, mappings=STUDY_MAPPING):
+    """Build the SELECT returning the rows of a child table, one per list item, from the `study` structs of `source`."""
+    nct_id = column_sql(next(mapping for mapping in mappings if mapping.column == 'nctId'))
+    columns = ['nct_id']
+    if child_table.value_column:
+        columns.append(f'_item AS {sql_identifier(child_table.value_column)}')
+    columns.extend(f'{path_sql(item_path, "_item")} AS {sql_identifier(column)}'
+                   for column, (item_path, _) in child_table.item_paths.items())
+    return f"""
+SELECT {', '.join(columns)}
+FROM (
+    SELECT {nct_id} AS nct_id, unnest({path_sql(child_table.path, 'study')}) AS _item
+    FROM {source}
+)
+"""
+
+def sql_transform(files, batch_size=10000, threads=None, duplicates=None):
+    """
+    Flatten and age-normalize archived page files in DuckDB, on all cores, instead of in Python.
+
+    The pages are parsed once into a temporary table, from which the studies table and every child
+    table are selected.
+
+    Args:
+        files (list): Archived page files (.json.gz or .json.zst), in fetch order.
+        batch_size (int): Rows per yielded record batch.
+        threads (int): DuckDB worker threads; None uses every core.
+        duplicates (dict): Page file -> nctIds of its studies already archived by an earlier page, which are skipped.
+
+    Yields:
+        tuple: (table name, pyarrow.RecordBatch), with the same tables and columns as `transform_pages` produces.
+    """
+    connection = duckdb.connect(config={'threads': threads} if threads else {})
+    try:
+        connection.execute(f'CREATE TEMP TABLE page_studies AS {page_studies_sql(files, duplicates)}')
+        selects = [(STUDIES_TABLE, study_select_sql('page_studies'))]
+        selects.extend((child_table.table, child_select_sql(child_table, 'page_studies')) for child_table in CHILD_TABLES)
+        for table, select in selects:
+            for batch in connection.execute(select).to_arrow_reader(batch_size):
+                # Same column types as the Python transform, e.g. dictionary-encoded categorical columns
+                yield table, batch.cast(TABLE_SCHEMAS[table])
+    finally:
+        connection.close()
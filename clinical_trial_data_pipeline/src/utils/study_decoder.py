@@ -0,0 +1,52 @@
+# src/utils/study_decoder.py
+import json
+from typing import List, TypedDict
+
+from utils.study_mapping import page_schema
+from utils.study_transform import CHILD_TABLES, STUDY_MAPPING
+
+try:
+    import msgspec
+except ImportError:  # Falls back to a generic JSON parser below
+    msgspec = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Typed schema of the parts of a study page the transform consumes, derived from STUDY_MAPPING.
+# Keys are optional (total=False) so missing values keep falling back to the mapping's defaults;
+# every other field of the document is skipped by the parser without being materialized.
+StudyPage = page_schema(STUDY_MAPPING, CHILD_TABLES)
+
+_page_decoder = msgspec.json.Decoder(StudyPage) if msgspec is not None else None
+
+# Only the pagination fields of a page; the studies are kept as undecoded slices of the body
+_header_decoder = None
+if msgspec is not None:
+    PageHeader = TypedDict('PageHeader', {'studies': List[msgspec.Raw], 'nextPageToken': str}, total=False)
+    _header_decoder = msgspec.json.Decoder(PageHeader)
+
+def decode_page(raw):
+    """
+    Decode the JSON body of a studies page into plain dicts holding only the fields of the schema above.
+
+    Uses msgspec's typed decoder when available, otherwise orjson or the standard library
+    (which decode the whole document).
+    """
+    if _page_decoder is not None:
+        return _page_decoder.decode(raw)
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+def decode_page_header(raw):
+    """
+    Decode only what is needed to walk the pageToken chain: `nextPageToken` and the `studies` list,
+    whose items are left undecoded (msgspec.Raw) so the studies can be parsed elsewhere, e.g. in
+    a worker process. Without msgspec the whole page is decoded.
+    """
+    if _header_decoder is not None:
+        return _header_decoder.decode(raw)
+    return decode_page(raw)
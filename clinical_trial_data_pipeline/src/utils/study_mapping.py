@@ -0,0 +1,265 @@
+# src/utils/study_mapping.py
+import string
+from typing import List, TypedDict
+
+class FieldMapping:
+    def __init__(self, column, path, default=None, join=None, item=None, item_defaults=None, value_type=str,
+                 empty_default=True):
+        """
+        Declare how one output column is read from a raw API study.
+
+        Args:
+            column (str): Name of the output column.
+            path (str): Dotted JSON path of the value inside a study, e.g. 'protocolSection.statusModule.overallStatus'.
+            default: Value used when the path is missing.
+            join (str): Separator to join a list value into one string; None keeps the value as is.
+            item (str): Format template applied to every dict of a list before joining, e.g. '{city} - {country}'.
+            item_defaults (dict): Defaults of the template's fields when an item lacks them.
+            value_type (type): Type of the value at `path` in the API (str or List[str]), used by the typed decoder.
+            empty_default (bool): For joined fields, also use the default when the list is empty;
+                False joins an empty list into ''.
+        """
+        self.column = column
+        self.path = path
+        self.default = default
+        self.join = join
+        self.item = item
+        self.item_defaults = item_defaults or {}
+        self.value_type = value_type
+        self.empty_default = empty_default
+
+    @property
+    def item_fields(self):
+        return [name for _, name, _, _ in string.Formatter().parse(self.item or '') if name]
+
+    @property
+    def api_fields(self):
+        """API field paths this column needs, as accepted by the `fields` projection."""
+        if self.item:
+            return [f'{self.path}.{name}' for name in self.item_fields]
+        return [self.path]
+
+class ChildTable:
+    def __init__(self, table, path, columns=None, value_column=None, column_types=None):
+        """
+        Declare a child table holding one row per item of a list inside a study, keyed by nct_id.
+
+        Args:
+            table (str): Name of the child table.
+            path (str): Dotted JSON path of the list inside a study.
+            columns (dict): Column name -> dotted path inside a list item, for lists of objects.
+            value_column (str): Column holding the item itself, for lists of strings.
+            column_types (dict): Column name -> type (str or float) of the item field; str by default.
+        """
+        self.table = table
+        self.path = path
+        self.columns = columns or {}
+        self.value_column = value_column
+        self.column_types = column_types or {}
+
+    @property
+    def item_paths(self):
+        """Column name -> (path inside an item, type) of every column read from a list of objects."""
+        return {column: (item_path, self.column_types.get(column, str)) for column, item_path in self.columns.items()}
+
+    @property
+    def api_fields(self):
+        if self.value_column:
+            return [self.path]
+        # Project whole top-level item fields (e.g. geoPoint), the API resolves them as single pieces
+        return [f"{self.path}.{item_path.split('.')[0]}" for item_path in self.columns.values()]
+
+def study_fields(mappings, child_tables=()):
+    """List every API field path read by `mappings` and `child_tables`, in declaration order and without duplicates."""
+    fields = []
+    for mapping in list(mappings) + list(child_tables):
+        for field in mapping.api_fields:
+            if field not in fields:
+                fields.append(field)
+    return fields
+
+def field_tree(mappings, child_tables=()):
+    """
+    Nest every API field read by `mappings` and `child_tables` into a tree following the study document:
+    objects are dicts, lists of objects are a list holding the dict of their item, leaves are value types.
+    """
+    tree = {}
+
+    def add(path, value_type):
+        node = tree
+        keys = path.split('.')
+        for key in keys[:-1]:
+            if key.endswith('[]'):
+                node = node.setdefault(key[:-2], [{}])[0]
+            else:
+                node = node.setdefault(key, {})
+        node[keys[-1]] = value_type
+
+    for mapping in mappings:
+        if mapping.item:
+            for field in mapping.item_fields:
+                add(f'{mapping.path}[].{field}', str)
+        else:
+            add(mapping.path, mapping.value_type)
+    for child_table in child_tables:
+        if child_table.value_column:
+            add(child_table.path, List[str])
+        for item_path, value_type in child_table.item_paths.values():
+            add(f'{child_table.path}[].{item_path}', value_type)
+    return tree
+
+def item_fstring(template, defaults, constant):
+    """Turn an item template like '{city} - {country}' into an f-string expression over the item `_i`."""
+    parts = []
+    for literal, field, _, _ in string.Formatter().parse(template):
+        parts.append(literal.replace('{', '{{').replace('}', '}}'))
+        if field:
+            parts.append(f'{{_i.get({field!r}, {constant(defaults.get(field))})}}')
+    source = ''.join(parts)
+    if '"' in source or '\\' in source:
+        # Not expressible inside f"..." before Python 3.12, format the template instead
+        arguments = ', '.join(f'{field}=_i.get({field!r}, {constant(defaults.get(field))})'
+                              for _, field, _, _ in string.Formatter().parse(template) if field)
+        return f'{constant(template)}.format({arguments})'
+    return f'f"{source}"'
+
+def _column_expressions(mappings, lines, namespace, study='study', indent='    '):
+    """
+    Generate the per-study body shared by the compiled flatteners.
+
+    Appends to `lines` the assignments of every intermediate object along the mapped paths (each looked
+    up once per study and kept in a local variable) and returns the inlined expression of every column.
+    """
+    nodes = {'': study}
+
+    def node_variable(path):
+        # Assign each intermediate object to a local the first time a column needs it
+        if path not in nodes:
+            parent, _, key = path.rpartition('.')
+            parent_variable = node_variable(parent)
+            variable = f'_n{len(nodes)}'
+            lines.append(f'{indent}{variable} = {parent_variable}.get({key!r}) or _EMPTY')
+            nodes[path] = variable
+        return nodes[path]
+
+    def constant(value):
+        # Plain literals are inlined (a constant load); anything else is bound in the function's globals
+        if value is None or isinstance(value, (str, int, float)):
+            return repr(value)
+        constant_name = f'_c{len(namespace)}'
+        namespace[constant_name] = value
+        return constant_name
+
+    columns = []
+    for mapping in mappings:
+        parent, _, key = mapping.path.rpartition('.')
+        node = node_variable(parent)
+        default = constant(mapping.default)
+        if mapping.join is None:
+            columns.append((mapping.column, f'{node}.get({key!r}, {default})'))
+            continue
+        value = f'{node}.get({key!r})'
+
+        if mapping.item:
+            item_fields = mapping.item_fields
+            if mapping.item == '{' + item_fields[0] + '}':
+                item_expression = f'_i.get({item_fields[0]!r}, {constant(mapping.item_defaults.get(item_fields[0]))})'
+            else:
+                item_expression = item_fstring(mapping.item, mapping.item_defaults, constant)
+            joined = f'{mapping.join!r}.join([{item_expression} for _i in _v])'
+        else:
+            joined = f'{mapping.join!r}.join(_v)'
+        # The walrus keeps the list lookup to a single dict access
+        present = '(_v := {})' if mapping.empty_default else '(_v := {}) is not None'
+        columns.append((mapping.column, f'{joined} if {present.format(value)} else {default}'))
+    return columns
+
+def _exec_function(source, name, namespace):
+    exec(compile(source, f'<{name}>', 'exec'), namespace)
+    function = namespace[name]
+    function.source = source
+    return function
+
+def compile_flattener(mappings, name='flatten_study'):
+    """
+    Compile field mappings into a single function turning a raw study dict into a flat row.
+
+    Every intermediate object along the mapped paths is looked up exactly once per study and kept
+    in a local variable, and each column is one inlined expression, so flattening does no interpretation
+    of the mapping at run time.
+    """
+    namespace = {'_EMPTY': {}}
+    lines = [f'def {name}(study):']
+    columns = _column_expressions(mappings, lines, namespace)
+    lines.append('    return {')
+    lines.extend(f'        {column!r}: {expression},' for column, expression in columns)
+    lines.append('    }')
+    return _exec_function('\n'.join(lines), name, namespace)
+
+def compile_column_flattener(mappings, name='flatten_columns'):
+    """
+    Compile field mappings into a function turning a list of raw studies into one list per column.
+
+    The generated loop appends every value straight to its column's list, so a page is flattened
+    without building a dict per study; the result is ready for `pyarrow.RecordBatch.from_pydict`.
+    """
+    namespace = {'_EMPTY': {}}
+    body = []
+    columns = _column_expressions(mappings, body, namespace, indent='        ')
+    lines = [f'def {name}(studies):']
+    lines.extend(f'    _l{index} = []; _a{index} = _l{index}.append' for index in range(len(columns)))
+    lines.append('    for study in studies:')
+    lines.extend(body)
+    lines.extend(f'        _a{index}({expression})' for index, (_, expression) in enumerate(columns))
+    lines.append('    return {')
+    lines.extend(f'        {column!r}: _l{index},' for index, (column, _) in enumerate(columns))
+    lines.append('    }')
+    return _exec_function('\n'.join(lines), name, namespace)
+
+def compile_child_flattener(child_table, name=None):
+    """
+    Compile a child table declaration into a function turning a list of raw studies, and their nct_ids,
+    into one list per child column (nct_id first) holding one entry per item of the studies' lists.
+    """
+    name = name or f'flatten_{child_table.table}'
+    namespace = {'_EMPTY': {}}
+    columns = ['nct_id']
+    lines = [f'def {name}(studies, nct_ids):']
+    body = ['    for study, nct_id in zip(studies, nct_ids):']
+    node = 'study'
+    for index, key in enumerate(child_table.path.split('.')[:-1], start=1):
+        body.append(f'        _n{index} = {node}.get({key!r}) or _EMPTY')
+        node = f'_n{index}'
+    body.append(f"        for _i in {node}.get({child_table.path.rpartition('.')[2]!r}) or ():")
+    body.append('            _a0(nct_id)')
+    if child_table.value_column:
+        columns.append(child_table.value_column)
+        body.append('            _a1(_i)')
+    for column, (item_path, _) in child_table.item_paths.items():
+        value = '_i'
+        keys = item_path.split('.')
+        for key in keys[:-1]:
+            value = f'({value}.get({key!r}) or _EMPTY)'
+        columns.append(column)
+        body.append(f'            _a{len(columns) - 1}({value}.get({keys[-1]!r}))')
+    lines.extend(f'    _l{index} = []; _a{index} = _l{index}.append' for index in range(len(columns)))
+    lines.extend(body)
+    lines.append('    return {')
+    lines.extend(f'        {column!r}: _l{index},' for index, column in enumerate(columns))
+    lines.append('    }')
+    return _exec_function('\n'.join(lines), name, namespace)
+
+def page_schema(mappings, child_tables=()):
+    """
+    Build the TypedDict schema of a studies page restricted to the mapped fields, for msgspec decoding.
+    """
+    def to_type(name, node):
+        if isinstance(node, list):
+            return List[to_type(name, node[0])]
+        if isinstance(node, dict):
+            fields = {key: to_type(key[0].upper() + key[1:], value) for key, value in node.items()}
+            return TypedDict(name, fields, total=False)
+        return node
+
+    study = to_type('Study', field_tree(mappings, child_tables))
+    return TypedDict('StudyPage', {'studies': List[study], 'nextPageToken': str, 'totalCount': int}, total=False)
@@ -0,0 +1,185 @@
+# src/utils/study_transform.py
+from typing import List
+
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from utils.age_utils import age_in_years, normalize_age_column
+from utils.date_utils import normalize_date_column
+
+from utils.study_mapping import (
+    ChildTable, FieldMapping, compile_child_flattener, compile_column_flattener, compile_flattener, study_fields
+)
+
+STATUS = 'protocolSection.statusModule'
+ELIGIBILITY = 'protocolSection.eligibilityModule'
+
+# Output column -> API path, default and join rule of every column of the studies table.
+# Adding a column here updates the flattener, the `fields` projection and the typed decoder.
+STUDY_MAPPING = [
+    FieldMapping('nctId', 'protocolSection.identificationModule.nctId', 'Unknown'),
+    FieldMapping('briefTitle', 'protocolSection.identificationModule.briefTitle', 'Unknown'),
+    FieldMapping('acronym', 'protocolSection.identificationModule.acronym', 'Unknown'),
+    FieldMapping('overallStatus', f'{STATUS}.overallStatus', 'Unknown'),
+    FieldMapping('startDate', f'{STATUS}.startDateStruct.date', 'Unknown Date'),
+    FieldMapping('conditions', 'protocolSection.conditionsModule.conditions', 'No conditions listed', join=', ',
+                 value_type=List[str], empty_default=False),
+    FieldMapping('interventions', 'protocolSection.armsInterventionsModule.interventions', 'No interventions listed',
+                 join=', ', item='{name}', item_defaults={'name': 'No intervention name listed'}),
+    FieldMapping('locations', 'protocolSection.contactsLocationsModule.locations', 'No locations listed',
+                 join=', ', item='{city} - {country}', item_defaults={'city': 'No City', 'country': 'No Country'}),
+    FieldMapping('primaryCompletionDate', f'{STATUS}.primaryCompletionDateStruct.date', 'Unknown Date'),
+    FieldMapping('studyFirstPostDate', f'{STATUS}.studyFirstPostDateStruct.date', 'Unknown Date'),
+    FieldMapping('lastUpdatePostDate', f'{STATUS}.lastUpdatePostDateStruct.date', 'Unknown Date'),
+    FieldMapping('studyType', 'protocolSection.designModule.studyType', 'Unknown'),
+    FieldMapping('phases', 'protocolSection.designModule.phases', 'Not Available', join=', ', value_type=List[str],
+                 empty_default=False),
+    FieldMapping('eligibilityCriteria', f'{ELIGIBILITY}.eligibilityCriteria', 'Unknown'),
+    FieldMapping('sex', f'{ELIGIBILITY}.sex', 'Unknown'),
+    FieldMapping('minimumAge', f'{ELIGIBILITY}.minimumAge', '0 Year'),
+    FieldMapping('maximumAge', f'{ELIGIBILITY}.maximumAge', '120 Years'),
+    FieldMapping('stdAges', f'{ELIGIBILITY}.stdAges', 'Unknown', join=', ', value_type=List[str],
+                 empty_default=False),
+]
+
+STUDIES_TABLE = 'studies'
+
+# Lists of a study loaded one row per item, keyed by nct_id, next to their joined string in studies
+CHILD_TABLES = [
+    ChildTable('study_locations', 'protocolSection.contactsLocationsModule.locations',
+               columns={'facility': 'facility', 'city': 'city', 'state': 'state', 'country': 'country',
+                        'latitude': 'geoPoint.lat', 'longitude': 'geoPoint.lon'},
+               column_types={'latitude': float, 'longitude': float}),
+    ChildTable('study_interventions', 'protocolSection.armsInterventionsModule.interventions',
+               columns={'intervention_type': 'type', 'name': 'name'}),
+    ChildTable('study_conditions', 'protocolSection.conditionsModule.conditions', value_column='condition'),
+    ChildTable('study_phases', 'protocolSection.designModule.phases', value_column='phase'),
+]
+
+# Every API field the transform reads; sent as the `fields` projection so the API omits the rest
+# (resultsSection, derivedSection, documentSection, ...)
+STUDY_FIELDS = tuple(study_fields(STUDY_MAPPING, CHILD_TABLES))
+
+# flatten_study(study) -> dict: flattens a single raw study record from the API into a studies row
+flatten_study = compile_flattener(STUDY_MAPPING)
+
+# flatten_columns(studies) -> dict of lists: flattens a page of raw studies column by column
+flatten_columns = compile_column_flattener(STUDY_MAPPING)
+
+# Every mapped column is a string once joined
+MAPPED_SCHEMA = pa.schema([pa.field(mapping.column, pa.string()) for mapping in STUDY_MAPPING])
+
+# Normalized age column -> (age column, use the upper bound of ranges, years of an 'N/A' age).
+# An age that does not apply is no limit, like a missing one, so it takes the years of the mapping's default
+MAPPING_DEFAULTS = {mapping.column: mapping.default for mapping in STUDY_MAPPING}
+NORMALIZED_AGES = {
+    'normalized_minimumAge': ('minimumAge', False, age_in_years(MAPPING_DEFAULTS['minimumAge'])),
+    'normalized_maximumAge': ('maximumAge', True, age_in_years(MAPPING_DEFAULTS['maximumAge'], upper=True)),
+}
+
+# Date columns loaded as DATE -> column flagging the precision ('day', 'month' or 'year') of partial dates,
+# None for the dates the API always reports to the day
+DATE_COLUMNS = {
+    'startDate': 'startDatePrecision',
+    'primaryCompletionDate': 'primaryCompletionDatePrecision',
+    'studyFirstPostDate': None,
+    'lastUpdatePostDate': None,
+}
+
+# Low-cardinality columns of each table (statuses, types, phases and their combinations): dictionary-encoded
+# in the record batches and stored as ENUM columns, see `DataPipeline.enum_columns`
+CATEGORICAL_COLUMNS = {
+    STUDIES_TABLE: ('overallStatus', 'studyType', 'sex', 'phases', 'stdAges'),
+    'study_interventions': ('intervention_type',),
+    'study_phases': ('phase',),
+}
+CATEGORY_TYPE = pa.dictionary(pa.int32(), pa.string())
+
+def categorical_schema(table, fields):
+    """Schema of `table` made of `fields`, with its CATEGORICAL_COLUMNS dictionary-encoded."""
+    categorical = CATEGORICAL_COLUMNS.get(table, ())
+    return pa.schema([field.with_type(CATEGORY_TYPE) if field.name in categorical else field for field in fields])
+
+STUDY_SCHEMA = categorical_schema(
+    STUDIES_TABLE,
+    [field.with_type(pa.date32()) if field.name in DATE_COLUMNS else field for field in MAPPED_SCHEMA]
+    + [pa.field(column, pa.float64()) for column in NORMALIZED_AGES]
+    + [pa.field(precision_column, pa.string()) for precision_column in DATE_COLUMNS.values() if precision_column]
+)
+
+ARROW_TYPES = {str: pa.string(), float: pa.float64()}
+
+# child table -> (flatten_<table>(studies, nct_ids) -> dict of lists, schema of the child table)
+CHILD_FLATTENERS = {
+    child_table.table: (
+        compile_child_flattener(child_table),
+        categorical_schema(
+            child_table.table,
+            [pa.field('nct_id', pa.string())]
+            + ([pa.field(child_table.value_column, pa.string())] if child_table.value_column else [])
+            + [pa.field(column, ARROW_TYPES[value_type]) for column, (_, value_type) in child_table.item_paths.items()]
+        )
+    )
+    for child_table in CHILD_TABLES
+}
+
+# table -> schema of its record batches
+TABLE_SCHEMAS = {STUDIES_TABLE: STUDY_SCHEMA, **{table: schema for table, (_, schema) in CHILD_FLATTENERS.items()}}
+
+
+def studies_record_batch(studies):
+    """
+    Flatten raw studies into an Arrow record batch with the STUDY_SCHEMA columns: ages normalized
+    to years, dates parsed into DATE columns and categorical columns dictionary-encoded.
+
+    Args:
+        studies (list): Raw study records as returned by the API.
+
+    Returns:
+        pyarrow.RecordBatch: One row per study.
+    """
+    batch = pa.RecordBatch.from_pydict(flatten_columns(studies), schema=MAPPED_SCHEMA)
+    columns = dict(zip(batch.schema.names, batch.columns))
+    for column, (age_column, upper, not_applicable) in NORMALIZED_AGES.items():
+        columns[column] = normalize_age_column(batch.column(age_column), upper, not_applicable)
+    for column, precision_column in DATE_COLUMNS.items():
+        columns[column], precisions = normalize_date_column(batch.column(column))
+        if precision_column:
+            columns[precision_column] = precisions
+    for column in CATEGORICAL_COLUMNS[STUDIES_TABLE]:
+        columns[column] = pc.dictionary_encode(columns[column])
+    return pa.RecordBatch.from_arrays([columns[name] for name in STUDY_SCHEMA.names], schema=STUDY_SCHEMA)
+
+
+def study_tables(studies):
+    """
+    Transform raw studies into the record batches of the studies table and of every child table.
+
+    Returns:
+        list: (table name, pyarrow.RecordBatch) pairs, the studies table first.
+    """
+    studies_batch = studies_record_batch(studies)
+    tables = [(STUDIES_TABLE, studies_batch)]
+    nct_ids = studies_batch.column('nctId').to_pylist()
+    for table, (flatten_child, schema) in CHILD_FLATTENERS.items():
+        tables.append((table, pa.RecordBatch.from_pydict(flatten_child(studies, nct_ids), schema=schema)))
+    return tables
+
+
+def transform_pages(pages):
+    """
+    Flatten and age-normalize API pages one at a time.
+
+    Only the page currently being processed is held in memory, so the cost of the
+    transform does not grow with the number of studies in the registry. Each page is kept
+    columnar, as Arrow record batches, so no per-study dict is built on the way to the load.
+
+    Args:
+        pages (iterable): Iterable of raw API pages (dicts with a 'studies' list).
+
+    Yields:
+        tuple: (table name, pyarrow.RecordBatch) of the flattened and age-normalized studies of each page,
+            followed by the rows of each child table.
+    """
+    for page in pages:
+        yield from study_tables(page.get('studies', []))
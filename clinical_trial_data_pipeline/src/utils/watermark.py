@@ -0,0 +1,39 @@
+# src/utils/watermark.py
+import re
+
+# lastUpdatePostDate is always a full ISO date in the API; anything else (e.g. 'Unknown Date') is ignored
+ISO_DATE_PATTERN = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+
+class Watermark:
+    def __init__(self, name, value=None):
+        """
+        Track the highest value of a date field seen while extracting studies.
+
+        Args:
+            name (str): The watermark name as stored in the extraction_watermarks table.
+            value (str): The watermark persisted by the previous run, if any (ISO date).
+        """
+        self.name = name
+        self.previous_value = value
+        self.value = value
+
+    def observe(self, dates):
+        """Advance the watermark to the highest ISO date in `dates`."""
+        for date in dates:
+            if date and ISO_DATE_PATTERN.match(date) and (self.value is None or date > self.value):
+                self.value = date
+
+    def advanced_filter(self, area):
+        """
+        Build the API `filter.advanced` expression selecting studies updated since the previous run.
+
+        The previous date is included, as studies updated later that same day were not seen yet;
+        re-fetched studies are de-duplicated by the merge on nctId.
+        """
+        if self.previous_value is None:
+            return None
+        return f'AREA[{area}]RANGE[{self.previous_value},MAX]'
+
+    @property
+    def advanced(self):
+        return self.value is not None and self.value != self.previous_value